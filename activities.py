@@ -0,0 +1,178 @@
+"""
+Нечёткий поиск вида тренировки в таблице MET (activities.tsv, Compendium of Physical Activities).
+
+    activities.match("бег трусцой")      -> Activity("бег трусцой", 7.0)
+    activities.match("велик")            -> Activity("велосипед", 7.5)
+    activities.match("плавание кролем")  -> Activity("плавание", 8.0)
+
+Таблица читается один раз при импорте; для каждого слова названий заранее строятся
+триграммы, а индекс «триграмма -> слова -> названия» отбирает кандидатов,
+так что сравниваются только названия с общими кусками слов.
+Слово запроса совпадает со словом названия по началу основы («бегал» — «бег»), общему корню
+(«плавала» — «плавание») или по доле общих триграмм (опечатки: «вилосипед»).
+
+    python activities.py бег трусцой
+"""
+import os
+import re
+import sys
+import time
+from functools import lru_cache
+
+from food_log import stem
+
+ACTIVITIES_PATH = os.getenv("ACTIVITIES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "activities.tsv"))
+# MET, если вид тренировки не узнали: средняя нагрузка
+DEFAULT_MET = 6.0
+# слова с такой долей общих триграмм считаются одним словом с опечаткой
+WORD_SIMILARITY = 0.5
+# ниже этой оценки совпадение не засчитывается
+MIN_SCORE = 0.6
+# слова с общим началом такой длины — формы одного слова («плавала» — «плавание»)
+SAME_ROOT = 4
+# служебные слова запроса не обязаны совпадать: «катался на роликах» — это «ролики»
+FILLER = frozenset((
+    "в", "во", "на", "с", "со", "по", "до", "и", "для", "к", "от", "за", "у", "из", "час", "мин", "минут",
+    "занимался", "занималась", "заниматься", "катался", "каталась", "кататься",
+    "играл", "играла", "играть", "делал", "делала", "ходил", "ходила",
+))
+
+WORD = re.compile(r"[a-zа-я0-9]+(?:[.,][0-9]+)?")
+
+
+class Activity:
+    __slots__ = ("name", "met")
+
+    def __init__(self, name: str, met: float):
+        self.name = name
+        self.met = met
+
+    def __repr__(self):
+        return f"Activity({self.name!r}, {self.met})"
+
+
+def words_of(text: str) -> tuple:
+    return tuple(WORD.findall(text.lower().replace("ё", "е")))
+
+
+def trigrams(word: str) -> frozenset:
+    padded = f" {word} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _similar(a: frozenset, b: frozenset) -> float:
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+class ActivityIndex:
+    def __init__(self, rows):
+        self.activities = []    # Activity по номеру строки таблицы
+        self.names = []         # (слова названия, номер Activity)
+        self.exact = {}         # слова названия -> номер Activity
+        self.words = {}         # слово -> (триграммы, номера названий)
+        self.by_trigram = {}    # триграмма -> слова
+        for met, names in rows:
+            activity_id = len(self.activities)
+            self.activities.append(Activity(names[0], met))
+            for name in names:
+                key = words_of(name)
+                if key in self.exact:
+                    raise ValueError(f"Название «{name}» встречается в таблице дважды")
+                self.exact[key] = activity_id
+                self.names.append((key, activity_id))
+        for name_id, (key, _) in enumerate(self.names):
+            for word in key:
+                entry = self.words.get(word)
+                if entry is None:
+                    entry = self.words[word] = (trigrams(word), [])
+                    for gram in entry[0]:
+                        self.by_trigram.setdefault(gram, []).append(word)
+                entry[1].append(name_id)
+
+    @classmethod
+    def load(cls, path: str = ACTIVITIES_PATH) -> "ActivityIndex":
+        rows = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                met, names = line.split("\t")
+                rows.append((float(met), names.split("|")))
+        return cls(rows)
+
+    def _word_score(self, query_word: str, base: str, query_grams: frozenset, word: str) -> float:
+        if word.startswith(base) or (len(word) >= 3 and query_word.startswith(word)):
+            return 1.0
+        similarity = _similar(query_grams, self.words[word][0])
+        root = len(os.path.commonprefix((query_word, word)))
+        if root >= SAME_ROOT:
+            # чем длиннее общее начало, тем ближе: «велотренажор» — «велотренажер», а не «велосипед»
+            similarity = max(similarity, 0.7 + 0.3 * root / max(len(query_word), len(word)))
+        return similarity if similarity >= WORD_SIMILARITY else 0.0
+
+    def search(self, text: str, limit: int = 5) -> list:
+        """[(оценка, Activity), ...] лучшие первыми"""
+        query = words_of(text)
+        if not query:
+            return []
+        exact = self.exact.get(query)
+        if exact is not None:
+            return [(1.0, self.activities[exact])]
+        query = tuple(w for w in query if w not in FILLER) or query
+
+        # слово запроса -> {слово таблицы: похожесть}
+        matched = []
+        candidates = set()
+        for query_word in query:
+            grams = trigrams(query_word)
+            base = stem(query_word)
+            scores = {}
+            for word in {w for gram in grams for w in self.by_trigram.get(gram, ())}:
+                score = self._word_score(query_word, base, grams, word)
+                if score:
+                    scores[word] = score
+                    candidates.update(self.words[word][1])
+            matched.append(scores)
+
+        best = {}
+        for name_id in candidates:
+            key, activity_id = self.names[name_id]
+            # сколько запроса покрыто названием и сколько названия — запросом:
+            # на «бег» «бег» лучше, чем «бег трусцой»
+            coverage = sum(max((scores.get(w, 0) for w in key), default=0) for scores in matched) / len(query)
+            precision = sum(max(scores.get(w, 0) for scores in matched) for w in key) / len(key)
+            score = 0.7 * coverage + 0.3 * precision
+            if score >= MIN_SCORE and score > best.get(activity_id, 0):
+                best[activity_id] = score
+        ranked = sorted(best.items(), key=lambda item: -item[1])
+        return [(score, self.activities[activity_id]) for activity_id, score in ranked[:limit]]
+
+
+_index = ActivityIndex.load()
+
+
+@lru_cache(maxsize=4096)
+def match(text: str):
+    """Activity или None, если ничего похожего в таблице нет"""
+    found = _index.search(text, limit=1)
+    return found[0][1] if found else None
+
+
+def main():
+    query = " ".join(sys.argv[1:])
+    if not query:
+        print("python activities.py <тренировка>")
+        return
+    started = time.perf_counter()
+    found = _index.search(query)
+    elapsed = time.perf_counter() - started
+    for score, activity in found:
+        print(f"{score:.2f}  {activity.met:>5}  {activity.name}")
+    if not found:
+        print(f"не найдено, MET {DEFAULT_MET}")
+    print(f"{len(_index.activities)} видов, {len(_index.names)} названий, поиск {elapsed * 1e6:.0f} мкс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import os
+import asyncio
+import logging
+import signal
+from aiogram import Bot, Dispatcher, BaseMiddleware
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import setup_application
+from aiohttp import web
+from handlers import router
+from fsm_storage import make_fsm_storage, count_active
+from update_queue import UpdateQueue
+import storage
+from storage import start_writer, stop_writer, store, users
+import metrics
+import food_api
+import weather_api
+import inline_search
+import plots
+import goals
+import reminders
+import outbound
+
+# DEBUG на нашей нагрузке сам по себе дорогой; для отладки LOG_LEVEL=DEBUG
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"), force=True)
+logger = logging.getLogger(__name__)
+
+logger.info("Старт приложения")
+logger.info(f"PORT из env: {os.environ.get('PORT', 'не задан')}")
+logger.info(f"BOT_TOKEN: {'задан' if os.environ.get('BOT_TOKEN') else 'НЕ ЗАДАН'}")
+logger.info(f"BUCKET_NAME: {os.environ.get('BUCKET_NAME', 'не задан')}")
+
+BOT_TOKEN = os.environ.get("BOT_TOKEN")
+if not BOT_TOKEN:
+    logger.critical("BOT_TOKEN не задан!")
+    raise ValueError("BOT_TOKEN is required")
+
+WEBHOOK_PATH = "/webhook"
+# в cluster.py webhook ставит только один воркер
+SET_WEBHOOK = os.environ.get("SET_WEBHOOK", "1") == "1"
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+if not WEBHOOK_URL:
+    logger.critical("WEBHOOK_URL не задан!")
+    raise ValueError("WEBHOOK_URL is required")
+
+# свой Bot API сервер (локальный telegram-bot-api или заглушка в benchmark.py)
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL")
+if TELEGRAM_API_URL:
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=BOT_TOKEN)
+# все исходящие запросы — через лимиты Telegram и повтор после RetryAfter
+send_limiter = outbound.SendLimiter()
+bot.session.middleware(send_limiter)
+dp = Dispatcher(storage=make_fsm_storage())
+class UserLoaderMiddleware(BaseMiddleware):
+    """Подгружает запись пользователя из хранилища до того, как хендлер к ней обратится"""
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None:
+            await storage.ensure_loaded(str(user.id))
+        return await handler(event, data)
+
+
+dp.update.outer_middleware(UserLoaderMiddleware())
+router.message.middleware(metrics.HandlerTimingMiddleware())
+router.callback_query.middleware(metrics.HandlerTimingMiddleware())
+router.inline_query.middleware(metrics.HandlerTimingMiddleware())
+dp.include_router(router)
+updates = UpdateQueue(dp, bot)
+
+metrics.Gauge("bot_users", "Пользователей в памяти процесса", lambda: len(users))
+metrics.Gauge("bot_storage_loaded_bytes", "Размер в хранилище загруженных пользователей и журнала",
+              lambda: store.loaded_bytes)
+metrics.CounterFunc("bot_storage_bytes_written_total", "Сколько байт записано в хранилище с запуска",
+                    lambda: store.bytes_written)
+metrics.Gauge("bot_fsm_active_conversations", "Незаконченные диалоги", lambda: count_active(dp.storage))
+metrics.Gauge("bot_update_queue_depth", "Апдейтов в очереди", lambda: updates.depth)
+metrics.CounterFunc("bot_updates_dropped_total", "Апдейтов отброшено из-за переполнения очереди", lambda: updates.dropped)
+metrics.Gauge("bot_send_waiting", "Исходящих запросов ждут общего лимита", lambda: send_limiter.waiting)
+metrics.Gauge("bot_reminder_subscribers", "Подписчиков на напоминания о воде", reminders.count)
+metrics.CounterFunc("bot_food_cache_hits_total", "Попадания в кэш поиска еды", lambda: food_api.cache_stats()["hits"])
+metrics.CounterFunc("bot_food_cache_misses_total", "Промахи кэша поиска еды", lambda: food_api.cache_stats()["misses"])
+metrics.CounterFunc("bot_weather_cache_hits_total", "Попадания в кэш погоды", lambda: weather_api.cache_stats()["hits"])
+metrics.CounterFunc("bot_weather_cache_misses_total", "Промахи кэша погоды", lambda: weather_api.cache_stats()["misses"])
+metrics.Gauge("bot_inline_cache_size", "Запросов в кэше inline-поиска", lambda: inline_search.cache_stats()["size"])
+
+async def on_startup():
+    # процессы рисования поднимаются до /ready и до приёма апдейтов, а не под первой нагрузкой
+    await asyncio.get_running_loop().run_in_executor(None, plots.warm_up)
+    # воркеры очереди стартуют только после прогрева: апдейты, пришедшие раньше, ждут в очереди
+    await storage.warm_up()
+    start_writer()
+    updates.start()
+    goals.start_scheduler()
+    await reminders.start(bot)
+    if not SET_WEBHOOK:
+        return
+
+    desired_url = f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}"  # убираем лишний слеш если был
+    logger.info("Пытаюсь установить/проверить webhook: %s", desired_url)
+    
+    try:
+        current = await bot.get_webhook_info()
+        
+        if current.url == desired_url:
+            logger.info("Webhook уже стоит правильно, пропускаем")
+            return
+        
+        logger.info("Текущий webhook: %s → ставим новый", current.url)
+        # RetryAfter повторяет outbound.SendLimiter
+        await bot.set_webhook(url=desired_url)
+        logger.info("Webhook успешно установлен!")
+        
+    except Exception as e:
+        logger.exception("Ошибка установки webhook: %s", e)
+
+async def on_shutdown():
+    # дообрабатываем очередь и сбрасываем все несохранённые изменения
+    await updates.stop()
+    await goals.stop_scheduler()
+    await reminders.stop()
+    await stop_writer()
+    await food_api.close_session()
+    await weather_api.close_session()
+    plots.shutdown_pool()
+
+async def ready_handler(request):
+    # 200 только после прогрева: балансировщик не шлёт трафик на ещё не готовый инстанс
+    if storage.ready:
+        return web.json_response({"ready": True})
+    return web.json_response({"ready": False}, status=503)
+
+async def main():
+    app = web.Application()
+
+    # апдейт сразу ставится в очередь, вебхук не ждёт обработки
+    app.router.add_post(WEBHOOK_PATH, updates.handle)
+    app.router.add_get("/metrics", metrics.handle)
+    app.router.add_get("/ready", ready_handler)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+
+    port = int(os.environ.get("PORT", 8080))
+    site = web.TCPSite(runner, "0.0.0.0", port)
+    await site.start()
+
+    logger.info(f"Сервер запущен на порту {port}")
+
+    await on_startup()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await stop.wait()
+    finally:
+        # сначала перестаём принимать апдейты, потом дообрабатываем очередь и сохраняем всё,
+        # и только потом runner.cleanup: его хуки (setup_application) закрывают FSM-хранилище,
+        # которое ещё нужно апдейтам из очереди
+        await site.stop()
+        await on_shutdown()
+        await runner.cleanup()
+        await bot.session.close()
@@ -0,0 +1,460 @@
+"""
+Нагрузочный тест бота целиком: поднимает заглушки Telegram Bot API, OpenFoodFacts,
+OpenWeather и S3, запускает bot.py и шлёт в /webhook синтетические апдейты
+(полные сценарии /set_profile, /log_water, /log_food, /log_workout,
+/check_progress, /history, /plot).
+
+Задержка команды — от POST апдейта до ответа бота в заглушку Bot API.
+
+    python benchmark.py --users 200
+    python benchmark.py --users 200 --save-baseline       # записать bench_baseline.json
+    python benchmark.py --users 200 --baseline bench_baseline.json   # сравнить, код 1 при регрессии
+"""
+import os
+import sys
+import json
+import time
+import random
+import math
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+from xml.sax.saxutils import escape
+
+import aiohttp
+from aiohttp import web
+
+BOT_TOKEN = "123456:benchmark"
+BASELINE_PATH = "bench_baseline.json"
+FOODS = ["гречка", "банан", "курица", "рис", "яблоко", "творог", "овсянка", "яйцо"]
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Сочи"]
+WORKOUTS = ["бег", "йога", "плавание", "велосипед", "ходьба"]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# =========================
+# Заглушка Telegram Bot API
+# =========================
+class FakeBotAPI:
+    def __init__(self):
+        self._replies = defaultdict(asyncio.Queue)
+        self.calls = defaultdict(int)
+        self._message_id = 0
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        form = dict(await request.post()) if request.can_read_body else {}
+        if method == "getWebhookInfo":
+            result = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        elif method in ("sendMessage", "sendPhoto", "sendDocument"):
+            chat_id = int(form["chat_id"])
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": str(form.get("text") or form.get("caption") or ""),
+            }
+            self._replies[chat_id].put_nowait((time.perf_counter(), method))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def drain(self, chat_id: int):
+        queue = self._replies[chat_id]
+        while not queue.empty():
+            queue.get_nowait()
+
+    async def wait_reply(self, chat_id: int, timeout: float):
+        return await asyncio.wait_for(self._replies[chat_id].get(), timeout)
+
+    def routes(self, app):
+        app.router.add_post("/bot{token}/{method}", self.handle)
+
+
+# =========================
+# Заглушки OpenFoodFacts и OpenWeather
+# =========================
+class FakeUpstreams:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.food_calls = 0
+        self.weather_calls = 0
+
+    async def _delay(self):
+        if self.latency:
+            # разброс как у настоящих API: обычно быстро, иногда долго
+            await asyncio.sleep(random.expovariate(1 / self.latency))
+
+    async def food(self, request):
+        self.food_calls += 1
+        await self._delay()
+        term = request.query.get("search_terms", "")
+        size = int(request.query.get("page_size", 5))
+        products = [
+            {"product_name": f"{term} {i + 1}", "nutriments": {"energy-kcal_100g": 100 + 10 * i}}
+            for i in range(size)
+        ]
+        return web.json_response({"products": products})
+
+    async def weather(self, request):
+        self.weather_calls += 1
+        await self._delay()
+        return web.json_response({"cod": 200, "main": {"temp": 20 + len(request.query.get("q", "")) % 15}})
+
+    def routes(self, app):
+        app.router.add_get("/cgi/search.pl", self.food)
+        app.router.add_get("/data/2.5/weather", self.weather)
+
+
+# =========================
+# Заглушка S3 (path-style: /<bucket>/<key>)
+# =========================
+def _decode_aws_chunked(body: bytes) -> bytes:
+    out = bytearray()
+    pos = 0
+    while True:
+        line_end = body.index(b"\r\n", pos)
+        size = int(body[pos:line_end].split(b";")[0], 16)
+        if size == 0:
+            return bytes(out)
+        start = line_end + 2
+        out += body[start:start + size]
+        pos = start + size + 2
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.bytes_written = 0
+        self.puts = 0
+        self.gets = 0
+
+    async def obj(self, request):
+        key = request.match_info["key"]
+        if request.method == "PUT":
+            body = await request.read()
+            if "aws-chunked" in request.headers.get("Content-Encoding", "") \
+                    or "x-amz-decoded-content-length" in request.headers:
+                body = _decode_aws_chunked(body)
+            self.objects[key] = body
+            self.bytes_written += len(body)
+            self.puts += 1
+            return web.Response(headers={"ETag": '"bench"'})
+        if request.method == "DELETE":
+            self.objects.pop(key, None)
+            return web.Response(status=204)
+        self.gets += 1
+        if key not in self.objects:
+            return web.Response(
+                status=404, content_type="application/xml",
+                text="<Error><Code>NoSuchKey</Code><Message>not found</Message></Error>",
+            )
+        return web.Response(body=self.objects[key], content_type="application/octet-stream")
+
+    async def list(self, request):
+        prefix = request.query.get("prefix", "")
+        keys = sorted(k for k in self.objects if k.startswith(prefix))
+        contents = "".join(
+            f"<Contents><Key>{escape(k)}</Key><Size>{len(self.objects[k])}</Size></Contents>"
+            for k in keys
+        )
+        xml = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Name>{request.match_info['bucket']}</Name><Prefix>{escape(prefix)}</Prefix>"
+            f"<KeyCount>{len(keys)}</KeyCount><MaxKeys>100000</MaxKeys>"
+            f"<IsTruncated>false</IsTruncated>{contents}</ListBucketResult>"
+        )
+        return web.Response(text=xml, content_type="application/xml")
+
+    def routes(self, app):
+        app.router.add_get("/{bucket}", self.list)
+        app.router.add_get("/{bucket}/", self.list)
+        app.router.add_route("*", "/{bucket}/{key:.+}", self.obj)
+
+
+# =========================
+# Синтетические апдейты
+# =========================
+class UpdateFactory:
+    def __init__(self):
+        self._update_id = 0
+        self._message_id = 0
+
+    def _next(self):
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    def message(self, uid: int, text: str) -> dict:
+        update_id, message_id = self._next()
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": {"id": uid, "is_bot": False, "first_name": f"user{uid}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": message}
+
+    def callback(self, uid: int, data: str) -> dict:
+        update_id, message_id = self._next()
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": {"id": uid, "is_bot": False, "first_name": f"user{uid}"},
+                "chat_instance": str(uid),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": uid, "type": "private"},
+                    "text": "Выберите продукт:",
+                },
+            },
+        }
+
+
+def scenario(uid: int, rnd: random.Random):
+    """Шаги одного пользователя: (команда для отчёта, тип, текст/данные)"""
+    steps = [("/start", "message", "/start")]
+    for text in ["/set_profile", rnd.choice(["муж", "жен"]), str(rnd.randint(50, 110)),
+                 str(rnd.randint(150, 200)), str(rnd.randint(18, 70)), str(rnd.randint(0, 120)),
+                 rnd.choice(CITIES)]:
+        steps.append(("/set_profile", "message", text))
+    for _ in range(rnd.randint(1, 3)):
+        steps += [("/log_water", "message", "/log_water"),
+                  ("/log_water", "message", str(rnd.choice([200, 250, 330, 500])))]
+    steps += [("/log_food", "message", "/log_food"),
+              ("/log_food", "message", rnd.choice(FOODS)),
+              ("/log_food", "callback", str(rnd.randint(0, 4))),
+              ("/log_food", "message", str(rnd.randint(50, 300)))]
+    steps += [("/log_workout", "message", "/log_workout"),
+              ("/log_workout", "message", rnd.choice(WORKOUTS)),
+              ("/log_workout", "message", str(rnd.randint(15, 90)))]
+    steps += [("/check_progress", "message", "/check_progress"),
+              ("/history", "message", "/history"),
+              ("/plot", "message", f"/plot {rnd.choice(['water', 'calories', 'burned'])}")]
+    # быстрая запись нескольких продуктов одним сообщением (последней: может оставить кнопки уточнения)
+    items = ", ".join(f"{rnd.randint(50, 300)} {food}" for food in rnd.sample(FOODS, 3))
+    steps.append(("/log_food [список]", "message", f"/log_food {items}"))
+    return steps
+
+
+# =========================
+# Прогон
+# =========================
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    # nearest-rank
+    index = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.telegram = FakeBotAPI()
+        self.upstreams = FakeUpstreams(args.upstream_latency / 1000)
+        self.s3 = FakeS3()
+        self.factory = UpdateFactory()
+        self.latencies = defaultdict(list)
+        self.timeouts = defaultdict(int)
+        self.sent = 0
+
+    async def _start_fakes(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        # порядок важен: маршруты S3 (/<bucket>/<key>) самые общие и идут последними
+        self.telegram.routes(app)
+        self.upstreams.routes(app)
+        self.s3.routes(app)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        self.fake_port = free_port()
+        await web.TCPSite(self._runner, "127.0.0.1", self.fake_port).start()
+
+    def _bot_env(self, workdir: str) -> dict:
+        base = f"http://127.0.0.1:{self.fake_port}"
+        env = dict(os.environ)
+        env.update({
+            "BOT_TOKEN": BOT_TOKEN,
+            "WEBHOOK_URL": f"http://127.0.0.1:{self.bot_port}",
+            "PORT": str(self.bot_port),
+            "TELEGRAM_API_URL": base,
+            "OFF_SEARCH_URL": f"{base}/cgi/search.pl",
+            "OPENWEATHER_URL": f"{base}/data/2.5/weather",
+            "OPENWEATHER_API_KEY": "bench",
+            "STORAGE_BACKEND": "s3",
+            "S3_ENDPOINT_URL": base,
+            "BUCKET_NAME": "bench",
+            "YC_ACCESS_KEY_ID": "bench",
+            "YC_SECRET_ACCESS_KEY": "bench",
+            "FOOD_SOURCE": "remote",
+            "FSM_DB_PATH": os.path.join(workdir, "fsm.db"),
+            # меряем бота, а не лимиты Telegram: заглушка Bot API частоту не ограничивает
+            "SEND_RATE": "0",
+            "SEND_CHAT_RATE": "0",
+            "SEND_GROUP_RATE": "0",
+        })
+        return env
+
+    async def _start_bot(self, workdir: str):
+        self.bot_port = free_port()
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+        self._log = open(os.path.join(workdir, "bot.log"), "wb")
+        self.bot = await asyncio.create_subprocess_exec(
+            sys.executable, script, env=self._bot_env(workdir),
+            stdout=self._log, stderr=self._log,
+        )
+        # ждём, пока бот начнёт принимать соединения
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self.bot.returncode is not None:
+                raise RuntimeError(f"bot.py упал при старте, лог: {self._log.name}")
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", self.bot_port)
+                writer.close()
+                return
+            except OSError:
+                await asyncio.sleep(0.2)
+        raise RuntimeError("bot.py не поднялся за 60 с")
+
+    async def _stop_bot(self):
+        if self.bot.returncode is None:
+            self.bot.send_signal(signal.SIGTERM)
+            await asyncio.wait_for(self.bot.wait(), 60)
+        self._log.close()
+
+    async def _run_user(self, session, uid: int):
+        rnd = random.Random(uid)
+        url = f"http://127.0.0.1:{self.bot_port}/webhook"
+        for command, kind, payload in scenario(uid, rnd):
+            update = self.factory.message(uid, payload) if kind == "message" else self.factory.callback(uid, payload)
+            self.telegram.drain(uid)
+            started = time.perf_counter()
+            async with session.post(url, json=update) as resp:
+                await resp.read()
+            self.sent += 1
+            try:
+                replied, _ = await self.telegram.wait_reply(uid, self.args.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts[command] += 1
+                continue
+            self.latencies[command].append((replied - started) * 1000)
+
+    async def run(self) -> dict:
+        await self._start_fakes()
+        with tempfile.TemporaryDirectory() as workdir:
+            await self._start_bot(workdir)
+            try:
+                sem = asyncio.Semaphore(self.args.concurrency)
+                connector = aiohttp.TCPConnector(limit=self.args.concurrency)
+                async with aiohttp.ClientSession(connector=connector) as session:
+                    async def one(uid):
+                        async with sem:
+                            await self._run_user(session, uid)
+                    started = time.perf_counter()
+                    await asyncio.gather(*(one(100000 + i) for i in range(self.args.users)))
+                    elapsed = time.perf_counter() - started
+                bytes_during_run = self.s3.bytes_written
+            finally:
+                await self._stop_bot()
+        await self._runner.cleanup()
+
+        commands = {}
+        for command, values in sorted(self.latencies.items()):
+            commands[command] = {
+                "count": len(values),
+                "timeouts": self.timeouts.get(command, 0),
+                "p50_ms": round(percentile(values, 50), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "p99_ms": round(percentile(values, 99), 2),
+            }
+        return {
+            "users": self.args.users,
+            "updates": self.sent,
+            "seconds": round(elapsed, 3),
+            "throughput_ups": round(self.sent / elapsed, 1),
+            "storage_bytes_during_run": bytes_during_run,
+            "storage_bytes_total": self.s3.bytes_written,
+            "storage_puts": self.s3.puts,
+            "upstream_food_calls": self.upstreams.food_calls,
+            "upstream_weather_calls": self.upstreams.weather_calls,
+            "commands": commands,
+        }
+
+
+def print_report(result: dict):
+    print(f"Пользователей: {result['users']}, апдейтов: {result['updates']}, "
+          f"время: {result['seconds']} с, {result['throughput_ups']} апдейтов/с")
+    print(f"Записано в хранилище: {result['storage_bytes_during_run']} байт за прогон, "
+          f"{result['storage_bytes_total']} с финальным сохранением ({result['storage_puts']} PUT)")
+    print(f"Запросов к API: еда {result['upstream_food_calls']}, погода {result['upstream_weather_calls']}")
+    print(f"{'команда':<16}{'n':>7}{'timeout':>9}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for command, row in result["commands"].items():
+        print(f"{command:<16}{row['count']:>7}{row['timeouts']:>9}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Список регрессий относительно baseline"""
+    problems = []
+    if result["throughput_ups"] < baseline["throughput_ups"] * (1 - tolerance):
+        problems.append(f"throughput {result['throughput_ups']} < {baseline['throughput_ups']}")
+    if result["storage_bytes_during_run"] > baseline["storage_bytes_during_run"] * (1 + tolerance):
+        problems.append(f"storage bytes {result['storage_bytes_during_run']} > {baseline['storage_bytes_during_run']}")
+    for command, row in result["commands"].items():
+        base = baseline["commands"].get(command)
+        if base and row["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            problems.append(f"{command} p95 {row['p95_ms']} мс > {base['p95_ms']} мс")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота через /webhook")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=100, help="сколько пользователей одновременно")
+    parser.add_argument("--upstream-latency", type=float, default=50, help="средняя задержка заглушек API, мс")
+    parser.add_argument("--timeout", type=float, default=30, help="сколько ждать ответ бота, с")
+    parser.add_argument("--json", help="записать результат в файл")
+    parser.add_argument("--baseline", help="сравнить с baseline-файлом")
+    parser.add_argument("--save-baseline", action="store_true", help=f"записать результат в {BASELINE_PATH}")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+
+    result = asyncio.run(Benchmark(args).run())
+    print_report(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Baseline записан в {BASELINE_PATH}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(result, json.load(f), args.tolerance)
+        for problem in problems:
+            print("РЕГРЕССИЯ:", problem)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def calculate_water_goal(weight, activity_minutes, temp):
     water = weight * 30  # базовая норма мл
     water += (activity_minutes // 30) * 500  # +500 мл за каждые 30 мин активности
@@ -31,3 +34,24 @@ def calculate_calorie_goal(weight, height, age, activity_minutes, sex="male"):
         pal = 1.9
 
     return bmr * pal
+
+
+# =========================
+# Векторные версии для пакетного пересчёта целей (goals.py)
+# =========================
+PAL_BOUNDS = (30, 60, 90, 120)
+PAL_VALUES = (1.2, 1.375, 1.55, 1.725, 1.9)
+
+
+def calculate_water_goals(weight, activity_minutes, temp):
+    """calculate_water_goal для массивов numpy"""
+    water = weight * 30 + (activity_minutes // 30) * 500
+    return water + np.where(temp > 30, 1000, np.where(temp > 25, 500, 0))
+
+
+def calculate_calorie_goals(weight, height, age, activity_minutes, male):
+    """calculate_calorie_goal для массивов numpy; male — булев массив"""
+    bmr = 10 * weight + 6.25 * height - 5 * age + np.where(male, 5, -161)
+    # граница включается в меньший коэффициент, как в <= у скалярной версии
+    pal = np.asarray(PAL_VALUES)[np.searchsorted(PAL_BOUNDS, activity_minutes, side="left")]
+    return bmr * pal
@@ -0,0 +1,138 @@
+"""
+Многопроцессный режим: фронт на PORT принимает вебхук и раздаёт апдейты
+BOT_WORKERS процессам bot.py. Апдейты пользователя всегда идут в процесс,
+который владеет его шардом хранилища (тот же shard_of, что и в storage_engine),
+поэтому процессы не пишут одного пользователя одновременно.
+
+    BOT_WORKERS=4 python cluster.py
+"""
+import os
+import sys
+import json
+import signal
+import asyncio
+import logging
+
+import aiohttp
+from aiohttp import web
+
+from storage_engine import shard_of
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", os.cpu_count() or 1))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", 8081))
+WEBHOOK_PATH = "/webhook"
+
+
+def update_user_id(data: dict):
+    # у любого типа апдейта (message, callback_query, inline_query, ...) автор лежит в "from"
+    for value in data.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return value["from"].get("id")
+    return None
+
+
+def import_legacy():
+    from storage import store
+    store.import_legacy()
+
+
+class Cluster:
+    def __init__(self, workers: int = BOT_WORKERS, base_port: int = WORKER_BASE_PORT):
+        self.workers = workers
+        self.base_port = base_port
+        self._procs = [None] * workers
+        self._session = None
+        self._stopping = False
+        self.forwarded = [0] * workers
+        self.failed = 0
+
+    def _spawn(self, index: int):
+        env = dict(os.environ)
+        env.update({
+            "PORT": str(self.base_port + index),
+            "SHARD_INDEX": str(index),
+            "SHARD_COUNT": str(self.workers),
+            # webhook в Telegram ставит только первый воркер, адрес у всех один — фронт
+            "SET_WEBHOOK": "1" if index == 0 else "0",
+        })
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+        # своя сессия: Ctrl+C из терминала получает только фронт, воркеров он останавливает сам
+        return asyncio.create_subprocess_exec(sys.executable, script, env=env, start_new_session=True)
+
+    async def _supervise(self, index: int):
+        # упавший воркер перезапускается; его шард всё это время никто другой не трогает
+        while not self._stopping:
+            proc = await self._spawn(index)
+            self._procs[index] = proc
+            logger.info("Воркер %d запущен (pid %d, порт %d)", index, proc.pid, self.base_port + index)
+            code = await proc.wait()
+            if not self._stopping:
+                logger.error("Воркер %d завершился с кодом %s, перезапуск", index, code)
+                await asyncio.sleep(1)
+
+    async def handle(self, request):
+        body = await request.read()
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        key = update_user_id(data)
+        if key is None:
+            key = data.get("update_id", 0)
+        index = shard_of(key, self.workers)
+        url = f"http://127.0.0.1:{self.base_port + index}{WEBHOOK_PATH}"
+        try:
+            async with self._session.post(url, data=body, headers={"Content-Type": "application/json"}) as resp:
+                self.forwarded[index] += 1
+                return web.Response(status=resp.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # не 200: Telegram повторит апдейт, когда воркер поднимется
+            self.failed += 1
+            logger.warning("Воркер %d недоступен: %r", index, e)
+            return web.Response(status=503)
+
+    async def stop(self):
+        self._stopping = True
+        for proc in self._procs:
+            if proc is not None and proc.returncode is None:
+                proc.send_signal(signal.SIGTERM)
+        # воркеры сами дообрабатывают очередь и сохраняют данные
+        await asyncio.gather(*(p.wait() for p in self._procs if p is not None))
+        await self._session.close()
+
+    async def run(self):
+        # старый users.json импортирует фронт, пока воркеров нет: иначе каждый воркер
+        # импортировал бы всех и мог затереть записи, которые другой уже обновил
+        await asyncio.get_running_loop().run_in_executor(None, import_legacy)
+        self._session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=10),
+            connector=aiohttp.TCPConnector(limit=0),
+        )
+        supervisors = [asyncio.create_task(self._supervise(i)) for i in range(self.workers)]
+
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        port = int(os.environ.get("PORT", 8080))
+        await web.TCPSite(runner, "0.0.0.0", port).start()
+        logger.info("Фронт на порту %d, воркеров: %d", port, self.workers)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        try:
+            await stop.wait()
+        finally:
+            await runner.cleanup()
+            await self.stop()
+            for task in supervisors:
+                task.cancel()
+
+
+if __name__ == "__main__":
+    asyncio.run(Cluster().run())
@@ -0,0 +1,125 @@
+"""
+Продукты, которые пользователь уже записывал: поиск по ним без запросов к API.
+
+У каждого пользователя в user.foods лежит до FAVORITES_SIZE продуктов:
+    {название: [ккал/100г, сколько раз записан, день последней записи (toordinal), граммы, [запросы]]}
+«Запросы» — что пользователь вводил, когда выбрал этот продукт («гречка» -> «Гречка ядрица»).
+Поиск — по началу слов названия и запросов, с опечатками — по похожести слов;
+среди подходящих выше те, что записывались чаще и недавно.
+"""
+import os
+from datetime import date
+from difflib import SequenceMatcher
+
+from food_api import normalize_query
+import food_log
+
+FAVORITES_SIZE = int(os.getenv("FAVORITES_SIZE", 50))
+# запись двухнедельной давности весит вдвое меньше сегодняшней
+HALF_LIFE_DAYS = 14
+# слово с опечаткой считается совпавшим при такой похожести
+FUZZY_CUTOFF = 0.75
+MAX_QUERIES = 3
+
+CALORIES, COUNT, LAST_DAY, GRAMS, QUERIES = range(5)
+
+# уровни совпадения: пользователь уже вводил ровно это / по началу слов / с опечаткой
+EXACT, PREFIX, FUZZY = 3, 2, 1
+
+
+def _weight(entry, today: int) -> float:
+    return entry[COUNT] * 0.5 ** ((today - entry[LAST_DAY]) / HALF_LIFE_DAYS)
+
+
+def remember(user, name: str, calories: float, grams: float, query: str = None):
+    """Учитывает записанный продукт (user — UserProfile)"""
+    today = date.today().toordinal()
+    foods = user.foods or {}
+    entry = foods.get(name)
+    queries = list(entry[QUERIES]) if entry else []
+    query = normalize_query(query or "")
+    if query and query != normalize_query(name):
+        if query in queries:
+            queries.remove(query)
+        queries = ([query] + queries)[:MAX_QUERIES]
+    count = entry[COUNT] + 1 if entry else 1
+    # новый список вместо правки на месте: журнал пишет только изменённый продукт
+    foods[name] = [calories, count, today, grams, queries]
+    while len(foods) > FAVORITES_SIZE:
+        del foods[min((n for n in foods if n != name), key=lambda n: _weight(foods[n], today))]
+    user.foods = foods
+
+
+def _word_hits(query_words: list, words: list, fuzzy: bool) -> bool:
+    for q in query_words:
+        base = food_log.stem(q)
+        if any(w.startswith(base) for w in words):
+            continue
+        if not fuzzy or not any(SequenceMatcher(None, q, w).ratio() >= FUZZY_CUTOFF for w in words):
+            return False
+    return True
+
+
+def _level(query: str, name: str, entry) -> int:
+    if query == normalize_query(name) or query in entry[QUERIES]:
+        return EXACT
+    query_words = query.split()
+    texts = [normalize_query(name).split()] + [q.split() for q in entry[QUERIES]]
+    if any(_word_hits(query_words, words, fuzzy=False) for words in texts):
+        return PREFIX
+    if any(_word_hits(query_words, words, fuzzy=True) for words in texts):
+        return FUZZY
+    return 0
+
+
+def find(user, query: str, limit: int = 5) -> list:
+    """[(название, ккал/100г), ...] из продуктов пользователя, лучшие первыми"""
+    query = normalize_query(query)
+    if not query or not user.foods:
+        return []
+    today = date.today().toordinal()
+    ranked = []
+    for name, entry in user.foods.items():
+        level = _level(query, name, entry)
+        if level:
+            ranked.append((level, _weight(entry, today), name, entry[CALORIES]))
+    ranked.sort(reverse=True)
+    return [(name, calories) for _, _, name, calories in ranked[:limit]]
+
+
+def top(user, limit: int = 5) -> list:
+    """[(название, ккал/100г), ...] — самые частые и недавние продукты пользователя"""
+    if not user.foods:
+        return []
+    today = date.today().toordinal()
+    ranked = sorted(user.foods.items(), key=lambda item: _weight(item[1], today), reverse=True)
+    return [(name, entry[CALORIES]) for name, entry in ranked[:limit]]
+
+
+def best(user, query: str):
+    """
+    (название, ккал/100г), если по продуктам пользователя ответ однозначен, иначе None:
+    он уже выбирал продукт по такому запросу или подходящие по началу слов
+    продукты равнозначны по калорийности (как в food_log.best_match) — берётся самый частый.
+    """
+    query = normalize_query(query)
+    if not query or not user.foods:
+        return None
+    today = date.today().toordinal()
+    levels = {name: _level(query, name, entry) for name, entry in user.foods.items()}
+    best_level = max(levels.values())
+    if best_level < PREFIX:
+        return None
+    candidates = sorted(
+        (name for name, level in levels.items() if level == best_level),
+        key=lambda n: _weight(user.foods[n], today), reverse=True,
+    )
+    calories = [user.foods[n][CALORIES] for n in candidates]
+    if best_level == PREFIX and max(calories) - min(calories) > food_log.SAME_CALORIES * max(max(calories), 1):
+        return None
+    return candidates[0], calories[0]
+
+
+def usual_grams(user, name: str):
+    entry = (user.foods or {}).get(name)
+    return entry[GRAMS] if entry else None
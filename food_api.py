@@ -1,34 +1,111 @@
-import requests
+import os
+import asyncio
+import logging
+import aiohttp
 
-def search_food(name: str, limit: int = 5):
-    url = "https://world.openfoodfacts.org/cgi/search.pl"
+from cache import TTLCache
+from resilience import Upstream
+import food_index
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SEARCH_URL = os.getenv("OFF_SEARCH_URL", "https://world.openfoodfacts.org/cgi/search.pl")
+FOOD_API_TIMEOUT = float(os.getenv("FOOD_API_TIMEOUT", 8))
+FOOD_CACHE_SIZE = int(os.getenv("FOOD_CACHE_SIZE", 5000))
+FOOD_CACHE_TTL = float(os.getenv("FOOD_CACHE_TTL", 24 * 3600))
+# дольше этого /log_food OpenFoodFacts не ждёт; старый ответ отдаётся ещё FOOD_STALE_TTL
+FOOD_API_BUDGET = float(os.getenv("FOOD_API_BUDGET", 2))
+FOOD_STALE_TTL = float(os.getenv("FOOD_STALE_TTL", 7 * 24 * 3600))
+# local_first — сначала локальный индекс, потом API; local_only — только индекс; remote — только API
+FOOD_SOURCE = os.getenv("FOOD_SOURCE", "local_first")
+
+_session = None
+_cache = TTLCache(maxsize=FOOD_CACHE_SIZE, ttl=FOOD_CACHE_TTL)    # ответы локального индекса
+_upstream = Upstream("search_food", budget=FOOD_API_BUDGET, fresh_ttl=FOOD_CACHE_TTL,
+                     stale_ttl=FOOD_STALE_TTL, maxsize=FOOD_CACHE_SIZE)
+
+
+def get_session() -> aiohttp.ClientSession:
+    # одна сессия на процесс: пул соединений, DNS и TLS переиспользуются
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=FOOD_API_TIMEOUT, connect=3),
+            connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300),
+            headers={"User-Agent": "Telegram_bot_DZ/1.0"},
+        )
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def normalize_query(name: str) -> str:
+    return " ".join(name.lower().replace("ё", "е").split())
+
+
+def parse_products(products):
+    result = []
+    for product in products:
+        calories = food_index.calories_from_nutriments(product.get("nutriments", {}))
+        name = product.get("product_name", "Без имени")
+        result.append((name, calories))
+    return result
+
+
+async def _fetch(query: str, limit: int):
     params = {
-        "search_terms": name,
+        "search_terms": query,
         "search_simple": 1,
         "action": "process",
         "json": 1,
         "page_size": limit
     }
-    r = requests.get(url, params=params)
-    data = r.json()
-    products = data.get("products")
-    if not products:
-        return []
+    async with get_session().get(SEARCH_URL, params=params) as resp:
+        resp.raise_for_status()
+        data = await resp.json(content_type=None)
+    return parse_products(data.get("products") or [])
 
-    result = []
-    for product in products:
-        nutriments = product.get("nutriments", {})
-        calories = (
-            nutriments.get("energy-kcal_100g") or
-            nutriments.get("energy-kcal") or
-            nutriments.get("energy-kcal_value") or
-            nutriments.get("energy-kcal_value_computed") or
-            # если есть только кДж — грубо переводим (1 ккал ≈ 4.184 кДж)
-            (nutriments.get("energy_100g") / 4.184 if nutriments.get("energy_100g") else None) or
-            0
-        )
-        if calories is None:
-            calories = 0
-        name = product.get("product_name", "Без имени")
-        result.append((name, calories))
-    return result
+
+async def search_food(name: str, limit: int = 5):
+    results, _ = await lookup_food(name, limit)
+    return results
+
+
+async def lookup_food(name: str, limit: int = 5):
+    """
+    ([(название, ккал/100г), ...], источник): "local" — локальный индекс, "remote" — API.
+    Ответ индекса на префикс полный (всё, что начинается так), ответ API — нет.
+    """
+    with metrics.track("search_food"):
+        return await _search_food(name, limit)
+
+
+async def _search_food(name: str, limit: int):
+    query = normalize_query(name)
+    if not query:
+        return [], "local"
+    key = (query, limit)
+
+    if FOOD_SOURCE != "remote":
+        result = _cache.get(key)
+        if result is None:
+            # SQLite — блокирующий вызов, в event loop его не выполняем
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(None, food_index.search, query, limit)
+            _cache.set(key, result)
+        if result or FOOD_SOURCE == "local_only":
+            return result, "local"
+
+    result = await _upstream.get(key, lambda: _fetch(query, limit))
+    return (result if result is not None else []), "remote"
+
+
+def cache_stats() -> dict:
+    local, remote = _cache.stats(), _upstream.cache.stats()
+    return {name: local[name] + remote[name] for name in local}
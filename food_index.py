@@ -0,0 +1,243 @@
+"""
+Локальный индекс калорийности продуктов из дампа OpenFoodFacts.
+
+Сборка (дамп читается потоково, целиком в память не грузится):
+    python food_index.py build openfoodfacts-products.jsonl.gz
+    python food_index.py build en.openfoodfacts.org.products.csv.gz --out food_index.db
+
+Проверка:
+    python food_index.py search гречка
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+import threading
+
+logger = logging.getLogger(__name__)
+
+FOOD_INDEX_PATH = os.getenv("FOOD_INDEX_PATH", "food_index.db")
+
+# поля с названием, в порядке предпочтения
+NAME_FIELDS = ("product_name_ru", "product_name", "product_name_en", "generic_name")
+ENERGY_FIELDS = (
+    "energy-kcal_100g",
+    "energy-kcal",
+    "energy-kcal_value",
+    "energy-kcal_value_computed",
+)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def calories_from_nutriments(nutriments: dict) -> float:
+    """Ккал на 100 г по тем же полям, что и ответ API OpenFoodFacts"""
+    for field in ENERGY_FIELDS:
+        value = _to_float(nutriments.get(field))
+        if value:
+            return value
+    # если есть только кДж — грубо переводим (1 ккал ≈ 4.184 кДж)
+    kj = _to_float(nutriments.get("energy_100g"))
+    if kj:
+        return kj / 4.184
+    return 0
+
+
+def _to_float(value):
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(_TOKEN_RE.findall(name.lower().replace("ё", "е")))
+
+
+# =========================
+# Сборка индекса
+# =========================
+def _open_text(path: str):
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def iter_dump(path: str):
+    """Потоково отдаёт (название, другие названия, ккал/100г) из JSONL или CSV/TSV дампа"""
+    base = path[:-3] if path.endswith(".gz") else path
+    with _open_text(path) as f:
+        if base.endswith((".jsonl", ".json", ".ndjson")):
+            for line in f:
+                try:
+                    product = json.loads(line)
+                except ValueError:
+                    continue
+                nutriments = product.get("nutriments") or {}
+                yield _pick_names(product) + (calories_from_nutriments(nutriments),)
+        else:
+            csv.field_size_limit(sys.maxsize)
+            sample = f.readline()
+            delimiter = "\t" if "\t" in sample else ","
+            header = next(csv.reader([sample], delimiter=delimiter))
+            # в CSV-экспорте нутриенты лежат плоскими колонками
+            for row in csv.DictReader(f, fieldnames=header, delimiter=delimiter):
+                yield _pick_names(row) + (calories_from_nutriments(row),)
+
+
+def _pick_names(product: dict):
+    # первое непустое название показываем, остальные (ru/en) только участвуют в поиске
+    names = []
+    for field in NAME_FIELDS:
+        name = (product.get(field) or "").strip()
+        if name and name not in names:
+            names.append(name)
+    if not names:
+        return None, ""
+    return names[0], " ".join(names[1:])
+
+
+def build_index(dump_path: str, out_path: str = FOOD_INDEX_PATH) -> int:
+    tmp_path = out_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    # промежуточная таблица убирает дубли названий
+    conn.execute("CREATE TABLE products (norm TEXT PRIMARY KEY, name TEXT, alt TEXT, kcal REAL)")
+
+    started = time.monotonic()
+    seen = 0
+    batch = []
+    for name, alt, kcal in iter_dump(dump_path):
+        seen += 1
+        if not name or not kcal or kcal <= 0 or kcal > 1000:
+            continue
+        norm = normalize_name(name)
+        if not norm:
+            continue
+        batch.append((norm, name, alt, round(kcal, 1)))
+        if len(batch) >= 10000:
+            conn.executemany("INSERT OR IGNORE INTO products VALUES (?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT OR IGNORE INTO products VALUES (?, ?, ?, ?)", batch)
+
+    conn.execute(
+        "CREATE VIRTUAL TABLE foods USING fts5("
+        "name, alt, kcal UNINDEXED, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    conn.execute("INSERT INTO foods(name, alt, kcal) SELECT name, alt, kcal FROM products")
+    count = conn.execute("SELECT count(*) FROM foods").fetchone()[0]
+    conn.execute("DROP TABLE products")
+    conn.execute("INSERT INTO foods(foods) VALUES ('optimize')")
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    os.replace(tmp_path, out_path)
+    logger.info("Индекс собран: %d продуктов из %d строк за %.1f с",
+                count, seen, time.monotonic() - started)
+    return count
+
+
+# =========================
+# Поиск
+# =========================
+# недописанное слово ищется по префиксу только с такой длины: «ба*» совпадает с огромной долей базы
+PREFIX_MIN_CHARS = int(os.getenv("FOOD_PREFIX_MIN_CHARS", 3))
+# недописанное слово: ранжируются только первые столько совпадений, иначе bm25 считается по всем
+# (короткое начало слова вроде «мол» совпадает с огромной долей базы); целые слова — без ограничения
+PREFIX_CANDIDATES = int(os.getenv("FOOD_PREFIX_CANDIDATES", 5000))
+
+_local = threading.local()
+
+
+def _get_conn():
+    # search вызывается из потоков executor'а: у каждого потока своё соединение только для чтения
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        if not os.path.exists(FOOD_INDEX_PATH):
+            return None
+        conn = _local.conn = sqlite3.connect(f"file:{FOOD_INDEX_PATH}?mode=ro", uri=True)
+        logger.debug("Локальный индекс продуктов: %s", FOOD_INDEX_PATH)
+    return conn
+
+
+def available() -> bool:
+    return os.path.exists(FOOD_INDEX_PATH)
+
+
+def _ranked(conn, match: str, limit: int, candidates: int = None):
+    if candidates is None:
+        sql = ("SELECT name, kcal FROM foods WHERE foods MATCH ? "
+               "ORDER BY bm25(foods, 2.0, 1.0), length(name) LIMIT ?")
+        args = (match, limit)
+    else:
+        # bm25 считается только для первых candidates совпадений (в порядке rowid, не по релевантности)
+        sql = ("SELECT name, kcal FROM ("
+               "  SELECT name, kcal, bm25(foods, 2.0, 1.0) AS rank FROM foods WHERE foods MATCH ? LIMIT ?"
+               ") ORDER BY rank, length(name) LIMIT ?")
+        args = (match, candidates, limit)
+    return conn.execute(sql, args).fetchall()
+
+
+def search(query: str, limit: int = 5):
+    """
+    Ранжированный поиск: [(название, ккал/100г), ...], пустой список если индекса нет.
+    Синхронный: в боте вызывается в executor (food_api.search_food).
+    """
+    conn = _get_conn()
+    if conn is None:
+        return []
+    tokens = _TOKEN_RE.findall(query.lower().replace("ё", "е"))
+    if not tokens:
+        return []
+    # сначала целые слова: их bm25 ранжирует по всем совпадениям, «молоко» находит «Молоко»
+    rows = _ranked(conn, " ".join(f'"{t}"' for t in tokens), limit)
+    last = tokens[-1]
+    if len(rows) < limit and len(last) >= PREFIX_MIN_CHARS:
+        # последнее слово может быть недописано: «греч» — «гречка»
+        seen = {name for name, _ in rows}
+        match = " ".join([f'"{t}"' for t in tokens[:-1]] + [f'"{last}"*'])
+        for name, kcal in _ranked(conn, match, limit, PREFIX_CANDIDATES):
+            if name not in seen and len(rows) < limit:
+                seen.add(name)
+                rows.append((name, kcal))
+    return [(name, kcal) for name, kcal in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный индекс продуктов OpenFoodFacts")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="собрать индекс из дампа (.jsonl/.csv, можно .gz)")
+    build.add_argument("dump")
+    build.add_argument("--out", default=FOOD_INDEX_PATH)
+    find = sub.add_parser("search", help="поиск по готовому индексу")
+    find.add_argument("query", nargs="+")
+    find.add_argument("--limit", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "build":
+        build_index(args.dump, args.out)
+    else:
+        started = time.perf_counter()
+        results = search(" ".join(args.query), args.limit)
+        elapsed = (time.perf_counter() - started) * 1000
+        for name, kcal in results:
+            print(f"{name} — {kcal} ккал/100г")
+        print(f"({len(results)} за {elapsed:.2f} мс)")
+
+
+if __name__ == "__main__":
+    main()
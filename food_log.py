@@ -0,0 +1,162 @@
+"""
+Разбор быстрой записи еды одним сообщением:
+    /log_food 200 гречка, 150 курица, 1 банан
+и выбор продукта из результатов поиска без участия пользователя, когда это однозначно.
+"""
+import re
+
+from food_api import normalize_query
+
+# десятичная запятая («1,5 банана») не разделяет продукты
+ITEM_SEPARATORS = re.compile(r"[;\n]|(?<!\d),|,(?!\d)")
+NUMBER = r"(\d+(?:[.,]\d+)?)"
+UNIT = r"(кг|kg|г|гр|грамм\w*|g|мл|ml|шт|штук\w*|pcs)?\.?"
+AMOUNT_FIRST = re.compile(rf"^{NUMBER}\s*{UNIT}\s+(.+)$", re.IGNORECASE)
+AMOUNT_LAST = re.compile(rf"^(.+?)\s+{NUMBER}\s*{UNIT}$", re.IGNORECASE)
+
+# вес одной штуки, г; ключ — начало слова, чтобы подходили падежи (яблоко, яблока)
+PIECE_GRAMS = {
+    "банан": 120, "banana": 120,
+    "яблок": 180, "apple": 180,
+    "яйц": 55, "egg": 55,
+    "апельсин": 150, "orange": 150,
+    "груш": 170, "pear": 170,
+    "мандарин": 80,
+    "персик": 150, "peach": 150,
+    "киви": 75, "kiwi": 75,
+    "помидор": 120, "томат": 120, "tomato": 120,
+    "огур": 100, "cucumber": 100,
+    "картоф": 100, "картош": 100, "potato": 100,
+    "сырник": 60,
+    "котлет": 80,
+    "печень": 12, "cookie": 12,
+}
+# без единиц и меньше этого числа — штуки («1 банан»), иначе граммы («200 гречка»)
+MAX_PIECES = 20
+# варианты с калорийностью в пределах этой доли считаются одним и тем же продуктом
+SAME_CALORIES = 0.15
+
+
+class FoodItem:
+    __slots__ = ("name", "amount", "unit")
+
+    def __init__(self, name: str, amount: float, unit: str):
+        self.name = name
+        self.amount = amount
+        self.unit = unit    # "g" или "pcs"
+
+    @property
+    def grams(self):
+        """Вес в граммах или None, если это штуки с неизвестным весом"""
+        if self.unit == "g":
+            return self.amount
+        piece = piece_grams(self.name)
+        return self.amount * piece if piece else None
+
+
+def piece_grams(name: str):
+    for word in normalize_query(name).split():
+        for stem, grams in PIECE_GRAMS.items():
+            if word.startswith(stem):
+                return grams
+    return None
+
+
+def _parse_amount(number: str, unit: str, name: str):
+    amount = float(number.replace(",", "."))
+    unit = (unit or "").lower()
+    if unit in ("кг", "kg"):
+        return amount * 1000, "g"
+    if unit.startswith(("шт", "pcs")):
+        return amount, "pcs"
+    if unit:
+        # граммы и миллилитры считаем одинаково
+        return amount, "g"
+    if amount < MAX_PIECES and piece_grams(name):
+        return amount, "pcs"
+    return amount, "g"
+
+
+def parse_items(text: str) -> list:
+    """[FoodItem, ...]; пустой список, если хоть один продукт записан без количества"""
+    items = []
+    for part in ITEM_SEPARATORS.split(text):
+        part = part.strip()
+        if not part:
+            continue
+        match = AMOUNT_FIRST.match(part)
+        if match:
+            number, unit, name = match.groups()
+        else:
+            match = AMOUNT_LAST.match(part)
+            if not match:
+                return []
+            name, number, unit = match.groups()
+        name = name.strip()
+        amount, unit = _parse_amount(number, unit, name)
+        if amount <= 0:
+            return []
+        items.append(FoodItem(name, amount, unit))
+    return items
+
+
+# падежные окончания: «200 г творога», «1,5 банана»
+ENDINGS = ("ами", "ями", "ой", "ей", "ом", "ем", "ов", "ев", "ы", "и", "а", "я", "у", "ю", "е")
+
+
+def stem(word: str) -> str:
+    if len(word) > 3:
+        for ending in ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= 3:
+                return word[:-len(ending)]
+    return word
+
+
+def search_variants(name: str) -> list:
+    """Запрос как есть и, если отличается, с основой последнего слова (для поиска по префиксу)"""
+    words = normalize_query(name).split()
+    if not words:
+        return []
+    variants = [" ".join(words)]
+    stemmed = " ".join(words[:-1] + [stem(words[-1])])
+    if stemmed != variants[0]:
+        variants.append(stemmed)
+    return variants
+
+
+def _score(query_words: list, name: str) -> float:
+    # доля слов запроса, основа которых совпадает с началом какого-нибудь слова названия
+    name_words = normalize_query(name).split()
+    hits = sum(any(w.startswith(stem(q)) for w in name_words) for q in query_words)
+    return hits / len(query_words)
+
+
+def matches(query: str, name: str) -> bool:
+    """Все слова запроса (по основе) есть в начале слов названия"""
+    words = normalize_query(query).split()
+    return bool(words) and _score(words, name) == 1
+
+
+def best_match(query: str, results: list):
+    """
+    (название, ккал/100г) или None, если выбрать за пользователя нельзя.
+    Подходящие по всем словам запроса варианты с почти одинаковой калорийностью
+    для подсчёта калорий равнозначны — берём первый по ранжированию поиска.
+    """
+    if len(results) == 1:
+        return tuple(results[0])
+    words = normalize_query(query).split()
+    if not words:
+        return None
+    good = [(name, kcal) for name, kcal in results if _score(words, name) == 1]
+    if not good:
+        return None
+    # «Банан» при запросе «банан» точнее, чем «Банановые чипсы»
+    exact = [(name, kcal) for name, kcal in good if _score(normalize_query(name).split(), " ".join(words)) == 1]
+    if exact:
+        good = exact
+    calories = [kcal for _, kcal in good]
+    low, high = min(calories), max(calories)
+    if high - low > SAME_CALORIES * max(high, 1):
+        return None
+    return good[0]
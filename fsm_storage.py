@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+logger = logging.getLogger(__name__)
+
+# memory — как раньше, в памяти процесса; sqlite — файл, общий для всех воркеров на машине
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", "fsm.db")
+# через сколько секунд брошенный диалог (начал /log_food и ушёл) забывается
+FSM_TTL = float(os.getenv("FSM_TTL", 24 * 3600))
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-состояния в SQLite (WAL): переживают рестарт и видны всем процессам,
+    которые открыли тот же файл. Запись старше ttl считается пустой и удаляется.
+    Запросы идут по первичному ключу и обычно занимают десятки микросекунд, но в кластере
+    запись может ждать блокировку WAL, пока пишет другой процесс (до timeout секунд).
+    Поэтому все запросы идут через один отдельный поток, а не в event loop:
+    одно соединение используется последовательно, порядок операций сохраняется.
+    """
+
+    def __init__(self, path: str = FSM_DB_PATH, ttl: float = FSM_TTL, cleanup_every: int = 1000):
+        self.path = path
+        self.ttl = ttl
+        self.cleanup_every = cleanup_every
+        self._writes = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm")
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT, updated REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS fsm_updated ON fsm(updated)")
+        # отдельное соединение для /metrics из event loop: чтение в WAL не ждёт пишущих
+        self._stats_conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=0.1)
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id,
+            key.business_connection_id, key.destiny,
+        ))
+
+    def _row(self, key: StorageKey):
+        row = self._conn.execute(
+            "SELECT state, data, updated FROM fsm WHERE key = ?", (self._key(key),)
+        ).fetchone()
+        if row is None or row[2] < time.time() - self.ttl:
+            return None, {}
+        return row[0], json.loads(row[1]) if row[1] else {}
+
+    def _write(self, key: StorageKey, state, data):
+        if state is None and not data:
+            self._conn.execute("DELETE FROM fsm WHERE key = ?", (self._key(key),))
+        else:
+            self._conn.execute(
+                "INSERT INTO fsm(key, state, data, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+                "data = excluded.data, updated = excluded.updated",
+                (self._key(key), state, json.dumps(data, ensure_ascii=False), time.time()),
+            )
+        self._writes += 1
+        if self._writes % self.cleanup_every == 0:
+            self.cleanup()
+
+    def _set_state(self, key: StorageKey, state):
+        _, data = self._row(key)
+        self._write(key, state, data)
+
+    def _set_data(self, key: StorageKey, data: dict):
+        state, _ = self._row(key)
+        self._write(key, state, data)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        if isinstance(state, State):
+            state = state.state
+        await self._run(self._set_state, key, state)
+
+    async def get_state(self, key: StorageKey):
+        return (await self._run(self._row, key))[0]
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        await self._run(self._set_data, key, dict(data))
+
+    async def get_data(self, key: StorageKey) -> dict:
+        return (await self._run(self._row, key))[1]
+
+    def cleanup(self) -> int:
+        """Удаляет брошенные диалоги, возвращает сколько удалено"""
+        cur = self._conn.execute("DELETE FROM fsm WHERE updated < ?", (time.time() - self.ttl,))
+        if cur.rowcount:
+            logger.info("FSM: удалено брошенных диалогов: %d", cur.rowcount)
+        return cur.rowcount
+
+    def count_active(self) -> int:
+        return self._stats_conn.execute(
+            "SELECT count(*) FROM fsm WHERE state IS NOT NULL AND updated >= ?",
+            (time.time() - self.ttl,),
+        ).fetchone()[0]
+
+    async def close(self) -> None:
+        await self._run(self._conn.close)
+        self._executor.shutdown()
+        self._stats_conn.close()
+
+
+def count_active(storage: BaseStorage) -> int:
+    """Сколько диалогов сейчас в процессе (для /metrics)"""
+    if isinstance(storage, SQLiteStorage):
+        return storage.count_active()
+    if isinstance(storage, MemoryStorage):
+        return sum(1 for record in storage.storage.values() if record.state is not None)
+    return 0
+
+
+def make_fsm_storage() -> BaseStorage:
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    logger.info("FSM-хранилище: %s (ttl %.0f с)", FSM_DB_PATH, FSM_TTL)
+    return SQLiteStorage(FSM_DB_PATH, FSM_TTL)
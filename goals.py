@@ -0,0 +1,189 @@
+"""
+Ежедневный пересчёт целей по воде и калориям для всех пользователей.
+
+Норма воды зависит от погоды, поэтому раз в день цели пересчитываются заново:
+погода запрашивается один раз на город, формулы считаются массивами numpy
+(calculations.calculate_*_goals), сохраняются только пользователи, у которых цель изменилась.
+Пользователи читаются пачками по GOALS_CHUNK_USERS и в памяти бота не остаются.
+Заодно сбрасывается прибавка к норме воды за тренировки прошлых дней.
+
+Бот запускает пересчёт сам каждый день в GOALS_REFRESH_AT (время сервера, пусто — выключено),
+каждый процесс — для своего шарда. Вручную, при остановленном боте:
+    python goals.py refresh
+"""
+import os
+import time
+import asyncio
+import logging
+import contextlib
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from calculations import calculate_water_goals, calculate_calorie_goals
+from user_model import UserProfile
+import weather_api
+
+logger = logging.getLogger(__name__)
+
+GOALS_REFRESH_AT = os.getenv("GOALS_REFRESH_AT", "06:00")
+GOALS_WEATHER_CONCURRENCY = int(os.getenv("GOALS_WEATHER_CONCURRENCY", 10))
+# столько пользователей читается из хранилища за раз
+GOALS_CHUNK_USERS = int(os.getenv("GOALS_CHUNK_USERS", 500))
+# столько запросов к хранилищу одновременно: время пересчёта — это ожидание ответов S3
+GOALS_IO_THREADS = int(os.getenv("GOALS_IO_THREADS", 32))
+
+_scheduler_task = None
+
+
+def cities_of(users: dict) -> list:
+    """Города пользователей, по одному написанию на город"""
+    cities = {}
+    for user in users.values():
+        if user.city:
+            cities.setdefault(weather_api.city_key(user.city), user.city.strip())
+    return list(cities.values())
+
+
+def recompute(users: dict, temperatures: dict) -> list:
+    """
+    Пересчитывает цели всех пользователей с заполненным профилем, возвращает uid изменённых.
+    Без await внутри: хендлеры не меняют пользователей посередине пересчёта.
+    Если погоды для города нет, норма воды остаётся прежней.
+    """
+    temperatures = {weather_api.city_key(city): temp for city, temp in temperatures.items()}
+    uids, rows = [], []
+    for uid, user in users.items():
+        if user.weight is None or user.height is None or user.age is None:
+            continue
+        temp = temperatures.get(weather_api.city_key(user.city), np.nan) if user.city else np.nan
+        uids.append(uid)
+        rows.append((user.weight, user.height, user.age, user.activity or 0,
+                     user.sex == "male", temp, user.water_goal or 0, user.calorie_goal or 0))
+    if not rows:
+        return []
+
+    weight, height, age, activity, male, temp, old_water, old_calories = np.array(rows, dtype=float).T
+    water = np.where(np.isnan(temp), old_water, calculate_water_goals(weight, activity, temp))
+    calories = calculate_calorie_goals(weight, height, age, activity, male.astype(bool))
+
+    changed = ~np.isclose(water, old_water) | ~np.isclose(calories, old_calories)
+    result = []
+    for i in np.flatnonzero(changed):
+        user = users[uids[i]]
+        user.water_goal = float(water[i])
+        user.calorie_goal = float(calories[i])
+        result.append(uids[i])
+    return result
+
+
+async def refresh(chunk_size: int = GOALS_CHUNK_USERS) -> int:
+    """
+    Пересчёт для всех пользователей своего шарда, возвращает число изменённых.
+    Пользователи читаются из хранилища пачками и в памяти бота не остаются:
+    изменённые записи сразу пишутся обратно, а в памяти правятся только уже загруженные.
+    """
+    import storage
+
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    temperatures = {}   # город -> температура по всем пачкам
+    asked = set()       # города, погоду которых уже запрашивали
+    total = changed_total = 0
+    chunks = storage.store.iter_users(chunk_size, GOALS_IO_THREADS)
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            # кто уже в памяти — считаем по нему: там могут быть ещё не сохранённые изменения
+            batch = {uid: dict.get(storage.users, uid) or UserProfile.from_dict(data) for uid, data in chunk}
+            cities = [city for city in cities_of(batch) if weather_api.city_key(city) not in asked]
+            asked.update(weather_api.city_key(city) for city in cities)
+            temperatures.update(await weather_api.get_temperatures(cities, GOALS_WEATHER_CONCURRENCY))
+
+            changed = recompute(batch, temperatures)
+            cold = {}
+            for uid in changed:
+                if dict.get(storage.users, uid) is batch[uid]:
+                    storage.save_users(uid)
+                else:
+                    cold[uid] = batch[uid].to_dict()
+            skipped = await loop.run_in_executor(None, storage.store.write_cold, cold, GOALS_IO_THREADS)
+            # эти успели загрузиться, пока шёл пересчёт: считаем заново по записи в памяти
+            for uid in skipped:
+                await storage.ensure_loaded(uid)
+            live = {uid: dict.get(storage.users, uid) for uid in skipped}
+            for uid in recompute({uid: user for uid, user in live.items() if user is not None}, temperatures):
+                storage.save_users(uid)
+            total += len(batch)
+            changed_total += len(changed)
+    finally:
+        # при отмене посреди чтения пачки генератор ещё занят в потоке — его закроет сборщик мусора
+        with contextlib.suppress(ValueError):
+            chunks.close()
+    logger.info(
+        "Цели пересчитаны: %d пользователей, погода для %d/%d городов, изменено %d, %.1f с",
+        total, len(temperatures), len(asked), changed_total, time.perf_counter() - started,
+    )
+    return changed_total
+
+
+def _seconds_until(at: str) -> float:
+    hour, minute = map(int, at.split(":"))
+    now = datetime.now()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+async def _scheduler():
+    while True:
+        await asyncio.sleep(_seconds_until(GOALS_REFRESH_AT))
+        try:
+            await refresh()
+        except Exception:
+            logger.exception("Ошибка пересчёта целей, попробуем завтра")
+
+
+def start_scheduler():
+    global _scheduler_task
+    if GOALS_REFRESH_AT and _scheduler_task is None:
+        _scheduler_task = asyncio.create_task(_scheduler())
+        logger.info("Пересчёт целей каждый день в %s", GOALS_REFRESH_AT)
+
+
+async def stop_scheduler():
+    global _scheduler_task
+    if _scheduler_task is not None:
+        _scheduler_task.cancel()
+        try:
+            await _scheduler_task
+        except asyncio.CancelledError:
+            pass
+        _scheduler_task = None
+
+
+def main():
+    import sys
+    import storage
+
+    if sys.argv[1:] != ["refresh"]:
+        print("Использование: python goals.py refresh")
+        sys.exit(1)
+
+    async def run():
+        try:
+            return await refresh()
+        finally:
+            await weather_api.close_session()
+
+    changed = asyncio.run(run())
+    # в памяти только те, чьи дельты ещё лежали в журнале
+    storage.flush_now()
+    print(f"Изменены цели у {changed} пользователей")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,24 @@
 from aiogram import Router, F
 from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, FSInputFile
+from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, BufferedInputFile, InlineQuery
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from datetime import date
-from io import BytesIO
-import matplotlib.pyplot as plt
+import asyncio
 
 from storage import users, save_users
 from calculations import calculate_water_goal, calculate_calorie_goal
 from food_api import search_food
-from weather_api import get_temperature
-import tempfile
+import food_log
+import favorites
+import inline_search
+import activities
+from weather_api import get_temperature, DEFAULT_TEMPERATURE
+from plots import render_metric
+from user_model import UserProfile
+import rollups
+import reminders
+import history_export
 
 router = Router()
 
@@ -50,23 +57,18 @@ class WaterStates(StatesGroup):
 # Вспомогательные функции
 # =========================
 def check_daily_reset(uid: str):
-    today = str(date.today())
+    today = date.today().toordinal()
     user = users[uid]
-    if user.get("last_update") != today:
-        yesterday = user.get("last_update")
-        if yesterday:
-            # сохраняем вчерашние данные в историю
-            user.setdefault("history", {})[yesterday] = {
-                "water": user.get("logged_water", 0),
-                "calories": user.get("logged_calories", 0),
-                "burned": user.get("burned_calories", 0)
-            }
+    counters = user.today
+    if counters.day != today:
+        if counters.day:
+            # сохраняем вчерашние данные в историю и в итоги недели/месяца/года
+            user.history.add(counters.day, counters.water, counters.calories, counters.burned)
+            rollups.add_day(user, date.fromordinal(counters.day),
+                            counters.water, counters.calories, counters.burned)
         # сброс значений на новый день
-        user["logged_water"] = 0
-        user["logged_calories"] = 0
-        user["burned_calories"] = 0
-        user["last_update"] = today
-        save_users()
+        counters.reset(today)
+        save_users(uid)
 
 # =========================
 # /start
@@ -75,26 +77,22 @@ def check_daily_reset(uid: str):
 async def start(message: Message):
     uid = str(message.from_user.id)
     if uid not in users:
-        users[uid] = {
-            "weight": None, "height": None, "age": None,
-            "activity": 0, "city": None, "sex": None,
-            "water_goal": 0, "calorie_goal": 0,
-            "logged_water": 0, "logged_calories": 0,
-            "burned_calories": 0, "last_update": str(date.today()),
-            "history": {}
-        }
-        save_users()
+        users[uid] = UserProfile()
+        save_users(uid)
     await message.answer(
         "👋 Привет! Я бот для воды, калорий и тренировок.\n"
         "Используй /set_profile для настройки профиля.\n"
         "Доступные команды:\n"
         "/set_profile - Настройка профиля\n"
         "/log_water <мл> - Записать воду\n"
-        "/log_food - Записать еду\n"
+        "/log_food [200 гречка, 1 банан] - Записать еду\n"
         "/log_workout - Записать тренировку\n"
         "/check_progress - Показать прогресс\n"
-        "/history - Показать историю\n"
-        "/plot <water/calories/burned> - График за последние дни"
+        "/history [с [по]] [страница] - Показать историю\n"
+        "/plot <water/calories/burned> - График за последние дни\n"
+        "/stats <week/month/year> - Статистика за период\n"
+        "/export [csv/jsonl] - Выгрузить историю файлом\n"
+        "/remind <on/off> - Напоминания о воде"
     )
 
 # =========================
@@ -104,8 +102,8 @@ async def start(message: Message):
 async def set_profile(message: Message, state: FSMContext):
     uid = str(message.from_user.id)
     if uid not in users:
-        users[uid] = {"logged_water": 0, "logged_calories": 0, "burned_calories": 0}
-        save_users()
+        users[uid] = UserProfile()
+        save_users(uid)
     await message.answer("Введите ваш пол (муж/жен):")
     await state.set_state(ProfileStates.sex)
 
@@ -186,21 +184,25 @@ async def process_city(message: Message, state: FSMContext):
     activity = data["activity"]
 
     temp = await get_temperature(city)
-    water_goal = calculate_water_goal(weight, activity, temp)
+    # без погоды — норма без поправки на жару; утренний пересчёт целей её уточнит
+    weather_note = "" if temp is not None else "\n🌡 Погода сейчас недоступна, норма воды без учёта жары"
+    water_goal = calculate_water_goal(weight, activity, DEFAULT_TEMPERATURE if temp is None else temp)
     calorie_goal = calculate_calorie_goal(weight, height, age, activity, sex=sex)
 
-    users[uid].update({
-        "sex": sex,
-        "weight": weight, "height": height, "age": age,
-        "activity": activity, "city": city,
-        "water_goal": water_goal, "calorie_goal": calorie_goal
-    })
-    save_users()
+    users[uid].set_profile(
+        sex=sex,
+        weight=weight, height=height, age=age,
+        activity=activity, city=city,
+        water_goal=water_goal, calorie_goal=calorie_goal,
+    )
+    reminders.update(uid, users[uid])
+    save_users(uid)
 
     await message.answer(
         f"✅ Профиль установлен!\n"
         f"💧 Вода: {water_goal:.0f} мл/день\n"
         f"🍽 Калории: {calorie_goal:.0f} ккал/день"
+        f"{weather_note}"
     )
     await state.clear()
 
@@ -231,14 +233,16 @@ async def process_water_amount(message: Message, state: FSMContext):
         await message.answer("Введите корректное количество воды в мл (число > 0).")
         return
 
-    users[uid]["logged_water"] += amount
-    save_users()
+    user = users[uid]
+    user.today.water += amount
+    reminders.update(uid, user)
+    save_users(uid)
 
-    left = max(0, users[uid]["water_goal"] - users[uid]["logged_water"])
+    left = max(0, user.water_goal - user.today.water)
 
     await message.answer(
         f"💧 Записано: {amount:.0f} мл\n"
-        f"Всего сегодня: {users[uid]['logged_water']:.0f} мл\n"
+        f"Всего сегодня: {user.today.water:.0f} мл\n"
         f"Осталось: {left:.0f} мл"
     )
 
@@ -256,15 +260,16 @@ async def check_progress(message: Message):
 
     check_daily_reset(uid)
     u = users[uid]
-    balance = u["calorie_goal"] - u["logged_calories"] + u["burned_calories"]
-    left_water = max(0, u["water_goal"] - u["logged_water"])
+    day = u.today
+    balance = u.calorie_goal - day.calories + day.burned
+    left_water = max(0, u.water_goal - day.water)
 
     await message.answer(
         f"📊 Прогресс:\n"
-        f"💧 Вода: {u['logged_water']:.0f} / {u['water_goal']:.0f} мл\n"
+        f"💧 Вода: {day.water:.0f} / {u.water_goal:.0f} мл\n"
         f"Осталось: {left_water:.0f} мл\n"
-        f"🍽 Калории: {u['logged_calories']:.0f} / {u['calorie_goal']:.0f} ккал\n"
-        f"Сожжено: {u['burned_calories']:.0f} ккал\n"
+        f"🍽 Калории: {day.calories:.0f} / {u.calorie_goal:.0f} ккал\n"
+        f"Сожжено: {day.burned:.0f} ккал\n"
         f"Баланс: {balance:.0f} ккал"
     )
 
@@ -279,38 +284,145 @@ async def log_food_start(message: Message, state: FSMContext):
         return
 
     check_daily_reset(uid)
+    args = message.text.split(maxsplit=1)
+    if len(args) > 1:
+        await log_food_items(message, state, args[1])
+        return
     await message.answer("🍽 Введите название продукта:")
     await state.set_state(FoodStates.choosing)
 
+# кнопка под списком своих продуктов: искать в базе
+SEARCH_MORE = "food_search"
+
+def food_keyboard(results, search_more: bool = False) -> InlineKeyboardMarkup:
+    buttons = [
+        [InlineKeyboardButton(text=f"{'⭐ ' if search_more else ''}{name} — {cal} ккал/100г", callback_data=str(i))]
+        for i, (name, cal) in enumerate(results)
+    ]
+    if search_more:
+        buttons.append([InlineKeyboardButton(text="🔎 Другой продукт", callback_data=SEARCH_MORE)])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+async def search_food_item(name: str):
+    # «творога» ищем и как «творог»: локальный индекс ищет по началу слова
+    for query in food_log.search_variants(name):
+        results = await search_food(query, limit=5)
+        if results:
+            return results
+    return []
+
+async def log_food_items(message: Message, state: FSMContext, text: str):
+    """/log_food 200 гречка, 150 курица, 1 банан — всё сразу, поиск параллельно"""
+    items = food_log.parse_items(text)
+    if not items:
+        await message.answer(
+            "Не понял количество. Пример: /log_food 200 гречка, 150 курица, 1 банан\n"
+            "или просто /log_food, чтобы выбрать продукт из списка."
+        )
+        return
+
+    uid = str(message.from_user.id)
+    user = users[uid]
+    # то, что пользователь уже записывал, узнаём без поиска
+    usual = [favorites.best(user, item.name) for item in items]
+    found = await asyncio.gather(*(
+        search_food_item(item.name) for item, match in zip(items, usual) if match is None
+    ))
+    found = iter(found)
+    lines, pending, missing = [], [], []
+    total = 0
+    for item, match in zip(items, usual):
+        results = [match] if match is not None else next(found)
+        if not results:
+            missing.append(item.name)
+            continue
+        if match is None:
+            match = food_log.best_match(item.name, results)
+        grams = item.grams
+        if match is None or grams is None:
+            # неоднозначно — спросим кнопками (и граммы, если штуки неизвестного веса)
+            pending.append({"name": item.name, "grams": grams, "results": results})
+            continue
+        name, calories = match
+        item_calories = calories * grams / 100
+        total += item_calories
+        favorites.remember(user, name, calories, grams, item.name)
+        lines.append(f"• {name}, {grams:.0f} г — {item_calories:.0f} ккал")
+
+    if lines:
+        user.today.calories += total
+        save_users(uid)
+        lines.append(f"✅ Записано: {total:.0f} ккал")
+    if missing:
+        lines.append("❌ Не найдено: " + ", ".join(missing))
+    if lines:
+        await message.answer("\n".join(lines))
+    await ask_next_food(message, state, pending)
+
+async def ask_next_food(message: Message, state: FSMContext, pending: list):
+    """Показывает кнопки для следующего неоднозначного продукта или завершает запись"""
+    if not pending:
+        await state.clear()
+        return
+    item, rest = pending[0], pending[1:]
+    await state.set_state(FoodStates.choosing)
+    await state.update_data(results=item["results"], grams=item["grams"], pending=rest, query=item["name"])
+    await message.answer(f"Уточните «{item['name']}»:", reply_markup=food_keyboard(item["results"]))
+
 @router.message(FoodStates.choosing)
 async def process_food_choice(message: Message, state: FSMContext):
+    uid = str(message.from_user.id)
     query = message.text
-    results = search_food(query, limit=5)
+    # новый поиск вручную — граммы и очередь быстрой записи больше не относятся к нему
+    await state.update_data(grams=None, pending=[], query=query)
+
+    # сначала свои продукты пользователя — без запроса к API
+    results = favorites.find(users[uid], query) if uid in users else []
+    if results:
+        await state.update_data(results=results)
+        await message.answer("Выберите продукт:", reply_markup=food_keyboard(results, search_more=True))
+        return
+    await show_search_results(message, state, query)
+
+async def show_search_results(message: Message, state: FSMContext, query: str):
+    results = await search_food(query, limit=5)
     if not results:
         await message.answer("❌ Продукт не найден.")
         return
-
     await state.update_data(results=results)
-
-    buttons = [
-        [InlineKeyboardButton(text=f"{name} — {cal} ккал/100г", callback_data=str(i))]
-        for i, (name, cal) in enumerate(results)
-    ]
-    markup = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await message.answer("Выберите продукт:", reply_markup=markup)
+    await message.answer("Выберите продукт:", reply_markup=food_keyboard(results))
 
 @router.callback_query(F.data)
 async def food_selected(callback: CallbackQuery, state: FSMContext):
-    index = int(callback.data)
     data = await state.get_data()
+    if callback.data == SEARCH_MORE:
+        await show_search_results(callback.message, state, data.get("query") or "")
+        return
+    index = int(callback.data)
     results = data.get("results", [])
     if index >= len(results):
         await callback.message.answer("Ошибка выбора.")
         return
 
     name, calories = results[index]
+    grams = data.get("grams")
+    if grams:
+        # количество уже известно из быстрой записи
+        uid = str(callback.from_user.id)
+        check_daily_reset(uid)
+        total_calories = calories * grams / 100
+        users[uid].today.calories += total_calories
+        favorites.remember(users[uid], name, calories, grams, data.get("query"))
+        save_users(uid)
+        await callback.message.answer(f"✅ {name}, {grams:.0f} г — записано {total_calories:.0f} ккал")
+        await ask_next_food(callback.message, state, data.get("pending", []))
+        return
+
     await state.update_data(chosen_name=name, chosen_calories=calories)
-    await callback.message.answer(f"{name} — {calories} ккал/100г\nСколько грамм?")
+    uid = str(callback.from_user.id)
+    usual = favorites.usual_grams(users[uid], name) if uid in users else None
+    hint = f" (обычно {usual:.0f})" if usual else ""
+    await callback.message.answer(f"{name} — {calories} ккал/100г\nСколько грамм?{hint}")
     await state.set_state(FoodStates.weight)
 
 @router.message(FoodStates.weight)
@@ -327,25 +439,25 @@ async def process_food_weight(message: Message, state: FSMContext):
 
     data = await state.get_data()
     total_calories = data["chosen_calories"] * grams / 100
-    users[uid]["logged_calories"] += total_calories
-    save_users()
+    users[uid].today.calories += total_calories
+    favorites.remember(users[uid], data["chosen_name"], data["chosen_calories"], grams, data.get("query"))
+    save_users(uid)
     await message.answer(f"✅ Записано: {total_calories:.1f} ккал")
-    await state.clear()
+    await ask_next_food(message, state, data.get("pending", []))
+
+# =========================
+# Inline-поиск: @bot гречка
+# =========================
+@router.inline_query()
+async def inline_food_search(inline_query: InlineQuery):
+    # сам поиск идёт в фоне после паузы в наборе — воркер очереди не ждёт
+    await inline_search.handle(inline_query, users.get(str(inline_query.from_user.id)))
+
 
 
 # =========================
 # /log_workout
 # =========================
-MET_VALUES = {
-    "бег": 9.8,
-    "ходьба": 3.5,
-    "плавание": 8.0,
-    "велосипед": 7.5,
-    "йога": 3.0,
-    "силовая тренировка": 6.0,
-    "тренажер": 5.5,
-}
-
 @router.message(Command("log_workout"))
 async def log_workout_start(message: Message, state: FSMContext):
     uid = str(message.from_user.id)
@@ -380,26 +492,38 @@ async def process_workout_duration(message: Message, state: FSMContext):
     user = users.get(uid)
     data = await state.get_data()
     workout_type = data.get("type", "тренировка")
-    weight = user.get("weight", 70)
+    weight = user.weight or 70
 
-    met = MET_VALUES.get(workout_type, 6.0)
+    # нечёткий поиск по таблице Compendium: «бегала трусцой», «велик», «плавание кролем»
+    activity = activities.match(workout_type)
+    met = activity.met if activity else activities.DEFAULT_MET
     burned_calories = (met * 3.5 * weight / 200) * duration
     water_added = 200 * (duration / 30)  # +200 мл за каждые 30 мин
 
-    user["burned_calories"] += burned_calories
-    user["water_goal"] += water_added
-    save_users()
+    user.today.burned += burned_calories
+    user.water_goal += water_added
+    reminders.update(uid, user)
+    save_users(uid)
 
+    if activity is None:
+        recognized = f"Такую тренировку не знаю, считаю как среднюю нагрузку (MET {met:g}).\n"
+    elif activity.name != workout_type:
+        recognized = f"Считаю как «{activity.name}» (MET {met:g}).\n"
+    else:
+        recognized = ""
     await message.answer(
         f"🏃‍♂️ {workout_type.capitalize()} {duration:.0f} мин — {burned_calories:.0f} ккал сожжено.\n"
+        f"{recognized}"
         f"💧 Цель по воде увеличена на {water_added:.0f} мл."
     )
     await state.clear()
 
 
 # =========================
-# /history
+# /history [с [по]] [страница]
 # =========================
+HISTORY_PAGE_SIZE = 14
+
 @router.message(Command("history"))
 async def show_history(message: Message):
     uid = str(message.from_user.id)
@@ -407,17 +531,73 @@ async def show_history(message: Message):
         await message.answer("Сначала настройте профиль /set_profile")
         return
 
-    user = users[uid]
-    history = user.get("history", {})
-    if not history:
+    history = users[uid].history
+    if not len(history):
         await message.answer("История пока пуста.")
         return
 
-    text = "📅 История:\n"
-    for d, stats in sorted(history.items()):
-        text += f"{d} — 💧 {stats['water']:.0f} мл, 🍽 {stats['calories']:.0f} ккал, 🔥 {stats['burned']:.0f} ккал\n"
+    args = message.text.split()[1:]
+    page = 1
+    start = end = None
+    try:
+        if args and args[-1].isdigit():
+            page = int(args.pop())
+            if page < 1: raise ValueError
+        if args:
+            start = date.fromisoformat(args[0])
+            end = date.fromisoformat(args[1]) if len(args) > 1 else date.today()
+    except ValueError:
+        await message.answer(
+            "Используйте: /history, /history 2 (страница)\n"
+            "или /history 2025-01-01 2025-01-31 [страница] (период)"
+        )
+        return
+
+    lo, hi = history.span(
+        start.toordinal() if start else None,
+        end.toordinal() if end else None,
+    )
+    if lo == hi:
+        await message.answer("За этот период записей нет.")
+        return
+
+    # страницы считаем с конца: первая — самые свежие дни
+    pages = (hi - lo + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE
+    page = min(page, pages)
+    page_hi = hi - (page - 1) * HISTORY_PAGE_SIZE
+    page_lo = max(lo, page_hi - HISTORY_PAGE_SIZE)
+
+    text = f"📅 История (стр. {page}/{pages}):\n"
+    for d, water, calories, burned in history.rows(page_lo, page_hi):
+        text += f"{d} — 💧 {water:.0f} мл, 🍽 {calories:.0f} ккал, 🔥 {burned:.0f} ккал\n"
+    if page < pages:
+        period = f"{start} {end} " if start else ""
+        text += f"\nДальше: /history {period}{page + 1}"
     await message.answer(text)
 
+# =========================
+# /stats <week/month/year>
+# =========================
+@router.message(Command("stats"))
+async def show_stats(message: Message):
+    args = message.text.split()
+    period = args[1] if len(args) > 1 else "week"
+    if period not in rollups.PERIODS:
+        await message.answer("Используйте: /stats week, /stats month или /stats year")
+        return
+
+    uid = str(message.from_user.id)
+    if uid not in users:
+        await message.answer("Сначала настройте профиль /set_profile")
+        return
+
+    check_daily_reset(uid)
+    bucket = rollups.get_bucket(users[uid], period)
+    if not bucket:
+        await message.answer("За этот период завершённых дней пока нет.")
+        return
+    await message.answer(rollups.format_stats(period, bucket))
+
 # =========================
 # /plot <metric>
 # =========================
@@ -436,35 +616,75 @@ async def plot_metric(message: Message):
         return
 
     # История за последние 7 дней
-    history_dict = u.get("history", {})
-    sorted_dates = sorted(history_dict.keys())
-    last_dates = sorted_dates[-7:]
-    values = [history_dict[d].get(metric, 0) for d in last_dates]
+    history = u.history
+    lo = max(0, len(history) - 7)
+    last_dates = [str(date.fromordinal(d)) for d in history.days[lo:]]
+    values = history.column(metric)[lo:].tolist()
 
     # Добавляем текущий день
     today_str = str(date.today())
     if today_str not in last_dates:
         last_dates.append(today_str)
-        current_value = u.get(f"logged_{metric}" if metric != "burned" else "burned_calories", 0)
-        values.append(current_value)
+        values.append(getattr(u.today, metric))
         if len(last_dates) > 7:
             last_dates = last_dates[-7:]
             values = values[-7:]
 
-    # Рисуем график
-    plt.figure(figsize=(8, 4))
-    plt.plot(last_dates, values, marker="o")
-    plt.title(f"{metric.capitalize()} за последние {len(last_dates)} дней")
-    plt.xlabel("Дата")
-    plt.ylabel(metric.capitalize())
-    plt.grid(True)
-    plt.tight_layout()
-
-    # Сохраняем в временный файл
-    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmpfile:
-        plt.savefig(tmpfile.name)
-        tmpfile_path = tmpfile.name
-    plt.close()
-
-    photo = FSInputFile(tmpfile_path)
+    # Рисуем график в отдельном процессе, PNG отправляем из памяти
+    png = await render_metric(metric, last_dates, values)
+    photo = BufferedInputFile(png, filename=f"{metric}.png")
     await message.answer_photo(photo=photo, caption=f"📊 {metric.capitalize()} за последние {len(last_dates)} дней")
+
+# =========================
+# /export [csv/jsonl]
+# =========================
+@router.message(Command("export"))
+async def export_history(message: Message):
+    args = message.text.split()
+    fmt = args[1].lower() if len(args) > 1 else "csv"
+    if fmt not in history_export.FORMATS:
+        await message.answer("Используйте: /export csv или /export jsonl")
+        return
+
+    uid = str(message.from_user.id)
+    user = users.get(uid)
+    if not user:
+        await message.answer("Сначала настройте профиль /set_profile")
+        return
+
+    check_daily_reset(uid)
+    # файл генерируется кусками во время отправки, целиком в памяти не собирается
+    await message.answer_document(
+        history_export.user_file(user, fmt),
+        caption=f"📄 История по дням: {len(user.history)} дн. + сегодня",
+    )
+
+
+# =========================
+# /remind <on/off>
+# =========================
+@router.message(Command("remind"))
+async def remind(message: Message):
+    uid = str(message.from_user.id)
+    user = users.get(uid)
+    if not user or not user.water_goal:
+        await message.answer("Сначала настройте профиль /set_profile")
+        return
+
+    args = message.text.split()
+    action = args[1].lower() if len(args) > 1 else None
+    window = f"с {reminders.REMIND_FROM}:00 до {reminders.REMIND_TO}:00"
+    if action == "on":
+        reminders.subscribe(uid, user)
+        save_users(uid)
+        await message.answer(
+            f"🔔 Напоминания включены: напомню {window}, "
+            f"если отстанете от нормы воды больше чем на {reminders.REMIND_BEHIND:.0f} мл."
+        )
+    elif action == "off":
+        reminders.unsubscribe(uid, user)
+        save_users(uid)
+        await message.answer("🔕 Напоминания выключены.")
+    else:
+        status = "включены" if user.remind_next is not None else "выключены"
+        await message.answer(f"Напоминания о воде {status} ({window}).\nИспользуйте: /remind on или /remind off")
@@ -0,0 +1,185 @@
+"""
+Выгрузка и загрузка истории по дням в CSV / JSONL.
+
+/export в боте отправляет историю пользователя документом: файл собирается генератором
+по кускам прямо во время отправки (ExportFile), целиком в памяти его нет.
+
+Для всей базы — при остановленном боте, пачками через storage.store, без загрузки всех сразу:
+    python history_export.py export history.csv            # или .jsonl, можно .gz
+    python history_export.py import history.jsonl          # дни из файла заменяют такие же дни в истории
+Строка файла — один день одного пользователя: uid, date, water, calories, burned.
+"""
+import os
+import csv
+import gzip
+import json
+import argparse
+import itertools
+from datetime import date
+
+from aiogram.types import InputFile
+
+from user_model import UserProfile
+
+FORMATS = ("csv", "jsonl")
+COLUMNS = ("date", "water", "calories", "burned")
+CHUNK_BYTES = 64 * 1024
+EXPORT_CHUNK_USERS = int(os.getenv("EXPORT_CHUNK_USERS", 500))
+
+
+def day_rows(user: UserProfile):
+    """(дата, вода, калории, сожжено) по всем дням истории и за сегодня"""
+    history = user.history
+    # дни только дописываются в конец: берём длину на момент начала выгрузки
+    n = len(history)
+    for i in range(n):
+        yield date.fromordinal(history.days[i]), history.water[i], history.calories[i], history.burned[i]
+    today = user.today
+    if today.day and (not n or today.day > history.days[n - 1]):
+        yield date.fromordinal(today.day), today.water, today.calories, today.burned
+
+
+def _number(value: float):
+    return int(value) if float(value).is_integer() else round(value, 2)
+
+
+def csv_lines(records, uid_column: bool = False):
+    """records — (uid, строка day_rows); без uid_column uid не пишется"""
+    yield ",".join((("uid",) if uid_column else ()) + COLUMNS) + "\n"
+    for uid, (day, water, calories, burned) in records:
+        values = [day.isoformat()] + [str(_number(v)) for v in (water, calories, burned)]
+        yield ",".join(([uid] if uid_column else []) + values) + "\n"
+
+
+def jsonl_lines(records, uid_column: bool = False):
+    for uid, (day, water, calories, burned) in records:
+        row = {"uid": uid} if uid_column else {}
+        row.update(date=day.isoformat(), water=_number(water), calories=_number(calories), burned=_number(burned))
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def lines(fmt: str, records, uid_column: bool = False):
+    return (csv_lines if fmt == "csv" else jsonl_lines)(records, uid_column)
+
+
+def chunks(text_lines, size: int = CHUNK_BYTES):
+    """Склеивает строки в куски по ~size байт"""
+    buffer, length = [], 0
+    for line in text_lines:
+        data = line.encode("utf-8")
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b"".join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+class ExportFile(InputFile):
+    """Документ, который генерируется кусками во время загрузки в Telegram"""
+
+    def __init__(self, make_lines, filename: str):
+        # make_lines — функция: при повторной отправке (RetryAfter) файл генерируется заново
+        super().__init__(filename=filename, chunk_size=CHUNK_BYTES)
+        self.make_lines = make_lines
+
+    async def read(self, bot):
+        for chunk in chunks(self.make_lines(), self.chunk_size):
+            yield chunk
+
+
+def user_file(user: UserProfile, fmt: str) -> ExportFile:
+    return ExportFile(
+        lambda: lines(fmt, ((None, row) for row in day_rows(user))),
+        filename=f"history.{fmt}",
+    )
+
+
+# =========================
+# Вся база: выгрузка и загрузка пачками
+# =========================
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def format_of(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    return "csv" if name.endswith(".csv") else "jsonl"
+
+
+def export_all(store, path: str, chunk_size: int = EXPORT_CHUNK_USERS) -> int:
+    """Пишет историю всех пользователей шарда; возвращает число пользователей"""
+    fmt = format_of(path)
+    count = 0
+
+    def records():
+        nonlocal count
+        for batch in store.iter_users(chunk_size):
+            for uid, data in batch:
+                count += 1
+                user = UserProfile.from_dict(data)
+                for row in day_rows(user):
+                    yield uid, row
+
+    with _open(path, "w") as f:
+        f.writelines(lines(fmt, records(), uid_column=True))
+    return count
+
+
+def read_rows(path: str):
+    """(uid, день toordinal, вода, калории, сожжено) из CSV или JSONL"""
+    with _open(path, "r") as f:
+        rows = csv.DictReader(f) if format_of(path) == "csv" else (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            yield (
+                str(row["uid"]), date.fromisoformat(row["date"]).toordinal(),
+                float(row["water"]), float(row["calories"]), float(row["burned"]),
+            )
+
+
+def import_all(store, path: str, chunk_size: int = EXPORT_CHUNK_USERS) -> int:
+    """
+    Добавляет дни из файла в историю пользователей (день из файла заменяет такой же день),
+    по chunk_size пользователей за раз. Незнакомые пользователи создаются с пустым профилем.
+    Возвращает число изменённых пользователей.
+    """
+    count = 0
+    # строки одного пользователя обычно идут подряд (так пишет export_all)
+    grouped = itertools.groupby(read_rows(path), key=lambda row: row[0])
+    while True:
+        batch = {}
+        for uid, rows in itertools.islice(grouped, chunk_size):
+            batch.setdefault(uid, []).extend(rows)
+        if not batch:
+            return count
+        updated = {}
+        for uid, rows in batch.items():
+            data = store.read_user(uid)
+            user = UserProfile.from_dict(data) if data is not None else UserProfile()
+            for _, day, water, calories, burned in rows:
+                user.history.add(day, water, calories, burned)
+            updated[uid] = user.to_dict()
+        store.write_users(updated)
+        count += len(updated)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка и загрузка истории всех пользователей")
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("path", help="файл .csv или .jsonl (можно .gz)")
+    parser.add_argument("--chunk", type=int, default=EXPORT_CHUNK_USERS, help="пользователей в пачке")
+    args = parser.parse_args()
+
+    from storage import store
+
+    if args.command == "export":
+        print(f"Выгружено пользователей: {export_all(store, args.path, args.chunk)}")
+    else:
+        print(f"Обновлено пользователей: {import_all(store, args.path, args.chunk)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+METRICS = ("water", "calories", "burned")
+
+
+class UserHistory:
+    """
+    История пользователя по дням в колонках:
+    days — порядковые номера дат (date.toordinal), отсортированы по возрастанию,
+    water / calories / burned — значения за соответствующий день.
+    Поиск по диапазону дат — бинарный, O(log n).
+    """
+
+    __slots__ = ("days", "water", "calories", "burned")
+
+    def __init__(self):
+        self.days = array("i")
+        self.water = array("d")
+        self.calories = array("d")
+        self.burned = array("d")
+
+    def __len__(self):
+        return len(self.days)
+
+    def add(self, day: int, water: float, calories: float, burned: float):
+        """Записывает итоги дня; повторная запись того же дня заменяет значения"""
+        # обычно день новее всех сохранённых — просто дописываем в конец
+        if not self.days or day > self.days[-1]:
+            self.days.append(day)
+            self.water.append(water)
+            self.calories.append(calories)
+            self.burned.append(burned)
+            return
+        i = bisect_left(self.days, day)
+        if i < len(self.days) and self.days[i] == day:
+            self.water[i] = water
+            self.calories[i] = calories
+            self.burned[i] = burned
+        else:
+            self.days.insert(i, day)
+            self.water.insert(i, water)
+            self.calories.insert(i, calories)
+            self.burned.insert(i, burned)
+
+    def span(self, start: int = None, end: int = None):
+        """Индексы [lo, hi) дней в диапазоне start..end включительно"""
+        lo = 0 if start is None else bisect_left(self.days, start)
+        hi = len(self.days) if end is None else bisect_right(self.days, end)
+        return lo, max(lo, hi)
+
+    def rows(self, lo: int, hi: int):
+        """[(date, water, calories, burned), ...] для индексов lo..hi"""
+        return [
+            (date.fromordinal(self.days[i]), self.water[i], self.calories[i], self.burned[i])
+            for i in range(lo, hi)
+        ]
+
+    def range(self, start: date = None, end: date = None):
+        lo, hi = self.span(
+            start.toordinal() if start else None,
+            end.toordinal() if end else None,
+        )
+        return self.rows(lo, hi)
+
+    def last(self, n: int):
+        return self.rows(max(0, len(self.days) - n), len(self.days))
+
+    def column(self, metric: str) -> array:
+        return getattr(self, metric)
+
+    # сериализация: колонки списками, чтобы журнал мог писать только дописанный хвост
+    def to_dict(self) -> dict:
+        return {
+            "days": self.days.tolist(),
+            "water": self.water.tolist(),
+            "calories": self.calories.tolist(),
+            "burned": self.burned.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UserHistory":
+        history = cls()
+        if not data:
+            return history
+        if "days" in data:
+            history.days = array("i", data["days"])
+            history.water = array("d", data["water"])
+            history.calories = array("d", data["calories"])
+            history.burned = array("d", data["burned"])
+            return history
+        # старый формат: {"2025-01-31": {"water": ..., "calories": ..., "burned": ...}}
+        for day, stats in sorted(data.items()):
+            history.add(
+                date.fromisoformat(day).toordinal(),
+                stats.get("water", 0), stats.get("calories", 0), stats.get("burned", 0),
+            )
+        return history
+
+
+def history_of(user: dict) -> UserHistory:
+    """История пользователя; записи без истории или в старом формате приводятся к UserHistory"""
+    history = user.get("history")
+    if not isinstance(history, UserHistory):
+        history = UserHistory.from_dict(history)
+        user["history"] = history
+    return history
@@ -0,0 +1,135 @@
+"""
+Inline-режим: «@bot гречка» в любом чате показывает калорийность по мере набора.
+
+Inline-запрос приходит на каждую набранную букву, поэтому:
+- результаты кэшируются по тексту запроса, общие для всех пользователей;
+- если более короткий запрос нашёлся в локальном индексе и результатов меньше INLINE_LIMIT,
+  это полный список, и ответ на «гречка ядрица» отбирается из ответа на «гречка» без поиска
+  (у полнотекстового поиска OpenFoodFacts такой гарантии нет);
+- в поиск (food_api.search_food) запрос уходит, только если пользователь перестал
+  печатать на INLINE_DEBOUNCE секунд: новый запрос того же пользователя отменяет ожидающий;
+- Telegram получает cache_time и сам не присылает повторы того же запроса.
+Свои продукты пользователя (favorites.py) показываются первыми, а на пустой запрос — только они.
+"""
+import os
+import asyncio
+import logging
+
+from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent
+
+from cache import TTLCache
+from food_api import lookup_food, normalize_query, FOOD_CACHE_TTL
+import food_log
+import favorites
+import metrics
+
+logger = logging.getLogger(__name__)
+
+INLINE_LIMIT = int(os.getenv("INLINE_LIMIT", 10))
+# короче — только свои продукты: двухбуквенный префикс совпадает с огромной долей базы
+INLINE_MIN_CHARS = int(os.getenv("INLINE_MIN_CHARS", 3))
+INLINE_DEBOUNCE = float(os.getenv("INLINE_DEBOUNCE", 0.3))
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", 20000))
+# сколько секунд Telegram может отдавать наш ответ сам; личные ответы меняются чаще
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 300))
+INLINE_PERSONAL_CACHE_TIME = int(os.getenv("INLINE_PERSONAL_CACHE_TIME", 10))
+
+# запрос -> ([(название, ккал), ...], из локального индекса ли ответ)
+_results = TTLCache(maxsize=INLINE_CACHE_SIZE, ttl=FOOD_CACHE_TTL)
+_pending = {}   # id пользователя -> задача, ждущая паузы в наборе
+
+inline_queries = metrics.Counter(
+    "bot_inline_queries_total", "Inline-запросов по тому, откуда взят ответ", ("source",),
+)
+
+
+def cached(query: str):
+    """Результаты без поиска или None: из кэша запроса или из полного ответа на его начало"""
+    entry = _results.get(query)
+    if entry is not None:
+        inline_queries.inc("cache")
+        return entry[0]
+    for end in range(len(query) - 1, INLINE_MIN_CHARS - 1, -1):
+        entry = _results.get(query[:end])
+        if entry is None:
+            continue
+        prefix, local = entry
+        if not local or len(prefix) >= INLINE_LIMIT:
+            # список может быть неполным
+            continue
+        result = [item for item in prefix if food_log.matches(query, item[0])]
+        if not result:
+            # не запоминаем: в индексе нет, но поиск ещё спросит OpenFoodFacts
+            return None
+        _results.set(query, (result, True))
+        inline_queries.inc("prefix")
+        return result
+    return None
+
+
+def _articles(results: list, starred: int = 0) -> list:
+    articles = []
+    seen = set()
+    for i, (name, calories) in enumerate(results):
+        if name in seen:
+            continue
+        seen.add(name)
+        articles.append(InlineQueryResultArticle(
+            id=str(i),
+            title=f"{'⭐ ' if i < starred else ''}{name}",
+            description=f"{calories} ккал/100г",
+            input_message_content=InputTextMessageContent(message_text=f"🍽 {name} — {calories} ккал/100г"),
+        ))
+    return articles
+
+
+async def _answer(inline_query: InlineQuery, own: list, results: list):
+    await inline_query.answer(
+        _articles(own + results, starred=len(own)),
+        cache_time=INLINE_PERSONAL_CACHE_TIME if own else INLINE_CACHE_TIME,
+        is_personal=bool(own),
+    )
+
+
+async def handle(inline_query: InlineQuery, user=None):
+    """Отвечает сразу, если поиск не нужен, иначе откладывает поиск до паузы в наборе"""
+    uid = inline_query.from_user.id
+    waiting = _pending.pop(uid, None)
+    if waiting is not None:
+        # пользователь допечатал запрос — старый уже не нужен
+        waiting.cancel()
+        inline_queries.inc("debounced")
+
+    query = normalize_query(inline_query.query)
+    own = []
+    if user is not None:
+        own = favorites.find(user, query) if query else favorites.top(user)
+    if len(query) < INLINE_MIN_CHARS:
+        inline_queries.inc("short")
+        await _answer(inline_query, own, [])
+        return
+    results = cached(query)
+    if results is not None:
+        await _answer(inline_query, own, results)
+        return
+    task = asyncio.create_task(_search_later(inline_query, query, own))
+    _pending[uid] = task
+    task.add_done_callback(lambda t: _pending.get(uid) is t and _pending.pop(uid))
+
+
+async def _search_later(inline_query: InlineQuery, query: str, own: list):
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    inline_queries.inc("search")
+    results, source = await lookup_food(query, limit=INLINE_LIMIT)
+    if results:
+        # пустой ответ может быть и сбоем API — его не запоминаем
+        _results.set(query, (results, source == "local"))
+    try:
+        await _answer(inline_query, own, results)
+    except Exception as e:
+        # запрос мог устареть, пока шёл поиск (Telegram ждёт ответ не дольше ~10 с)
+        logger.warning("Не удалось ответить на inline-запрос %r: %r", query, e)
+
+
+def cache_stats() -> dict:
+    return _results.stats()
@@ -0,0 +1,91 @@
+"""
+Сколько памяти занимает один пользователь: старые словари против UserProfile.
+
+    python memory_benchmark.py --users 100000 --days 30
+
+«До» — запись в прежнем виде: словарь с ключами-строками и история словарём словарей
+{"2025-01-31": {"water": ..., "calories": ..., "burned": ...}}.
+«После» — UserProfile со счётчиками дня и колоночной историей.
+«В боте» — всё, что процесс держит на загруженного пользователя: UserProfile в storage.users
+и копию сохранённого состояния в JournaledStore._shadow, от которой считаются дельты.
+Считается всё, что выделено при построении записей (tracemalloc), делённое на число пользователей.
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+from datetime import date, timedelta
+
+from storage_engine import _dumps, snapshot_user
+from user_model import UserProfile
+
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург"]
+
+
+def legacy_record(rng: random.Random, days: int) -> dict:
+    today = date.today()
+    history = {}
+    for i in range(days, 0, -1):
+        history[str(today - timedelta(days=i))] = {
+            "water": float(rng.randint(500, 3000)),
+            "calories": float(rng.randint(1200, 3000)),
+            "burned": float(rng.randint(0, 600)),
+        }
+    return {
+        "weight": float(rng.randint(50, 110)), "height": float(rng.randint(150, 200)),
+        "age": rng.randint(18, 70), "activity": rng.randint(0, 120),
+        # города приходят из JSON — отдельной строкой у каждого пользователя
+        "city": "".join(rng.choice(CITIES)), "sex": "".join(rng.choice(["male", "female"])),
+        "water_goal": float(rng.randint(1500, 3500)), "calorie_goal": float(rng.randint(1500, 3000)),
+        "logged_water": float(rng.randint(0, 2000)), "logged_calories": float(rng.randint(0, 2000)),
+        "burned_calories": float(rng.randint(0, 500)), "last_update": str(today),
+        "history": history,
+    }
+
+
+def measure(build, n: int) -> float:
+    """build(i) — кортеж значений пользователя, каждое в своём словаре uid -> значение (как users и _shadow)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tables = {}
+    for i in range(n):
+        uid = str(100000 + i)
+        for column, value in enumerate(build(i)):
+            tables.setdefault(column, {})[uid] = value
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tables
+    return (after - before) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память на одного пользователя")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=30, help="дней истории у каждого")
+    args = parser.parse_args()
+
+    # одни и те же исходные данные для обоих вариантов
+    rng = random.Random(42)
+    records = [legacy_record(rng, args.days) for _ in range(args.users)]
+    import copy
+
+    old = measure(lambda i: (copy.deepcopy(records[i]),), args.users)
+    new = measure(lambda i: (UserProfile.from_dict(records[i]),), args.users)
+
+    def loaded(i):
+        user = UserProfile.from_dict(records[i])
+        return user, _dumps(snapshot_user(user))
+
+    bot = measure(loaded, args.users)
+
+    print(f"Пользователей: {args.users}, дней истории: {args.days}")
+    print(f"Словари (до):     {old:8.0f} байт/пользователь")
+    print(f"UserProfile (после): {new:8.0f} байт/пользователь ({new / old:.0%})")
+    print(f"В боте (users + _shadow): {bot:8.0f} байт/пользователь")
+    print(f"На 1 млн пользователей: {old * 1e6 / 2**20:.0f} МБ -> {new * 1e6 / 2**20:.0f} МБ, "
+          f"в боте {bot * 1e6 / 2**20:.0f} МБ")
+
+
+if __name__ == "__main__":
+    main()
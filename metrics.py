@@ -0,0 +1,147 @@
+"""
+Метрики в текстовом формате Prometheus (GET /metrics), без внешних зависимостей.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+
+
+def _labels(names, values, extra=""):
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, *labels, value: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.label_names, labels)} {value}"
+
+
+class CounterFunc:
+    """Счётчик, который ведёт сам объект (очередь, кэш); значение берётся в момент запроса /metrics"""
+
+    def __init__(self, name: str, help: str, func):
+        self.name = name
+        self.help = help
+        self.func = func
+        _registry.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        yield f"{self.name} {self.func()}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [counts по корзинам..., sum, count]
+        _registry.append(self)
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        i = bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _labels(self.label_names, labels, f'le="{bound}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            le = _labels(self.label_names, labels, 'le="+Inf"')
+            yield f"{self.name}_bucket{le} {series[-1]}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {series[-2]}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {series[-1]}"
+
+
+class Gauge:
+    """Значение считается в момент запроса /metrics"""
+
+    def __init__(self, name: str, help: str, func):
+        self.name = name
+        self.help = help
+        self.func = func
+        _registry.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {self.func()}"
+
+
+handler_latency = Histogram("bot_handler_latency_seconds", "Время работы хендлера", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Исключения в хендлерах", ("handler",))
+dependency_latency = Histogram("bot_dependency_latency_seconds", "Время вызова внешней зависимости", ("dependency",))
+dependency_errors = Counter("bot_dependency_errors_total", "Ошибки внешних зависимостей", ("dependency",))
+
+
+@contextmanager
+def track(dependency: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        dependency_errors.inc(dependency)
+        raise
+    finally:
+        dependency_latency.observe(time.perf_counter() - started, dependency)
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: знает, какой хендлер выбран, и замеряет его"""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def handle(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
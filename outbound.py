@@ -0,0 +1,211 @@
+"""
+Исходящие запросы к Telegram: ограничение частоты, приоритеты и повтор после RetryAfter.
+
+Подключается middleware сессии бота (bot.session.middleware(SendLimiter())),
+поэтому действует на все message.answer / answer_photo / send_message без правок хендлеров.
+
+Лимиты — token bucket: общий на бота (SEND_RATE в секунду) и свой на каждый чат
+(SEND_CHAT_RATE для личных чатов, SEND_GROUP_RATE для групп). Когда общего лимита
+не хватает, первыми проходят ответы пользователям, а рассылки (напоминания) ждут:
+    with outbound.bulk():
+        await bot.send_message(...)
+На TelegramRetryAfter чат ставится на паузу на указанное время, и запрос повторяется
+(до SEND_MAX_RETRIES раз).
+"""
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 0 — без ограничения
+SEND_RATE = float(os.getenv("SEND_RATE", 25))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", 1))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", 3))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", 20 / 60))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 3))
+# дольше этого RetryAfter не ждём, а отдаём ошибку хендлеру
+SEND_MAX_RETRY_AFTER = float(os.getenv("SEND_MAX_RETRY_AFTER", 60))
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+_priority = ContextVar("send_priority", default=INTERACTIVE)
+
+send_latency = metrics.Histogram(
+    "bot_send_latency_seconds", "Время отправки в Telegram вместе с ожиданием лимитов",
+    ("method", "priority"),
+)
+send_wait = metrics.Histogram(
+    "bot_send_wait_seconds", "Сколько запрос ждал лимитов", ("priority",),
+)
+send_retry_after = metrics.Counter(
+    "bot_send_retry_after_total", "Ответов RetryAfter от Telegram", ("method",),
+)
+
+
+@contextmanager
+def bulk():
+    """Отправки внутри блока — рассылка: уступают ответам пользователям"""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst в запасе; acquire — с приоритетами"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._waiters = []      # (приоритет, порядковый номер, future)
+        self._seq = itertools.count()
+        self._pump_task = None
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds: float):
+        until = time.monotonic() + seconds
+        if until > self.paused_until:
+            # за время паузы токены не копятся
+            self.paused_until = until
+            self.updated = until
+            self.tokens = min(self.tokens, 0)
+
+    def _delay(self, now: float) -> float:
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def acquire(self, priority: int = INTERACTIVE):
+        now = time.monotonic()
+        if not self._waiters and self._delay(now) == 0:
+            self.tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        # раздаёт токены ожидающим по приоритету, пока очередь не опустеет
+        while self._waiters:
+            delay = self._delay(time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.tokens -= 1
+                future.set_result(None)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def idle(self) -> bool:
+        now = time.monotonic()
+        if self._waiters or now < self.paused_until:
+            return False
+        self._refill(now)
+        return self.tokens >= self.burst - 1e-9
+
+
+class SendLimiter(BaseRequestMiddleware):
+    """Middleware сессии: лимиты перед отправкой в чат и повтор после RetryAfter"""
+
+    def __init__(self, rate: float = SEND_RATE, chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: float = SEND_CHAT_BURST, group_rate: float = SEND_GROUP_RATE,
+                 max_chats: int = 100000):
+        self.global_bucket = TokenBucket(rate, max(1.0, rate)) if rate > 0 else None
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            self._chats.move_to_end(chat_id)
+            return bucket
+        group = isinstance(chat_id, str) or chat_id < 0
+        rate = self.group_rate if group else self.chat_rate
+        if rate <= 0:
+            return None
+        bucket = self._chats[chat_id] = TokenBucket(rate, 1 if group else self.chat_burst)
+        # забываем самые давние чаты, у которых никто не ждёт и запас полный
+        while len(self._chats) > self.max_chats:
+            oldest, old_bucket = next(iter(self._chats.items()))
+            if not old_bucket.idle:
+                break
+            del self._chats[oldest]
+        return bucket
+
+    async def _acquire(self, chat_id, priority: int):
+        chat = self._chat_bucket(chat_id)
+        if chat is not None:
+            await chat.acquire(priority)
+        if self.global_bucket is not None:
+            await self.global_bucket.acquire(priority)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # служебные запросы (getWebhookInfo, answerCallbackQuery...) лимитами не ограничиваем
+            return await self._send(make_request, bot, method, None, INTERACTIVE)
+        priority = _priority.get()
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await self._send(make_request, bot, method, chat_id, priority)
+        finally:
+            send_latency.observe(time.perf_counter() - started, name, PRIORITY_NAMES[priority])
+
+    async def _send(self, make_request, bot, method, chat_id, priority: int):
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            if chat_id is not None:
+                waited = time.perf_counter()
+                await self._acquire(chat_id, priority)
+                send_wait.observe(time.perf_counter() - waited, PRIORITY_NAMES[priority])
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                send_retry_after.inc(type(method).__name__)
+                if attempt == SEND_MAX_RETRIES or e.retry_after > SEND_MAX_RETRY_AFTER:
+                    raise
+                logger.warning("RetryAfter %s с: %s в чат %s, попытка %d",
+                               e.retry_after, type(method).__name__, chat_id, attempt + 1)
+                if chat_id is not None:
+                    bucket = self._chat_bucket(chat_id)
+                    if bucket is not None:
+                        bucket.pause(e.retry_after)
+                        continue
+                await asyncio.sleep(e.retry_after)
+
+    @property
+    def waiting(self) -> int:
+        """Сколько запросов ждут общего лимита"""
+        return self.global_bucket.waiting if self.global_bucket is not None else 0
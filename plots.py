@@ -0,0 +1,90 @@
+import os
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+PLOT_WORKERS = int(os.getenv("PLOT_WORKERS", 2))
+PLOT_CACHE_SIZE = int(os.getenv("PLOT_CACHE_SIZE", 500))
+
+_pool = None
+_pool_lock = threading.Lock()   # warm_up создаёт пул из потока executor'а
+_cache = TTLCache(maxsize=PLOT_CACHE_SIZE, ttl=24 * 3600)
+
+
+def render_png(metric: str, dates, values) -> bytes:
+    """Рисует график в PNG. Выполняется в отдельном процессе"""
+    # объектный API без pyplot: никакого глобального состояния, потокобезопасно
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from io import BytesIO
+
+    fig = Figure(figsize=(8, 4))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(dates, values, marker="o")
+    ax.set_title(f"{metric.capitalize()} за последние {len(dates)} дней")
+    ax.set_xlabel("Дата")
+    ax.set_ylabel(metric.capitalize())
+    ax.grid(True)
+    fig.tight_layout()
+
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # не fork: к этому моменту в боте уже работают потоки executor'а и aiohttp,
+            # а fork многопоточного процесса может оставить в потомке захваченные блокировки
+            # (и потомок получил бы всю память бота). Процессы рисования форкаются
+            # от однопоточного forkserver, в котором matplotlib уже импортирован. Главный модуль
+            # (bot.py) потомки импортируют заново, поэтому он ничего не делает при импорте.
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["plots", "matplotlib.figure", "matplotlib.backends.backend_agg"])
+            _pool = ProcessPoolExecutor(max_workers=PLOT_WORKERS, mp_context=context)
+        return _pool
+
+
+def warm_up():
+    """
+    Поднимает все PLOT_WORKERS процессов рисования. Запуск forkserver ждёт импорта matplotlib
+    (секунда-две), поэтому в боте вызывается в executor при старте.
+    """
+    pool = _get_pool()
+    # процессы создаются по мере надобности: одновременные задачи поднимают их все
+    futures = [pool.submit(render_png, "warmup", ["0"], [0]) for _ in range(PLOT_WORKERS)]
+    try:
+        for future in futures:
+            future.result()
+    except Exception as e:
+        logger.warning("Не удалось прогреть процессы рисования: %r", e)
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def render_metric(metric: str, dates, values) -> bytes:
+    """PNG графика; одинаковые данные рисуются один раз"""
+    key = hashlib.sha1(json.dumps([metric, list(dates), list(values)]).encode()).hexdigest()
+    png = _cache.get(key)
+    if png is not None:
+        return png
+    loop = asyncio.get_running_loop()
+    png = await loop.run_in_executor(_get_pool(), render_png, metric, list(dates), list(values))
+    _cache.set(key, png)
+    return png
@@ -0,0 +1,249 @@
+"""
+Напоминания о воде (/remind on): «вы отстаёте от нормы на сегодня на 800 мл».
+
+Норма воды распределяется равномерно по активным часам REMIND_FROM..REMIND_TO
+(по времени сервера). Для каждого подписчика заранее считается момент, когда отставание
+дойдёт до REMIND_BEHIND мл (next_due), и этот момент кладётся в кучу.
+Планировщик спит до ближайшего срока и будит только тех, чей срок наступил:
+постановка и перенос — O(log n), всех пользователей он не перебирает.
+
+Срок хранится в записи пользователя (remind_next), а расписание всех подписчиков шарда
+ещё и отдельным объектом reminders/<шард>.json рядом с хранилищем: при старте бот
+восстанавливает кучу из него, не загружая пользователей.
+"""
+import os
+import time
+import heapq
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+
+import storage
+import outbound
+from storage_engine import _dumps, _loads
+
+logger = logging.getLogger(__name__)
+
+REMIND_FROM = int(os.getenv("REMIND_FROM", 9))
+REMIND_TO = int(os.getenv("REMIND_TO", 21))
+# отставание, с которого стоит напоминать, и минимальный промежуток между напоминаниями
+REMIND_BEHIND = float(os.getenv("REMIND_BEHIND", 300))
+REMIND_INTERVAL = float(os.getenv("REMIND_INTERVAL", 2 * 3600))
+# как часто сохранять расписание, если оно менялось
+REMIND_INDEX_EVERY = float(os.getenv("REMIND_INDEX_EVERY", 300))
+
+INDEX_KEY = f"{storage.store.prefix}reminders/{storage.store.shard}.json"
+
+_heap = []          # (срок, uid); устаревшие записи пропускаются при извлечении
+_due = {}           # uid -> актуальный срок
+_wakeup = None
+_task = None
+_bot = None
+_index_dirty = False
+
+
+# =========================
+# Когда напоминать
+# =========================
+def _window(day: datetime):
+    start = day.replace(hour=REMIND_FROM, minute=0, second=0, microsecond=0)
+    return start, day.replace(hour=REMIND_TO, minute=0, second=0, microsecond=0)
+
+
+def _jitter(uid: str) -> float:
+    # подписчики с одинаковыми данными не должны просыпаться в одну секунду
+    return int(uid) % 600 if uid.lstrip("-").isdigit() else 0
+
+
+def logged_today(user, now: datetime) -> float:
+    # счётчики ещё за вчера, если пользователь сегодня ничего не делал
+    return user.today.water if user.today.day == now.toordinal() else 0
+
+
+def behind(user, now: datetime) -> float:
+    """На сколько мл пользователь отстаёт от равномерного графика на сегодня"""
+    start, end = _window(now)
+    if not user.water_goal or now <= start:
+        return 0
+    share = min(1.0, (now - start) / (end - start))
+    return max(0.0, user.water_goal * share - logged_today(user, now))
+
+
+def next_due(uid: str, user, now: datetime, reminded: bool = False) -> float:
+    """Unix-время следующей проверки"""
+    start, end = _window(now)
+    jitter = _jitter(uid)
+    tomorrow = start + timedelta(days=1, seconds=REMIND_INTERVAL + jitter)
+    if not user.water_goal or now >= end:
+        return tomorrow.timestamp()
+    earliest = now + timedelta(seconds=REMIND_INTERVAL if reminded else 0)
+    # момент, когда график обгонит выпитое на REMIND_BEHIND
+    need = logged_today(user, now) + REMIND_BEHIND
+    if need >= user.water_goal:
+        return tomorrow.timestamp()
+    due = start + (end - start) * (need / user.water_goal) + timedelta(seconds=jitter)
+    due = max(due, earliest)
+    return (due if due < end else tomorrow).timestamp()
+
+
+# =========================
+# Расписание
+# =========================
+def schedule(uid: str, due: float):
+    global _index_dirty
+    if _due.get(uid) == due:
+        return
+    _due[uid] = due
+    heapq.heappush(_heap, (due, uid))
+    _index_dirty = True
+    if len(_heap) > 2 * len(_due) + 1000:
+        _rebuild_heap()
+    if _wakeup is not None and _heap[0] == (due, uid):
+        _wakeup.set()
+
+
+def cancel(uid: str):
+    global _index_dirty
+    if _due.pop(uid, None) is not None:
+        _index_dirty = True
+
+
+def _rebuild_heap():
+    # после множества переносов в куче копятся устаревшие записи
+    _heap[:] = [(due, uid) for uid, due in _due.items()]
+    heapq.heapify(_heap)
+
+
+def subscribe(uid: str, user):
+    user.remind_next = next_due(uid, user, datetime.now())
+    schedule(uid, user.remind_next)
+
+
+def unsubscribe(uid: str, user):
+    user.remind_next = None
+    cancel(uid)
+
+
+def update(uid: str, user):
+    """Пересчитывает срок после изменения выпитого или нормы"""
+    if user.remind_next is None:
+        return
+    user.remind_next = next_due(uid, user, datetime.now())
+    schedule(uid, user.remind_next)
+
+
+def count() -> int:
+    return len(_due)
+
+
+# =========================
+# Отправка
+# =========================
+async def _fire(uid: str):
+    await storage.ensure_loaded(uid)
+    user = storage.users.get(uid)
+    if user is None or user.remind_next is None:
+        cancel(uid)
+        return
+    now = datetime.now()
+    lag = behind(user, now)
+    reminded = False
+    if lag >= REMIND_BEHIND:
+        try:
+            # рассылка: уступает ответам пользователям в общем лимите отправки
+            with outbound.bulk():
+                await _bot.send_message(
+                    int(uid),
+                    f"💧 Вы отстаёте от нормы воды на сегодня на {lag:.0f} мл.\n"
+                    f"Выпито {logged_today(user, now):.0f} из {user.water_goal:.0f} мл. /log_water\n"
+                    f"Выключить напоминания: /remind off",
+                )
+            reminded = True
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # бот заблокирован или чат недоступен — больше не напоминаем
+            logger.info("Напоминания для %s выключены: %s", uid, e)
+            unsubscribe(uid, user)
+            storage.save_users(uid)
+            return
+    user.remind_next = next_due(uid, user, now, reminded)
+    schedule(uid, user.remind_next)
+    storage.save_users(uid)
+
+
+async def _run():
+    global _index_dirty
+    saved_at = time.monotonic()
+    while True:
+        now = time.time()
+        while _heap and _heap[0][0] <= now:
+            due, uid = heapq.heappop(_heap)
+            if _due.get(uid) != due:
+                continue
+            del _due[uid]
+            _index_dirty = True
+            try:
+                await _fire(uid)
+            except Exception:
+                logger.exception("Ошибка напоминания для %s", uid)
+                schedule(uid, now + REMIND_INTERVAL)
+        if _index_dirty and time.monotonic() - saved_at >= REMIND_INDEX_EVERY:
+            await save_index()
+            saved_at = time.monotonic()
+        timeout = REMIND_INDEX_EVERY
+        if _heap:
+            timeout = min(timeout, max(0.0, _heap[0][0] - time.time()))
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+# =========================
+# Сохранение расписания
+# =========================
+async def load_index():
+    loop = asyncio.get_running_loop()
+    body = await loop.run_in_executor(None, storage.store.backend.get, INDEX_KEY)
+    if body is None:
+        return
+    # сроки, поставленные до загрузки (апдейты уже обрабатываются), новее сохранённых
+    for uid, due in _loads(body).items():
+        _due.setdefault(uid, due)
+    _rebuild_heap()
+    logger.info("Напоминания: %d подписчиков", len(_due))
+
+
+async def save_index():
+    global _index_dirty
+    _index_dirty = False
+    body = _dumps(dict(_due))
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, storage.store.backend.put, INDEX_KEY, body)
+    except Exception:
+        _index_dirty = True
+        logger.exception("Не удалось сохранить расписание напоминаний")
+
+
+async def start(bot):
+    global _bot, _wakeup, _task
+    _bot = bot
+    _wakeup = asyncio.Event()
+    await load_index()
+    _task = asyncio.create_task(_run())
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    if _index_dirty:
+        await save_index()
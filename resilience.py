@@ -0,0 +1,185 @@
+"""
+Общая обвязка внешних API (OpenFoodFacts, OpenWeather): бюджет времени, hedged-запросы,
+circuit breaker и stale-while-revalidate.
+
+    upstream = Upstream("search_food", budget=1.5, fresh_ttl=24 * 3600, stale_ttl=7 * 24 * 3600)
+    result = await upstream.get(key, lambda: fetch(...))   # значение или None
+
+- Ответ ждём не дольше budget секунд. Запрос при этом не отменяется: если он всё же
+  завершится, результат попадёт в кэш и пригодится следующему пользователю.
+- Если первый запрос не ответил за p95 последних ответов, параллельно уходит второй,
+  берётся тот, что ответит раньше.
+- Когда большая часть последних вызовов — ошибки или дольше бюджета, breaker размыкается,
+  и cooldown секунд запросы наверх не идут вовсе; потом пробуется один.
+- Устаревшее значение (старше fresh_ttl, но моложе stale_ttl) отдаётся сразу,
+  а обновление идёт в фоне; пока API недоступен, пользователи получают последнее известное.
+"""
+import time
+import asyncio
+import logging
+from collections import deque
+
+from cache import TTLCache, SingleFlight
+import metrics
+
+logger = logging.getLogger(__name__)
+
+hedged_requests = metrics.Counter(
+    "bot_upstream_hedged_total", "Повторных (hedged) запросов к внешнему API", ("upstream",))
+budget_exceeded = metrics.Counter(
+    "bot_upstream_budget_exceeded_total", "Ответ не уложился в бюджет времени", ("upstream",))
+stale_served = metrics.Counter(
+    "bot_upstream_stale_served_total", "Отдано устаревшее значение из кэша", ("upstream",))
+short_circuited = metrics.Counter(
+    "bot_upstream_short_circuited_total", "Вызовов без запроса наверх: breaker разомкнут", ("upstream",))
+
+
+class LatencyWindow:
+    """Время последних ответов для оценки p95"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self._values = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds: float):
+        self._values.append(seconds)
+
+    def percentile(self, q: float):
+        if len(self._values) < self.min_samples:
+            return None
+        ordered = sorted(self._values)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class CircuitBreaker:
+    """
+    closed — запросы идут; open — не идут до истечения cooldown;
+    после cooldown пропускается один пробный запрос (half-open).
+    """
+
+    def __init__(self, window: int = 20, min_calls: int = 10, threshold: float = 0.5,
+                 cooldown: float = 30):
+        self._outcomes = deque(maxlen=window)    # True — плохой вызов (ошибка или медленно)
+        self.min_calls = min_calls
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self._probing or time.monotonic() - self.opened_at < self.cooldown:
+            return False
+        self._probing = True
+        return True
+
+    def record(self, bad: bool):
+        if self.opened_at is not None:
+            if not self._probing:
+                return
+            # результат пробного запроса
+            self._probing = False
+            if bad:
+                self.opened_at = time.monotonic()
+            else:
+                self.opened_at = None
+                self._outcomes.clear()
+            return
+        self._outcomes.append(bad)
+        if (len(self._outcomes) >= self.min_calls
+                and sum(self._outcomes) / len(self._outcomes) >= self.threshold):
+            self.opened_at = time.monotonic()
+            self._outcomes.clear()
+
+
+class Upstream:
+    def __init__(self, name: str, budget: float, fresh_ttl: float, stale_ttl: float,
+                 maxsize: int = 10000, hedge: bool = True, breaker: CircuitBreaker = None):
+        self.name = name
+        self.budget = budget
+        self.fresh_ttl = fresh_ttl
+        self.hedge = hedge
+        self.cache = TTLCache(maxsize=maxsize, ttl=stale_ttl)   # key -> (время получения, значение)
+        self.latency = LatencyWindow()
+        self.breaker = breaker or CircuitBreaker()
+        self._flights = SingleFlight()
+        metrics.Gauge(f"bot_{name}_breaker_open", f"Breaker {name} разомкнут (1) или нет (0)",
+                      lambda: int(self.breaker.is_open))
+
+    def hedge_delay(self) -> float:
+        p95 = self.latency.percentile(95)
+        if p95 is None:
+            return self.budget / 2
+        return min(max(p95, 0.05), self.budget * 0.8)
+
+    async def get(self, key, fetch):
+        """Значение из кэша или из API в пределах бюджета; None — ответа нет"""
+        entry = self.cache.get(key)
+        if entry is not None:
+            fetched_at, value = entry
+            if time.monotonic() - fetched_at >= self.fresh_ttl:
+                stale_served.inc(self.name)
+                self._refresh(key, fetch)
+            return value
+        if not self.breaker.allow():
+            short_circuited.inc(self.name)
+            return None
+        try:
+            return await asyncio.wait_for(self._flights.do(key, lambda: self._call(key, fetch)), self.budget)
+        except asyncio.TimeoutError:
+            budget_exceeded.inc(self.name)
+            logger.warning("%s: нет ответа за %.1f с (%s)", self.name, self.budget, key)
+        except Exception as e:
+            logger.warning("%s недоступен (%s): %r", self.name, key, e)
+        return None
+
+    def _refresh(self, key, fetch):
+        if not self.breaker.allow():
+            return
+        future = asyncio.ensure_future(self._flights.do(key, lambda: self._call(key, fetch)))
+        # ошибку фонового обновления уже залогировал и посчитал _call
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    async def _call(self, key, fetch):
+        started = time.monotonic()
+        try:
+            value = await self._hedged(fetch)
+        except Exception:
+            metrics.dependency_errors.inc(self.name)
+            self.breaker.record(True)
+            raise
+        self.breaker.record(time.monotonic() - started > self.budget)
+        if value is not None:
+            self.cache.set(key, (time.monotonic(), value))
+        return value
+
+    async def _timed(self, fetch):
+        started = time.monotonic()
+        value = await fetch()
+        self.latency.add(time.monotonic() - started)
+        return value
+
+    async def _hedged(self, fetch):
+        tasks = {asyncio.ensure_future(self._timed(fetch))}
+        if self.hedge:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay())
+            if not done:
+                hedged_requests.inc(self.name)
+                tasks.add(asyncio.ensure_future(self._timed(fetch)))
+        error = None
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,99 @@
+"""
+Накопительные итоги по неделям, месяцам и годам.
+
+Итоги обновляются, когда день уходит в историю (check_daily_reset),
+поэтому /stats отвечает за O(1) независимо от длины истории.
+Пересобрать итоги всех пользователей из сырой истории:
+    python rollups.py rebuild
+"""
+from datetime import date
+
+PERIODS = {
+    "week": "неделю",
+    "month": "месяц",
+    "year": "год",
+}
+
+
+def period_key(period: str, day: date) -> str:
+    if period == "week":
+        year, week, _ = day.isocalendar()
+        return f"week:{year}-W{week:02d}"
+    if period == "month":
+        return f"month:{day.year}-{day.month:02d}"
+    return f"year:{day.year}"
+
+
+def _empty_bucket() -> dict:
+    return {
+        "days": 0,
+        "water": 0, "calories": 0, "burned": 0,
+        "water_hits": 0, "calorie_hits": 0, "workout_days": 0,
+    }
+
+
+def add_day(user, day: date, water: float, calories: float, burned: float):
+    """Добавляет закрытый день в итоги его недели, месяца и года (user — UserProfile)"""
+    water_goal = user.water_goal or 0
+    calorie_goal = user.calorie_goal or 0
+    if user.rollups is None:
+        user.rollups = {}
+    rollups = user.rollups
+    for period in PERIODS:
+        key = period_key(period, day)
+        # новый словарь вместо правки на месте: журнал пишет только изменённые корзины
+        bucket = dict(rollups.get(key) or _empty_bucket())
+        bucket["days"] += 1
+        bucket["water"] += water
+        bucket["calories"] += calories
+        bucket["burned"] += burned
+        if water_goal and water >= water_goal:
+            bucket["water_hits"] += 1
+        if calorie_goal and calories <= calorie_goal + burned:
+            bucket["calorie_hits"] += 1
+        if burned > 0:
+            bucket["workout_days"] += 1
+        rollups[key] = bucket
+
+
+def get_bucket(user, period: str, day: date = None):
+    return (user.rollups or {}).get(period_key(period, day or date.today()))
+
+
+def rebuild(user):
+    """Пересчитывает итоги из истории (цели берутся текущие)"""
+    user.rollups = None
+    history = user.history
+    for day, water, calories, burned in history.rows(0, len(history)):
+        add_day(user, day, water, calories, burned)
+
+
+def format_stats(period: str, bucket: dict) -> str:
+    days = bucket["days"]
+    return (
+        f"📈 Статистика за {PERIODS[period]} ({days} дн.):\n"
+        f"💧 Вода: {bucket['water'] / days:.0f} мл/день, всего {bucket['water']:.0f} мл\n"
+        f"🍽 Калории: {bucket['calories'] / days:.0f} ккал/день, всего {bucket['calories']:.0f} ккал\n"
+        f"🔥 Сожжено: {bucket['burned'] / days:.0f} ккал/день, всего {bucket['burned']:.0f} ккал\n"
+        f"🎯 Норма воды выполнена: {bucket['water_hits'] / days:.0%}\n"
+        f"🎯 В пределах калорий: {bucket['calorie_hits'] / days:.0%}\n"
+        f"🏃 Дни с тренировками: {bucket['workout_days'] / days:.0%}"
+    )
+
+
+def main():
+    import sys
+    import storage
+
+    if sys.argv[1:] != ["rebuild"]:
+        print("Использование: python rollups.py rebuild")
+        sys.exit(1)
+    storage.load_users()
+    for user in storage.users.values():
+        rebuild(user)
+    storage.flush_now()
+    print(f"Итоги пересобраны для {len(storage.users)} пользователей")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,9 @@ async def main():
         BotCommand(command="/check_progress", description="Показать прогресс"),
         BotCommand(command="/history", description="История"),
         BotCommand(command="/plot", description="График"),
+        BotCommand(command="/stats", description="Статистика за неделю/месяц/год"),
+        BotCommand(command="/export", description="Выгрузить историю в CSV/JSONL"),
+        BotCommand(command="/remind", description="Напоминания о воде"),
     ])
     await bot.session.close()
 
@@ -0,0 +1,237 @@
+"""
+Компактный бинарный снимок всех пользователей с индексом по id.
+
+Формат (все числа little-endian):
+    заголовок   b"TGSN" | u16 версия | u16 флаги (0)
+    записи      u32 длина | JSON полей без истории (u32 длина + байты)
+                | u32 дней | days int32[n] | water f64[n] | calories f64[n] | burned f64[n]
+    индекс      n × (i64 id | u64 смещение записи | u32 длина), отсортирован по id
+    хвост       u64 смещение индекса | u32 число записей | b"TGSN"
+
+Файл открывается через mmap, id ищется бинарным поиском прямо по индексу в файле,
+декодируется только запись нужного пользователя.
+
+    python snapshot.py migrate users.json users.snap     # из старого JSON
+    python snapshot.py export users.snap users.json      # обратно в JSON
+    python snapshot.py build users.snap                  # из текущего хранилища
+    python snapshot.py get users.snap 123456789
+
+Бот подключает снимок через SNAPSHOT_PATH: он служит нижним слоем под users/<uid>.json
+и журналом, а всё, что изменилось после снимка, по-прежнему пишется в обычное хранилище.
+"""
+import os
+import argparse
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+MAGIC = b"TGSN"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+FOOTER = struct.Struct("<QI4s")
+INDEX_ENTRY = struct.Struct("<qQI")
+U32 = struct.Struct("<I")
+NO_HISTORY = 0xFFFFFFFF
+COLUMNS = ("water", "calories", "burned")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+# =========================
+# Кодирование одной записи
+# =========================
+def encode_user(user: dict) -> bytes:
+    """user — обычный словарь (после snapshot_user): история в колонках-списках"""
+    fields = {k: v for k, v in user.items() if k != "history"}
+    meta = json.dumps(fields, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if "history" not in user:
+        return b"".join([U32.pack(len(meta)), meta, U32.pack(NO_HISTORY)])
+    history = user["history"] or {}
+    if history and "days" not in history:
+        raise SnapshotError("история в старом формате, сначала приведите её через history_of")
+    days = array("i", history.get("days", []))
+    parts = [U32.pack(len(meta)), meta, U32.pack(len(days)), days.tobytes()]
+    for column in COLUMNS:
+        parts.append(array("d", history.get(column, [])).tobytes())
+    return b"".join(parts)
+
+
+def decode_user(buf, offset: int = 0) -> dict:
+    meta_len, = U32.unpack_from(buf, offset)
+    offset += 4
+    user = json.loads(bytes(buf[offset:offset + meta_len]).decode("utf-8"))
+    offset += meta_len
+    n, = U32.unpack_from(buf, offset)
+    offset += 4
+    if n == NO_HISTORY:
+        return user
+    days = array("i")
+    days.frombytes(bytes(buf[offset:offset + 4 * n]))
+    offset += 4 * n
+    history = {"days": days.tolist()}
+    for column in COLUMNS:
+        values = array("d")
+        values.frombytes(bytes(buf[offset:offset + 8 * n]))
+        offset += 8 * n
+        history[column] = values.tolist()
+    user["history"] = history
+    return user
+
+
+# =========================
+# Запись снимка
+# =========================
+def write_snapshot(path: str, users) -> int:
+    """users — итерируемое (uid, user); пишется потоково, в памяти только индекс"""
+    index = []
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0))
+        for uid, user in users:
+            if not str(uid).lstrip("-").isdigit():
+                raise SnapshotError(f"id пользователя должен быть числом: {uid!r}")
+            record = encode_user(user)
+            index.append((int(uid), f.tell(), len(record)))
+            f.write(record)
+        index_offset = f.tell()
+        index.sort()
+        for entry in index:
+            f.write(INDEX_ENTRY.pack(*entry))
+        f.write(FOOTER.pack(index_offset, len(index), MAGIC))
+    os.replace(tmp, path)
+    return len(index)
+
+
+# =========================
+# Чтение снимка
+# =========================
+class SnapshotReader:
+    """Снимок через mmap: открытие O(1), поиск пользователя O(log n), декодируется только он"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise SnapshotError(f"{path}: не снимок пользователей")
+        if version != VERSION:
+            raise SnapshotError(f"{path}: неподдерживаемая версия {version}")
+        self._index_offset, self.count, magic = FOOTER.unpack_from(self._mm, len(self._mm) - FOOTER.size)
+        if magic != MAGIC:
+            raise SnapshotError(f"{path}: файл обрезан")
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, i: int):
+        return INDEX_ENTRY.unpack_from(self._mm, self._index_offset + i * INDEX_ENTRY.size)
+
+    def get(self, uid):
+        uid = str(uid)
+        if not uid.lstrip("-").isdigit():
+            return None
+        key = int(uid)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_key, offset, length = self._entry(mid)
+            if entry_key < key:
+                lo = mid + 1
+            elif entry_key > key:
+                hi = mid
+            else:
+                return decode_user(self._mm, offset)
+        return None
+
+    def uids(self):
+        for i in range(self.count):
+            yield str(self._entry(i)[0])
+
+    def items(self):
+        for i in range(self.count):
+            uid, offset, _ = self._entry(i)
+            yield str(uid), decode_user(self._mm, offset)
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+# =========================
+# Миграция и экспорт
+# =========================
+def _normalized(users: dict):
+    from history_store import history_of
+
+    for uid, user in users.items():
+        if hasattr(user, "to_dict"):
+            yield uid, user.to_dict()
+            continue
+        if "history" in user:
+            history_of(user)
+        yield uid, {k: v.to_dict() if hasattr(v, "to_dict") else v for k, v in user.items()}
+
+
+def migrate(json_path: str, snapshot_path: str) -> int:
+    with open(json_path, encoding="utf-8") as f:
+        users = json.load(f)
+    return write_snapshot(snapshot_path, _normalized(users))
+
+
+def build_from_storage(snapshot_path: str) -> int:
+    """Снимок всех пользователей шарда из текущего хранилища (с учётом журнала)"""
+    import storage
+
+    storage.load_users()
+    return write_snapshot(snapshot_path, _normalized(storage.users))
+
+
+def export_json(snapshot_path: str, json_path: str) -> int:
+    reader = SnapshotReader(snapshot_path)
+    with open(json_path, "w", encoding="utf-8") as f:
+        f.write("{")
+        for i, (uid, user) in enumerate(reader.items()):
+            f.write(("," if i else "") + json.dumps(uid) + ":" + json.dumps(user, ensure_ascii=False))
+        f.write("}")
+    count = len(reader)
+    reader.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бинарный снимок пользователей")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("migrate", help="users.json -> снимок")
+    p.add_argument("json_path")
+    p.add_argument("snapshot_path")
+    p = sub.add_parser("export", help="снимок -> users.json")
+    p.add_argument("snapshot_path")
+    p.add_argument("json_path")
+    p = sub.add_parser("build", help="текущее хранилище -> снимок")
+    p.add_argument("snapshot_path")
+    p = sub.add_parser("get", help="показать одного пользователя")
+    p.add_argument("snapshot_path")
+    p.add_argument("uid")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        print(f"Записано пользователей: {migrate(args.json_path, args.snapshot_path)}")
+    elif args.command == "build":
+        print(f"Записано пользователей: {build_from_storage(args.snapshot_path)}")
+    elif args.command == "export":
+        print(f"Выгружено пользователей: {export_json(args.snapshot_path, args.json_path)}")
+    else:
+        user = SnapshotReader(args.snapshot_path).get(args.uid)
+        if user is None:
+            print("Не найден")
+            sys.exit(1)
+        print(json.dumps(user, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
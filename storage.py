@@ -1,9 +1,17 @@
-import json
 import os
+import asyncio
+import time
+from collections import OrderedDict
 import boto3
 from botocore.client import Config
 import logging
 
+from storage_engine import JournaledStore, LocalDirBackend, S3Backend, snapshot_user
+from user_model import UserProfile
+from snapshot import SnapshotReader
+from cache import TTLCache, SingleFlight
+import metrics
+
 BUCKET = os.getenv("BUCKET_NAME")
 FILE_KEY = "users.json"
 
@@ -13,33 +21,271 @@ logger = logging.getLogger(__name__)
 YC_ACCESS_KEY_ID = os.getenv("YC_ACCESS_KEY_ID")
 YC_SECRET_ACCESS_KEY = os.getenv("YC_SECRET_ACCESS_KEY")
 
-s3 = boto3.client(
-    "s3",
-    endpoint_url="https://storage.yandexcloud.net",
-    aws_access_key_id=YC_ACCESS_KEY_ID,
-    aws_secret_access_key=YC_SECRET_ACCESS_KEY,
-    config=Config(signature_version='s3')
+# s3 — Object Storage (по умолчанию), local — папка на диске, без облака
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3")
+STORAGE_DIR = os.getenv("STORAGE_DIR", "data")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "https://storage.yandexcloud.net")
+# соединений к S3: пакетные задачи (goals.py) читают и пишут во много потоков
+S3_MAX_CONNECTIONS = int(os.getenv("S3_MAX_CONNECTIONS", 32))
+JOURNAL_COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", 200))
+# в многопроцессном режиме (cluster.py) каждый воркер владеет своей долей пользователей
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", 0))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 1))
+# write-behind: как часто и при скольких изменённых пользователях сбрасывать на диск
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", 2))
+FLUSH_MAX_DIRTY = int(os.getenv("FLUSH_MAX_DIRTY", 500))
+# бинарный снимок пользователей (python snapshot.py migrate/build), читается через mmap
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "")
+# через сколько секунд без апдейтов пользователь выгружается из памяти
+USER_IDLE_TTL = float(os.getenv("USER_IDLE_TTL", 3600))
+
+
+class TrackedBackend:
+    """Замеряет время и ошибки обращений к хранилищу для /metrics"""
+
+    def __init__(self, backend, name: str):
+        self.backend = backend
+        self.name = name
+
+    def get(self, key: str):
+        with metrics.track(f"{self.name}_get_object"):
+            return self.backend.get(key)
+
+    def put(self, key: str, body: bytes):
+        with metrics.track(f"{self.name}_put_object"):
+            self.backend.put(key, body)
+
+    def delete(self, key: str):
+        with metrics.track(f"{self.name}_delete_object"):
+            self.backend.delete(key)
+
+    def list(self, prefix: str):
+        with metrics.track(f"{self.name}_list_objects"):
+            return self.backend.list(prefix)
+
+
+def make_backend():
+    if STORAGE_BACKEND == "local":
+        return TrackedBackend(LocalDirBackend(STORAGE_DIR), "local")
+    s3 = boto3.client(
+        "s3",
+        endpoint_url=S3_ENDPOINT_URL,
+        aws_access_key_id=YC_ACCESS_KEY_ID,
+        aws_secret_access_key=YC_SECRET_ACCESS_KEY,
+        config=Config(signature_version='s3', max_pool_connections=S3_MAX_CONNECTIONS)
+    )
+    return TrackedBackend(S3Backend(s3, BUCKET), "s3")
+
+
+def open_snapshot():
+    if not SNAPSHOT_PATH:
+        return None
+    if not os.path.exists(SNAPSHOT_PATH):
+        logger.warning("Снимок %s не найден, работаем без него", SNAPSHOT_PATH)
+        return None
+    reader = SnapshotReader(SNAPSHOT_PATH)
+    logger.info("Снимок %s: %d пользователей", SNAPSHOT_PATH, len(reader))
+    return reader
+
+
+store = JournaledStore(
+    make_backend(),
+    compact_every=JOURNAL_COMPACT_EVERY,
+    shard=SHARD_INDEX,
+    shards=SHARD_COUNT,
+    base=open_snapshot(),
 )
 
-def load_users():
+class LazyUsers(dict):
+    """
+    uid -> UserProfile. Пользователи подгружаются из хранилища при первом обращении, а не все при старте.
+    В боте запись заранее подгружает ensure_loaded (в executor, без блокировки event loop),
+    синхронная подгрузка здесь — запасной путь для скриптов.
+    Тех, кто давно не писал, бот выгружает (evict_idle), так что в памяти только активные.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # кого точно нет в хранилище — чтобы не ходить в S3 на каждое сообщение незнакомца
+        self._missing = TTLCache(maxsize=100000, ttl=3600)
+        self._seen = OrderedDict()  # uid -> время последнего обращения, давние в начале
+
+    def touch(self, uid):
+        self._seen[uid] = time.monotonic()
+        self._seen.move_to_end(uid)
+
+    def idle(self, ttl: float) -> list:
+        """Загруженные пользователи, к которым не обращались дольше ttl секунд"""
+        deadline = time.monotonic() - ttl
+        idle = []
+        for uid, seen in self._seen.items():
+            if seen > deadline:
+                break
+            idle.append(uid)
+        return idle
+
+    def forget(self, uids):
+        for uid in uids:
+            self._seen.pop(uid, None)
+            dict.pop(self, uid, None)
+
+    def _load(self, uid):
+        if dict.__contains__(self, uid):
+            return dict.__getitem__(self, uid)
+        if self._missing.get(uid):
+            return None
+        self._remember(uid, store.load_user(uid))
+        return dict.get(self, uid)
+
+    def _remember(self, uid, user):
+        if user is None:
+            self._missing.set(uid, True)
+        elif not dict.__contains__(self, uid):
+            dict.__setitem__(self, uid, UserProfile.from_dict(user))
+            self.touch(uid)
+
+    def __contains__(self, uid):
+        return self._load(uid) is not None
+
+    def __missing__(self, uid):
+        user = self._load(uid)
+        if user is None:
+            raise KeyError(uid)
+        return user
+
+    def get(self, uid, default=None):
+        user = self._load(uid)
+        return default if user is None else user
+
+    def __setitem__(self, uid, user):
+        self._missing.set(uid, False)
+        dict.__setitem__(self, uid, user)
+        self.touch(uid)
+
+
+users = LazyUsers()
+_user_loads = SingleFlight()
+ready = False
+
+
+async def ensure_loaded(uid: str):
+    """Подгружает пользователя до обработки апдейта; блокирующий I/O — в executor"""
+    if dict.__contains__(users, uid):
+        users.touch(uid)
+        return
+    if users._missing.get(uid):
+        return
+    loop = asyncio.get_running_loop()
+    user = await _user_loads.do(uid, lambda: loop.run_in_executor(None, store.load_user, uid))
+    users._remember(uid, user)
+
+
+async def warm_up():
+    """Подготовка к приёму трафика: журнал и миграция, без чтения всех пользователей"""
+    global ready
+    loop = asyncio.get_running_loop()
     try:
-        obj = s3.get_object(Bucket=BUCKET, Key=FILE_KEY)
-        data = json.loads(obj["Body"].read().decode("utf-8"))
-        logger.info("Users загружены из Object Storage")
-        return data
-    except s3.exceptions.NoSuchKey:
-        logger.warning("users.json не найден, создаю пустой")
-        return {}
+        await loop.run_in_executor(None, store.open)
     except Exception as e:
-        logger.error(f"Ошибка загрузки users.json: {e}")
+        logger.error(f"Ошибка открытия хранилища: {e}")
         raise
+    ready = True
+    logger.info("Хранилище готово (бэкенд %s, шард %d/%d)", STORAGE_BACKEND, SHARD_INDEX, SHARD_COUNT)
 
-users = load_users()
 
-def save_users():
-    s3.put_object(
-        Bucket=BUCKET,
-        Key=FILE_KEY,
-        Body=json.dumps(users, ensure_ascii=False, indent=2).encode("utf-8")
-    )
-    logger.info("users.json сохранён")
+def load_users():
+    """Загружает всех пользователей сразу — только для скриптов обслуживания"""
+    for uid, user in store.load().items():
+        users._remember(uid, user)
+    logger.info("Users загружены: %d", len(users))
+    return users
+
+_dirty = set()
+_flush_lock = asyncio.Lock()
+_flush_needed = None
+_writer_task = None
+
+
+def save_users(uid: str = None):
+    # ничего не пишет сразу: помечает пользователя изменённым,
+    # фоновая задача сохранит все изменения одной пачкой
+    if uid is not None:
+        _dirty.add(uid)
+    else:
+        _dirty.update(users)
+    if _flush_needed is not None and len(_dirty) >= FLUSH_MAX_DIRTY:
+        _flush_needed.set()
+
+
+async def flush():
+    """Сохраняет всех изменённых пользователей, блокирующий I/O — в executor"""
+    async with _flush_lock:
+        if not _dirty:
+            return
+        uids = list(_dirty)
+        _dirty.clear()
+        # копии снимаем в потоке event loop, чтобы хендлеры не меняли их во время записи
+        batch = {uid: snapshot_user(dict.__getitem__(users, uid))
+                 for uid in uids if dict.__contains__(users, uid)}
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, store.commit, batch, uids)
+        except Exception:
+            _dirty.update(uids)
+            logger.exception("Ошибка сохранения, повторим в следующий раз")
+            return
+        logger.debug("Сохранено пользователей: %d", len(uids))
+
+
+async def _writer():
+    while True:
+        try:
+            await asyncio.wait_for(_flush_needed.wait(), timeout=FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_needed.clear()
+        # shield: отмена при остановке не должна обрывать запись посередине
+        await asyncio.shield(flush())
+        await evict_idle()
+
+
+async def evict_idle():
+    """Выгружает из памяти тех, кто не писал дольше USER_IDLE_TTL и чьи изменения уже сохранены"""
+    idle = [uid for uid in users.idle(USER_IDLE_TTL) if uid not in _dirty]
+    if not idle:
+        return
+    users.forget(idle)
+    # store.forget ждёт блокировку хранилища, которую держат чтения из S3, — в executor
+    await asyncio.get_running_loop().run_in_executor(None, store.forget, idle)
+    logger.debug("Выгружено пользователей: %d", len(idle))
+
+
+def start_writer():
+    global _flush_needed, _writer_task
+    if _writer_task is None:
+        _flush_needed = asyncio.Event()
+        _writer_task = asyncio.create_task(_writer())
+
+
+async def stop_writer():
+    """Останавливает фоновую запись и гарантированно сохраняет всё, что осталось"""
+    global _writer_task
+    if _writer_task is not None:
+        _writer_task.cancel()
+        try:
+            await _writer_task
+        except asyncio.CancelledError:
+            pass
+        _writer_task = None
+    await flush()
+    loop = asyncio.get_running_loop()
+    async with _flush_lock:
+        await loop.run_in_executor(None, store.compact)
+    logger.info("Все изменения сохранены")
+
+
+def flush_now(uids=None):
+    """Синхронно сохраняет и сворачивает журнал — для скриптов обслуживания вне бота"""
+    uids = list(users) if uids is None else list(uids)
+    store.commit({uid: snapshot_user(users[uid]) for uid in uids if uid in users}, uids)
+    store.compact()
@@ -0,0 +1,513 @@
+import json
+import os
+import logging
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+USERS_PREFIX = "users/"
+JOURNAL_PREFIX = "journal/"
+LEGACY_KEY = "users.json"
+LEGACY_MARKER_KEY = "users.json.migrated"
+
+
+def shard_of(uid, shards: int) -> int:
+    """Номер шарда, которому принадлежит пользователь (тот же расчёт у фронта и воркеров)"""
+    uid = str(uid)
+    if uid.isdigit():
+        return int(uid) % shards
+    return zlib.crc32(uid.encode("utf-8")) % shards
+
+
+def _dumps(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(body: bytes):
+    return json.loads(body.decode("utf-8"))
+
+
+# =========================
+# Бэкенды: где физически лежат объекты
+# =========================
+class LocalDirBackend:
+    """Объекты хранятся файлами в локальной папке (разработка, тесты без S3)"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def get(self, key: str):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, body: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, path)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix: str):
+        base = self._path(prefix.rstrip("/")) if prefix.rstrip("/") else self.root
+        if not os.path.isdir(base):
+            return []
+        keys = []
+        for dirpath, _, filenames in os.walk(base):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                rel = os.path.relpath(os.path.join(dirpath, filename), self.root)
+                keys.append(rel.replace(os.sep, "/"))
+        return sorted(keys)
+
+
+class S3Backend:
+    """Объекты в Object Storage (Yandex Cloud или любой S3-совместимый сервер)"""
+
+    def __init__(self, client, bucket: str):
+        self.client = client
+        self.bucket = bucket
+
+    def get(self, key: str):
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return obj["Body"].read()
+
+    def put(self, key: str, body: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body)
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def list(self, prefix: str):
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                keys.append(item["Key"])
+        return sorted(keys)
+
+
+# =========================
+# Дельты между сохранённым и текущим состоянием пользователя
+# =========================
+def snapshot_user(user) -> dict:
+    # объекты со своей сериализацией (UserProfile, история) превращаем в обычные словари,
+    # остальные вложенные словари копируем на один уровень:
+    # их значения заменяются целиком, а не правятся на месте
+    if hasattr(user, "to_dict"):
+        return user.to_dict()
+    snap = {}
+    for key, value in user.items():
+        if hasattr(value, "to_dict"):
+            value = value.to_dict()
+        elif isinstance(value, dict):
+            value = dict(value)
+        snap[key] = value
+    return snap
+
+
+def _is_extension(old, new) -> bool:
+    return (isinstance(old, list) and isinstance(new, list)
+            and len(new) > len(old) and new[:len(old)] == old)
+
+
+def make_delta(old: dict, new: dict) -> dict:
+    """Минимальное изменение, которое превращает old в new"""
+    delta = {}
+    for key, value in new.items():
+        prev = old.get(key)
+        if key in old and prev == value:
+            continue
+        if isinstance(prev, dict) and isinstance(value, dict) and prev.keys() <= value.keys():
+            # для словарей пишем только изменённые ключи,
+            # а у списков, которые только росли (колонки истории), — только хвост
+            for k, v in value.items():
+                if k in prev and prev[k] == v:
+                    continue
+                if _is_extension(prev.get(k), v):
+                    # с какой позиции хвост: повторное применение дельты
+                    # (падение между компакцией и удалением журнала) не дублирует элементы
+                    at = len(prev[k])
+                    delta.setdefault("append", {}).setdefault(key, {})[k] = {"at": at, "tail": v[at:]}
+                else:
+                    delta.setdefault("merge", {}).setdefault(key, {})[k] = v
+        else:
+            delta.setdefault("set", {})[key] = value
+    removed = [key for key in old if key not in new]
+    if removed:
+        delta["unset"] = removed
+    return delta
+
+
+def _replayed(user, deltas):
+    """Запись после дельт журнала; None — пользователя нет или он удалён"""
+    for delta in deltas:
+        if delta.get("drop"):
+            user = None
+        else:
+            user = apply_delta(user if user is not None else {}, delta)
+    return user
+
+
+def apply_delta(user: dict, delta: dict) -> dict:
+    user.update(delta.get("set", {}))
+    for key, part in delta.get("merge", {}).items():
+        user.setdefault(key, {}).update(part)
+    for key, part in delta.get("append", {}).items():
+        target = user.setdefault(key, {})
+        for k, tail in part.items():
+            column = target.setdefault(k, [])
+            if isinstance(tail, dict):
+                column[tail["at"]:] = tail["tail"]
+            else:
+                # сегменты, записанные до появления "at"
+                column.extend(tail)
+    for key in delta.get("unset", []):
+        user.pop(key, None)
+    return user
+
+
+# =========================
+# Хранилище: объект на пользователя + журнал изменений
+# =========================
+class JournaledStore:
+    """
+    users/<uid>.json     — полная запись пользователя (после последней компакции)
+    journal/<seq>.json   — пачка дельт, записанная одним save
+    users.json           — старый формат, импортируется один раз при первом запуске
+                           (в кластере — фронтом до запуска воркеров)
+    base (необязательно) — бинарный снимок (snapshot.SnapshotReader), нижний слой:
+                           из него берутся пользователи, у которых ещё нет users/<uid>.json
+
+    Пользователи читаются по одному по мере обращения (load_user),
+    поэтому старт не зависит от размера базы: open() читает только журнал.
+
+    Запись одного лога стоит столько байт, сколько реально поменялось.
+    Раз в compact_every дельт изменённые пользователи переписываются целиком,
+    а журнал очищается.
+
+    При shards > 1 экземпляр загружает и пишет только своих пользователей
+    (shard_of(uid) == shard), а журнал ведёт в своей папке journal/<shard>/,
+    так что несколько процессов не затирают изменения друг друга.
+    Менять число шардов можно только после штатной остановки всех процессов
+    (при остановке журнал сворачивается).
+    """
+
+    def __init__(self, backend, compact_every: int = 200, prefix: str = "",
+                 shard: int = 0, shards: int = 1, base=None):
+        self.backend = backend
+        self.base = base
+        self.compact_every = compact_every
+        self.prefix = prefix
+        self.shard = shard
+        self.shards = shards
+        self.journal_prefix = f"{prefix}{JOURNAL_PREFIX}{shard}/"
+        # uid -> то, что уже лежит в хранилище, сериализованным JSON: байты компактнее словарей
+        # (у пользователя с историей в несколько раз), а разбирать их нужно только при записи
+        self._shadow = {}
+        self._seq = 0           # номер последнего сегмента журнала
+        self._segments = []     # сегменты журнала, ещё не свёрнутые компакцией
+        self._pending = 0       # сколько дельт в журнале
+        self._touched = set()   # пользователи, изменённые после компакции
+        self.bytes_written = 0
+        self._sizes = {}        # uid -> размер объекта users/<uid>.json
+        self._users_bytes = 0
+        self._journal_bytes = 0
+        self._replay = {}       # uid -> дельты из журнала для ещё не загруженных пользователей
+        self._evicted = set()   # выгруженные ботом, чьи записи компакция ещё возьмёт из _shadow
+        self._opened = False
+        # load_user и commit вызываются из потоков executor'а
+        self._lock = threading.RLock()
+        self._writing = set()   # uid, чьи записи сейчас пишет write_cold
+        self._written = threading.Condition(self._lock)
+
+    def _key(self, kind: str, name: str) -> str:
+        return f"{self.prefix}{kind}{name}.json"
+
+    def owns(self, uid) -> bool:
+        return self.shards == 1 or shard_of(uid, self.shards) == self.shard
+
+    def _put(self, key: str, body: bytes):
+        self.backend.put(key, body)
+        self.bytes_written += len(body)
+
+    def _set_size(self, uid, size: int):
+        self._users_bytes += size - self._sizes.pop(uid, 0)
+        if size:
+            self._sizes[uid] = size
+
+    @property
+    def loaded_bytes(self) -> int:
+        """
+        Сколько занимают в хранилище загруженные пользователи и журнал. Размер всей базы
+        так не узнать без листинга всех объектов, а старт не должен зависеть от её размера.
+        """
+        return self._users_bytes + self._journal_bytes
+
+    def open(self):
+        """Читает журнал (и один раз импортирует старый users.json); пользователей не грузит"""
+        with self._lock:
+            if self._opened:
+                return
+            if self.shards == 1:
+                # в кластере импорт один раз делает фронт до запуска воркеров (cluster.py):
+                # воркеры, импортирующие каждый всё, затирали бы друг другу свежие записи
+                self.import_legacy()
+            self._segments = self.backend.list(self.journal_prefix)
+            for key in self._segments:
+                body = self.backend.get(key)
+                self._journal_bytes += len(body)
+                for delta in _loads(body):
+                    self._replay.setdefault(delta["u"], []).append(delta)
+                    self._touched.add(delta["u"])
+                    self._pending += 1
+            if self._segments:
+                last = self._segments[-1]
+                self._seq = int(last[len(self.journal_prefix):-len(".json")])
+            self._opened = True
+
+    def load_user(self, uid: str):
+        """Запись пользователя с учётом журнала или None, если такого нет"""
+        with self._lock:
+            self.open()
+            # иначе прочитали бы запись, которую write_cold вот-вот перепишет
+            while uid in self._writing:
+                self._written.wait()
+            self._evicted.discard(uid)
+            if uid in self._shadow:
+                return _loads(self._shadow[uid])
+            body = self.backend.get(self._key(USERS_PREFIX, uid))
+            if body is not None:
+                # null — пользователь удалён, но ещё лежит в снимке
+                user = _loads(body)
+                self._set_size(uid, len(body))
+            else:
+                user = self.base.get(uid) if self.base is not None else None
+            user = _replayed(user, self._replay.pop(uid, []))
+            if user is None:
+                return None
+            self._shadow[uid] = _dumps(snapshot_user(user))
+            return user
+
+    def read_user(self, uid: str):
+        """
+        Как load_user, но ничего не запоминает — для выгрузок всей базы, которые
+        иначе держали бы в памяти всех пользователей. Можно вызывать из нескольких потоков.
+        """
+        self.open()
+        with self._lock:
+            if uid in self._shadow:
+                return _loads(self._shadow[uid])
+            # копия: apply_delta вкладывает значения дельт в запись, а эти дельты ещё понадобятся
+            deltas = _loads(_dumps(self._replay.get(uid, [])))
+        body = self.backend.get(self._key(USERS_PREFIX, uid))
+        if body is not None:
+            user = _loads(body)
+        else:
+            user = self.base.get(uid) if self.base is not None else None
+        return _replayed(user, deltas)
+
+    def uids(self) -> list:
+        """id всех пользователей шарда (включая удалённых, которые ещё лежат в журнале), по порядку"""
+        self.open()
+        uids = {
+            key[len(self.prefix + USERS_PREFIX):-len(".json")]
+            for key in self.backend.list(self.prefix + USERS_PREFIX)
+        }
+        with self._lock:
+            uids.update(self._replay)
+            uids.update(self._shadow)
+        if self.base is not None:
+            uids.update(self.base.uids())
+        return sorted(uid for uid in uids if self.owns(uid))
+
+    def iter_users(self, chunk_size: int = 500, workers: int = 8):
+        """Пачки [(uid, запись), ...] всех пользователей шарда; в памяти — одна пачка"""
+        uids = self.uids()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for start in range(0, len(uids), chunk_size):
+                chunk = uids[start:start + chunk_size]
+                # из S3 пачку читаем параллельно: время уходит на ожидание ответов
+                users = pool.map(self.read_user, chunk)
+                yield [(uid, user) for uid, user in zip(chunk, users) if user is not None]
+
+    def write_users(self, users: dict):
+        """
+        Пишет записи целиком в users/, минуя журнал — для массового импорта при остановленном боте.
+        Журнал сначала сворачивается, чтобы его дельты потом не легли поверх новых записей.
+        """
+        with self._lock:
+            self.open()
+            self._compact()
+            for uid, user in users.items():
+                body = _dumps(user)
+                self._put(self._key(USERS_PREFIX, uid), body)
+                if uid in self._shadow:
+                    self._shadow[uid] = body
+                    self._set_size(uid, len(body))
+
+    def write_cold(self, users: dict, workers: int = 8) -> list:
+        """
+        Пишет записи в users/ тем, кто не загружен в память и не ждёт дельт из журнала,
+        — для пакетных задач внутри работающего бота. Остальных не трогает и возвращает
+        их uid: их нужно поправить в памяти и сохранить обычным путём.
+        """
+        skipped = []
+        bodies = {}     # uid -> запись
+        with self._lock:
+            self.open()
+            for uid, user in users.items():
+                if uid in self._shadow or uid in self._replay or uid in self._writing:
+                    skipped.append(uid)
+                else:
+                    bodies[uid] = _dumps(user)
+            self._writing.update(bodies)
+        # в S3 пишем параллельно и без общей блокировки: ждут только load_user этих пользователей
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                keys = [self._key(USERS_PREFIX, uid) for uid in bodies]
+                for _ in pool.map(self.backend.put, keys, bodies.values()):
+                    pass
+            with self._lock:
+                self.bytes_written += sum(map(len, bodies.values()))
+        finally:
+            with self._lock:
+                self._writing.difference_update(bodies)
+                self._written.notify_all()
+        return skipped
+
+    def forget(self, uids):
+        """Забывает выгруженных из памяти пользователей; следующий load_user прочитает их заново"""
+        with self._lock:
+            for uid in uids:
+                if uid in self._touched:
+                    # дельты ещё в журнале: компакция запишет пользователя из _shadow, потом забудет
+                    self._evicted.add(uid)
+                    continue
+                self._shadow.pop(uid, None)
+                self._set_size(uid, 0)
+
+    def load(self) -> dict:
+        """Все пользователи шарда сразу — для скриптов обслуживания, не для бота"""
+        users = {}
+        for uid in self.uids():
+            user = self.load_user(uid)
+            if user is not None:
+                users[uid] = user
+        return users
+
+    def import_legacy(self):
+        """Один раз переносит старый users.json в users/<uid>.json — всех пользователей, а не только шарда"""
+        if self.backend.get(self.prefix + LEGACY_MARKER_KEY) is not None:
+            return
+        body = self.backend.get(self.prefix + LEGACY_KEY)
+        if body is not None:
+            users = _loads(body)
+            for uid, user in users.items():
+                self._put(self._key(USERS_PREFIX, uid), _dumps(user))
+            logger.info("Импортировано %d пользователей из %s", len(users), LEGACY_KEY)
+        self._put(self.prefix + LEGACY_MARKER_KEY, b"{}")
+
+    def commit(self, users: dict, uids):
+        """Пишет в журнал дельты указанных пользователей одним сегментом"""
+        with self._lock:
+            self.open()
+            self._commit(users, uids)
+
+    def _commit(self, users: dict, uids):
+        deltas = []
+        shadows = {}
+        for uid in uids:
+            user = users.get(uid)
+            if user is None:
+                if uid in self._shadow:
+                    deltas.append({"u": uid, "drop": True})
+                    shadows[uid] = None
+                continue
+            stored = self._shadow.get(uid)
+            delta = make_delta(_loads(stored) if stored is not None else {}, user)
+            if not delta:
+                continue
+            delta["u"] = uid
+            deltas.append(delta)
+            shadows[uid] = _dumps(user)
+        if not deltas:
+            return
+
+        key = f"{self.journal_prefix}{self._seq + 1:012d}.json"
+        body = _dumps(deltas)
+        self._put(key, body)
+        # состояние обновляем только после успешной записи,
+        # иначе при ошибке следующая попытка не увидит изменений
+        self._seq += 1
+        self._segments.append(key)
+        self._journal_bytes += len(body)
+        self._pending += len(deltas)
+        for uid, shadow in shadows.items():
+            if shadow is None:
+                self._shadow.pop(uid, None)
+            else:
+                self._shadow[uid] = shadow
+            self._touched.add(uid)
+
+        if self._pending >= self.compact_every:
+            self._compact()
+
+    def compact(self):
+        """Переписывает изменённых пользователей целиком и удаляет журнал"""
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        if not self._segments:
+            return
+        # пользователи из журнала, к которым так и не обратились, догружаются здесь
+        # и после компакции забываются: в памяти бота их нет
+        for uid in list(self._replay):
+            self.load_user(uid)
+            self._evicted.add(uid)
+        # сначала пишем итоговые записи, потом удаляем журнал:
+        # при падении посередине дельты применятся к уже свёрнутой записи ещё раз,
+        # поэтому все они идемпотентны (set/merge заменяют значения, append пишет с позиции "at")
+        for uid in self._touched:
+            if uid in self._shadow:
+                body = self._shadow[uid]
+                self._put(self._key(USERS_PREFIX, uid), body)
+                self._set_size(uid, len(body))
+            elif self.base is not None and self.base.get(uid) is not None:
+                self._put(self._key(USERS_PREFIX, uid), b"null")
+                self._set_size(uid, 0)
+            else:
+                self.backend.delete(self._key(USERS_PREFIX, uid))
+                self._set_size(uid, 0)
+        for key in self._segments:
+            self.backend.delete(key)
+        logger.info("Компакция: %d пользователей, %d сегментов журнала",
+                    len(self._touched), len(self._segments))
+        self._segments = []
+        self._journal_bytes = 0
+        self._touched = set()
+        for uid in self._evicted:
+            self._shadow.pop(uid, None)
+            self._set_size(uid, 0)
+        self._evicted = set()
+        self._pending = 0
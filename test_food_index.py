@@ -0,0 +1,44 @@
+"""
+Поиск по локальному индексу продуктов.
+
+    python -m pytest -q test_food_index.py
+"""
+import json
+
+import pytest
+
+import food_index
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    dump = tmp_path / "dump.jsonl"
+    with open(dump, "w", encoding="utf-8") as f:
+        # совпадений со словом больше, чем кандидатов у недописанного слова
+        for i in range(300):
+            f.write(json.dumps({"product_name": f"Напиток {i} с добавлением молоко сухое",
+                                "nutriments": {"energy-kcal_100g": 100}}, ensure_ascii=False) + "\n")
+        for name, kcal in (("Молоко", 60), ("Гречка ядрица", 313), ("Гренки", 400)):
+            f.write(json.dumps({"product_name": name, "nutriments": {"energy-kcal_100g": kcal}},
+                               ensure_ascii=False) + "\n")
+    path = str(tmp_path / "food_index.db")
+    food_index.build_index(str(dump), path)
+    monkeypatch.setattr(food_index, "FOOD_INDEX_PATH", path)
+    monkeypatch.setattr(food_index, "PREFIX_CANDIDATES", 50)
+    monkeypatch.setattr(food_index._local, "conn", None, raising=False)
+    yield
+    food_index._local.conn.close()
+    food_index._local.conn = None
+
+
+def test_whole_word_ranked_over_all_matches(index):
+    assert food_index.search("молоко")[0] == ("Молоко", 60.0)
+
+
+def test_unfinished_word_by_prefix(index):
+    assert [name for name, _ in food_index.search("греч")] == ["Гречка ядрица"]
+    assert {name for name, _ in food_index.search("гре")} == {"Гречка ядрица", "Гренки"}
+
+
+def test_short_prefix_not_expanded(index):
+    assert food_index.search("гр") == []
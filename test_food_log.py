@@ -0,0 +1,59 @@
+"""
+Разбор быстрой записи еды и выбор продукта без участия пользователя.
+
+    python -m pytest -q test_food_log.py
+"""
+import food_log
+
+
+def parsed(text):
+    return [(item.name, item.amount, item.unit) for item in food_log.parse_items(text)]
+
+
+def test_parse_list():
+    assert parsed("200 гречка, 150г курица; 1 банан\nмолоко 0,5 кг") == [
+        ("гречка", 200, "g"),
+        ("курица", 150, "g"),
+        ("банан", 1, "pcs"),
+        ("молоко", 500, "g"),
+    ]
+
+
+def test_decimal_comma_is_not_a_separator():
+    assert parsed("1,5 банана") == [("банана", 1.5, "pcs")]
+
+
+def test_pieces_and_grams():
+    # мало и вес штуки известен — штуки, иначе граммы
+    assert parsed("2 яйца, 30 яблок, 3 гречка, 2 шт хлеб") == [
+        ("яйца", 2, "pcs"), ("яблок", 30, "g"), ("гречка", 3, "g"), ("хлеб", 2, "pcs"),
+    ]
+    item = food_log.parse_items("2 яйца")[0]
+    assert item.grams == 2 * food_log.PIECE_GRAMS["яйц"]
+    assert food_log.parse_items("2 шт хлеб")[0].grams is None
+
+
+def test_item_without_amount_rejects_whole_list():
+    # обычный поиск по всему тексту, а не запись половины списка
+    assert food_log.parse_items("200 гречка, курица") == []
+    assert food_log.parse_items("гречка") == []
+    assert food_log.parse_items("0 гречка") == []
+
+
+def test_best_match_single_result():
+    assert food_log.best_match("что угодно", [("Гречка", 313)]) == ("Гречка", 313)
+
+
+def test_best_match_prefers_exact_name():
+    results = [("Банановые чипсы", 519), ("Банан", 89), ("Банан спелый", 95)]
+    assert food_log.best_match("бананы", results) == ("Банан", 89)
+
+
+def test_best_match_same_calories_takes_first():
+    results = [("Гречка ядрица", 313), ("Гречка продел", 326)]
+    assert food_log.best_match("гречка", results) == ("Гречка ядрица", 313)
+
+
+def test_best_match_ambiguous():
+    assert food_log.best_match("сыр", [("Сыр тофу", 76), ("Сыр пармезан", 392)]) is None
+    assert food_log.best_match("курица", [("Гречка", 313), ("Рис", 344)]) is None
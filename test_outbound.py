@@ -0,0 +1,57 @@
+"""
+Token bucket исходящих запросов: скорость, запас и приоритеты.
+
+    python -m pytest -q test_outbound.py
+"""
+import asyncio
+import time
+
+from outbound import BULK, INTERACTIVE, TokenBucket
+
+
+def test_burst_then_rate():
+    async def run():
+        bucket = TokenBucket(rate=50, burst=5)
+        started = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        burst = time.monotonic() - started
+        for _ in range(5):
+            await bucket.acquire()
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(run())
+    # запас уходит сразу, следующие пять — по 1/50 с
+    assert burst < 0.02
+    assert 0.08 < total < 0.3
+
+
+def test_interactive_waiters_go_first():
+    async def run():
+        bucket = TokenBucket(rate=100, burst=1)
+        await bucket.acquire()
+        order = []
+
+        async def send(name, priority):
+            await bucket.acquire(priority)
+            order.append(name)
+
+        # рассылка встала в очередь раньше, но ответы пользователям её обгоняют
+        await asyncio.gather(
+            send("bulk1", BULK), send("bulk2", BULK),
+            send("answer1", INTERACTIVE), send("answer2", INTERACTIVE),
+        )
+        return order
+
+    assert asyncio.run(run()) == ["answer1", "answer2", "bulk1", "bulk2"]
+
+
+def test_pause_blocks_and_drains_tokens():
+    async def run():
+        bucket = TokenBucket(rate=1000, burst=10)
+        bucket.pause(0.1)
+        started = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - started
+
+    assert 0.09 < asyncio.run(run()) < 0.3
@@ -0,0 +1,76 @@
+"""
+Напоминания о воде: срок следующей проверки и куча подписчиков.
+
+    python -m pytest -q test_reminders.py
+"""
+import heapq
+from datetime import datetime, timedelta
+
+import pytest
+
+import reminders
+from user_model import UserProfile
+
+# uid, кратный 600: без разброса по времени (reminders._jitter)
+UID = "600"
+DAY = datetime(2025, 6, 2)
+
+
+@pytest.fixture(autouse=True)
+def schedule(monkeypatch):
+    monkeypatch.setattr(reminders, "REMIND_FROM", 9)
+    monkeypatch.setattr(reminders, "REMIND_TO", 21)
+    monkeypatch.setattr(reminders, "REMIND_BEHIND", 300)
+    monkeypatch.setattr(reminders, "REMIND_INTERVAL", 7200)
+    monkeypatch.setattr(reminders, "_heap", [])
+    monkeypatch.setattr(reminders, "_due", {})
+
+
+def drinker(goal, drunk, now=DAY):
+    user = UserProfile(water_goal=goal)
+    user.today.day = now.toordinal()
+    user.today.water = drunk
+    return user
+
+
+def at(hour, minute=0):
+    return DAY.replace(hour=hour, minute=minute)
+
+
+def test_due_when_lag_reaches_threshold():
+    # 2400 мл за 12 часов — 200 мл в час: 300 мл отставания наберутся к 10:30
+    assert reminders.next_due(UID, drinker(2400, 0), at(9)) == at(10, 30).timestamp()
+    assert reminders.next_due(UID, drinker(2400, 600), at(9)) == at(13, 30).timestamp()
+
+
+def test_lagging_user_checked_now_or_after_interval():
+    user = drinker(2400, 0)
+    assert reminders.next_due(UID, user, at(15)) == at(15).timestamp()
+    assert reminders.next_due(UID, user, at(15), reminded=True) == at(17).timestamp()
+    assert reminders.behind(user, at(15)) == 1200
+
+
+def test_done_or_late_moves_to_tomorrow():
+    tomorrow = (at(9) + timedelta(days=1, seconds=7200)).timestamp()
+    assert reminders.next_due(UID, drinker(2400, 2200), at(12)) == tomorrow
+    assert reminders.next_due(UID, drinker(2400, 0), at(22)) == tomorrow
+    assert reminders.next_due(UID, drinker(0, 0), at(12)) == tomorrow
+
+
+def test_yesterdays_counters_do_not_count():
+    user = drinker(2400, 2000, now=DAY - timedelta(days=1))
+    assert reminders.logged_today(user, at(12)) == 0
+
+
+def test_heap_keeps_only_latest_due():
+    reminders.schedule("1", 300.0)
+    reminders.schedule("2", 200.0)
+    reminders.schedule("1", 100.0)
+    reminders.cancel("2")
+    assert reminders.count() == 1
+    # в куче остались устаревшие записи — планировщик их пропускает
+    live = [(due, uid) for due, uid in sorted(reminders._heap) if reminders._due.get(uid) == due]
+    assert live == [(100.0, "1")]
+    reminders._rebuild_heap()
+    assert reminders._heap == [(100.0, "1")]
+    assert heapq.heappop(reminders._heap) == (100.0, "1")
@@ -0,0 +1,114 @@
+"""
+Обвязка внешних API: breaker, hedged-запросы, бюджет времени и устаревшие ответы.
+
+    python -m pytest -q test_resilience.py
+"""
+import asyncio
+import time
+
+from resilience import CircuitBreaker, Upstream
+
+
+class FakeApi:
+    """fetch, который отвечает через заданные задержки по очереди (последняя — для всех следующих)"""
+
+    def __init__(self, *delays, value="ok", error=None):
+        self.delays = list(delays)
+        self.value = value
+        self.error = error
+        self.calls = 0
+
+    async def fetch(self):
+        delay = self.delays[min(self.calls, len(self.delays) - 1)]
+        self.calls += 1
+        await asyncio.sleep(delay)
+        if self.error is not None:
+            raise self.error
+        return f"{self.value}{self.calls}"
+
+
+def test_breaker_opens_and_probes():
+    breaker = CircuitBreaker(window=4, min_calls=4, threshold=0.5, cooldown=0.05)
+    for bad in (False, True, False):
+        breaker.record(bad)
+    assert not breaker.is_open
+    breaker.record(True)
+    assert breaker.is_open and not breaker.allow()
+
+    time.sleep(0.06)
+    # после cooldown — ровно один пробный запрос
+    assert breaker.allow() and not breaker.allow()
+    breaker.record(True)
+    assert breaker.is_open and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False)
+    assert not breaker.is_open and breaker.allow()
+
+
+def test_slow_call_is_hedged():
+    async def run():
+        api = FakeApi(1.0, 0.01)
+        upstream = Upstream("test_hedge", budget=0.4, fresh_ttl=60, stale_ttl=60)
+        started = time.monotonic()
+        value = await upstream.get("k", api.fetch)
+        return value, api.calls, time.monotonic() - started
+
+    value, calls, elapsed = asyncio.run(run())
+    # второй запрос ушёл через budget / 2 и ответил первым
+    assert value == "ok2" and calls == 2 and elapsed < 0.4
+
+
+def test_budget_exceeded_result_still_cached():
+    async def run():
+        api = FakeApi(0.2)
+        upstream = Upstream("test_budget", budget=0.05, fresh_ttl=60, stale_ttl=60, hedge=False)
+        first = await upstream.get("k", api.fetch)
+        await asyncio.sleep(0.25)
+        second = await upstream.get("k", api.fetch)
+        return first, second, api.calls
+
+    assert asyncio.run(run()) == (None, "ok1", 1)
+
+
+def test_stale_value_served_while_refreshing():
+    async def run():
+        api = FakeApi(0.01)
+        upstream = Upstream("test_stale", budget=1, fresh_ttl=0, stale_ttl=60, hedge=False)
+        first = await upstream.get("k", api.fetch)
+        # значение уже устарело: отдаётся сразу, обновление — в фоне
+        second = await upstream.get("k", api.fetch)
+        await asyncio.sleep(0.05)
+        third = await upstream.get("k", api.fetch)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert (first, second) == ("ok1", "ok1") and third == "ok2"
+
+
+def test_stale_value_survives_upstream_errors():
+    async def run():
+        api = FakeApi(0)
+        upstream = Upstream("test_stale_errors", budget=1, fresh_ttl=0, stale_ttl=60, hedge=False)
+        assert await upstream.get("k", api.fetch) == "ok1"
+        api.error = RuntimeError("API down")
+        values = []
+        for _ in range(3):
+            values.append(await upstream.get("k", api.fetch))
+            await asyncio.sleep(0.01)
+        return values
+
+    assert asyncio.run(run()) == ["ok1"] * 3
+
+
+def test_open_breaker_short_circuits():
+    async def run():
+        api = FakeApi(0, error=RuntimeError("API down"))
+        breaker = CircuitBreaker(window=2, min_calls=2, threshold=0.5, cooldown=60)
+        upstream = Upstream("test_breaker", budget=1, fresh_ttl=60, stale_ttl=60, hedge=False, breaker=breaker)
+        values = [await upstream.get(f"k{i}", api.fetch) for i in range(5)]
+        return values, api.calls, breaker.is_open
+
+    values, calls, is_open = asyncio.run(run())
+    assert values == [None] * 5 and calls == 2 and is_open
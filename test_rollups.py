@@ -0,0 +1,59 @@
+"""
+Итоги по неделям, месяцам и годам.
+
+    python -m pytest -q test_rollups.py
+"""
+from datetime import date, timedelta
+
+import rollups
+from storage_engine import make_delta
+from user_model import UserProfile
+
+# воскресенье 31 декабря — на стыке недели, месяца и года
+DAYS = [(date(2023, 12, 30) + timedelta(days=i), 2000.0 + 100 * i, 1800.0, 300.0 * (i % 2)) for i in range(4)]
+
+
+def tracked():
+    user = UserProfile(water_goal=2100, calorie_goal=1700)
+    for day, water, calories, burned in DAYS:
+        user.history.add(day.toordinal(), water, calories, burned)
+        rollups.add_day(user, day, water, calories, burned)
+    return user
+
+
+def test_period_keys():
+    assert rollups.period_key("week", date(2023, 12, 31)) == "week:2023-W52"
+    assert rollups.period_key("week", date(2024, 1, 1)) == "week:2024-W01"
+    assert rollups.period_key("month", date(2024, 1, 1)) == "month:2024-01"
+    assert rollups.period_key("year", date(2023, 12, 31)) == "year:2023"
+
+
+def test_buckets_split_at_period_boundaries():
+    user = tracked()
+    old_week = rollups.get_bucket(user, "week", date(2023, 12, 31))
+    assert old_week["days"] == 2 and old_week["water"] == 2000 + 2100
+    # 2100 мл и больше — норма воды; калории в норме, когда 1800 <= 1700 + сожжённое
+    assert old_week["water_hits"] == 1 and old_week["calorie_hits"] == 1 and old_week["workout_days"] == 1
+    new_year = rollups.get_bucket(user, "year", date(2024, 1, 2))
+    assert new_year["days"] == 2 and new_year["burned"] == 300
+    assert rollups.get_bucket(user, "month", date(2024, 2, 1)) is None
+
+
+def test_rebuild_matches_incremental():
+    user = tracked()
+    incremental = user.rollups
+    rollups.rebuild(user)
+    assert user.rollups == incremental
+
+
+def test_new_day_changes_only_its_buckets():
+    user = tracked()
+    before = user.to_dict()
+    rollups.add_day(user, date(2024, 1, 3), 2500.0, 1500.0, 0.0)
+    delta = make_delta(before, user.to_dict())
+    assert set(delta["merge"]["rollups"]) == {"week:2024-W01", "month:2024-01", "year:2024"}
+
+
+def test_format_stats():
+    text = rollups.format_stats("week", rollups.get_bucket(tracked(), "week", date(2024, 1, 1)))
+    assert "за неделю (2 дн.)" in text and "2250 мл/день" in text
@@ -0,0 +1,91 @@
+"""
+Бинарный снимок пользователей: кодирование записей, индекс и слой под хранилищем.
+
+    python -m pytest -q test_snapshot.py
+"""
+import json
+from datetime import date
+
+import pytest
+
+import snapshot
+from snapshot import SnapshotError, SnapshotReader, decode_user, encode_user, write_snapshot
+from storage_engine import JournaledStore, LocalDirBackend
+
+USER = {
+    "weight": 70.5, "city": "Москва", "water_goal": 2100.0, "foods": {"Гречка": [313, 2, 739000, 200, []]},
+    "history": {"days": [739000, 739001], "water": [1500.0, 2000.5],
+                "calories": [1800.0, 2100.0], "burned": [0.0, 350.25]},
+}
+
+
+@pytest.mark.parametrize("user", [
+    USER,
+    {"weight": None, "city": None},
+    {"age": 30, "history": {"days": [], "water": [], "calories": [], "burned": []}},
+])
+def test_encode_decode_round_trip(user):
+    record = encode_user(user)
+    assert decode_user(b"prefix" + record, len(b"prefix")) == user
+
+
+def test_old_history_format_rejected():
+    with pytest.raises(SnapshotError):
+        encode_user({"history": {"2025-01-31": {"water": 1.0}}})
+
+
+def test_reader_finds_users_by_id(tmp_path):
+    path = str(tmp_path / "users.snap")
+    users = {str(uid): {"age": uid % 90} for uid in (42, -7, 100500, 3, 999999999999)}
+    assert write_snapshot(path, users.items()) == len(users)
+
+    reader = SnapshotReader(path)
+    assert len(reader) == len(users)
+    assert list(reader.uids()) == sorted(users, key=int)
+    assert dict(reader.items()) == users
+    for uid, user in users.items():
+        assert reader.get(uid) == user
+        assert reader.get(int(uid)) == user
+    assert reader.get("43") is None and reader.get("abc") is None
+    reader.close()
+
+
+def test_non_numeric_id_rejected(tmp_path):
+    with pytest.raises(SnapshotError):
+        write_snapshot(str(tmp_path / "users.snap"), [("abc", {})])
+
+
+def test_truncated_file_rejected(tmp_path):
+    path = tmp_path / "users.snap"
+    write_snapshot(str(path), [("1", USER)])
+    path.write_bytes(path.read_bytes()[:-3])
+    with pytest.raises(SnapshotError):
+        SnapshotReader(str(path))
+
+
+def test_migrate_and_export_legacy_json(tmp_path):
+    legacy = {"7": {"weight": 80.0, "history": {"2025-01-31": {"water": 500.0, "calories": 900.0, "burned": 0.0}}}}
+    src, snap, out = tmp_path / "users.json", str(tmp_path / "users.snap"), tmp_path / "out.json"
+    src.write_text(json.dumps(legacy), encoding="utf-8")
+    assert snapshot.migrate(str(src), snap) == 1
+    assert snapshot.export_json(snap, str(out)) == 1
+    user = json.loads(out.read_text(encoding="utf-8"))["7"]
+    assert user["weight"] == 80.0
+    assert user["history"]["days"] == [date(2025, 1, 31).toordinal()]
+    assert user["history"]["water"] == [500.0]
+
+
+def test_snapshot_is_bottom_layer_of_store(tmp_path):
+    path = str(tmp_path / "users.snap")
+    write_snapshot(path, [("1", {"age": 30}), ("2", {"age": 40})])
+    root = str(tmp_path / "store")
+    store = JournaledStore(LocalDirBackend(root), base=SnapshotReader(path))
+    assert store.load_user("1") == {"age": 30}
+
+    # изменения после снимка ложатся поверх него, удаление прячет запись снимка
+    store.load_user("2")
+    store.commit({"1": {"age": 31}}, ["1", "2"])
+    store.compact()
+    reopened = JournaledStore(LocalDirBackend(root), base=SnapshotReader(path))
+    assert reopened.load_user("1") == {"age": 31}
+    assert reopened.load_user("2") is None
@@ -0,0 +1,115 @@
+"""
+Журнал JournaledStore: восстановление после падения посреди компакции.
+
+    python -m pytest -q test_storage_engine.py
+"""
+import threading
+
+import pytest
+
+from storage_engine import JournaledStore, LocalDirBackend, apply_delta
+
+
+class CrashOnDelete(LocalDirBackend):
+    """Падает на удалении сегмента журнала — как процесс, убитый посреди компакции"""
+
+    def delete(self, key: str):
+        raise RuntimeError("crash")
+
+
+class SlowPut(LocalDirBackend):
+    """put ждёт разрешения — запись в S3, которая ещё идёт"""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def put(self, key: str, body: bytes):
+        self.started.set()
+        self.release.wait(5)
+        super().put(key, body)
+
+
+def user(days):
+    return {"water_goal": 2000, "history": {
+        "days": list(days),
+        "water": [100.0] * len(days),
+        "calories": [200.0] * len(days),
+        "burned": [300.0] * len(days),
+    }}
+
+
+def test_replay_after_crash_in_compaction(tmp_path):
+    root = str(tmp_path)
+    first = JournaledStore(LocalDirBackend(root))
+    first.commit({"1": user([739000])}, ["1"])
+    first.compact()
+
+    store = JournaledStore(CrashOnDelete(root), compact_every=1000)
+    store.load_user("1")
+    # в журнале только дописанные хвосты колонок
+    store.commit({"1": user([739000, 739001])}, ["1"])
+    # users/1.json уже записан, а журнал не удалён
+    with pytest.raises(RuntimeError):
+        store.compact()
+
+    reopened = JournaledStore(LocalDirBackend(root))
+    assert reopened.load_user("1") == user([739000, 739001])
+    assert reopened.read_user("1") == user([739000, 739001])
+
+    reopened.commit({"1": user([739000, 739001, 739002])}, ["1"])
+    reopened.compact()
+    assert JournaledStore(LocalDirBackend(root)).load_user("1") == user([739000, 739001, 739002])
+
+
+def test_append_delta_is_idempotent():
+    delta = {"append": {"history": {"days": {"at": 1, "tail": [739001]}}}}
+    once = apply_delta({"history": {"days": [739000]}}, delta)
+    twice = apply_delta(apply_delta({"history": {"days": [739000]}}, delta), delta)
+    assert once == twice == {"history": {"days": [739000, 739001]}}
+
+
+def test_old_append_delta_format():
+    delta = {"append": {"history": {"days": [739001]}}}
+    assert apply_delta({"history": {"days": [739000]}}, delta) == {"history": {"days": [739000, 739001]}}
+
+
+def test_forget_before_compaction_keeps_user(tmp_path):
+    store = JournaledStore(LocalDirBackend(str(tmp_path)), compact_every=1000)
+    store.commit({"1": user([739000]), "2": user([739000])}, ["1", "2"])
+    store.compact()
+    store.commit({"1": user([739000, 739001])}, ["1"])
+    # у "1" дельта ещё в журнале, "2" сохранён целиком
+    store.forget(["1", "2"])
+    assert "2" not in store._shadow and "1" in store._shadow
+    store.compact()
+    assert store._shadow == {} and store.loaded_bytes == 0
+    reopened = JournaledStore(LocalDirBackend(str(tmp_path)))
+    assert reopened.load_user("1") == user([739000, 739001])
+    assert reopened.load_user("2") == user([739000])
+
+
+def test_load_user_waits_for_cold_write(tmp_path):
+    backend = SlowPut(str(tmp_path))
+    backend.release.set()
+    store = JournaledStore(backend)
+    store.write_users({"1": user([739000])})
+    backend.started.clear()
+    backend.release.clear()
+
+    writer = threading.Thread(target=store.write_cold, args=({"1": user([739000, 739001])},))
+    writer.start()
+    assert backend.started.wait(5)
+    loaded = []
+    reader = threading.Thread(target=lambda: loaded.append(store.load_user("1")))
+    reader.start()
+    reader.join(0.2)
+    # пока запись идёт, load_user ждёт, а не читает старую версию
+    assert reader.is_alive()
+    backend.release.set()
+    writer.join(5)
+    reader.join(5)
+    assert loaded == [user([739000, 739001])]
+    # теперь пользователь в памяти: пакетная запись его пропускает
+    assert store.write_cold({"1": user([739000])}) == ["1"]
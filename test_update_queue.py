@@ -0,0 +1,81 @@
+"""
+Очередь апдейтов за вебхуком: порядок по пользователю и переполнение.
+
+    python -m pytest -q test_update_queue.py
+"""
+import asyncio
+import random
+
+from aiogram.types import Update
+
+from update_queue import UpdateQueue
+
+
+class RecordingDispatcher:
+    """Вместо aiogram: запоминает порядок обработки, апдейты обрабатываются разное время"""
+
+    def __init__(self, delay: float = 0.005):
+        self.delay = delay
+        self.handled = []
+
+    async def feed_update(self, bot, update):
+        await asyncio.sleep(random.random() * self.delay)
+        self.handled.append((update.message.from_user.id, update.update_id))
+
+
+def message(update_id: int, uid: int) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "/start",
+            "chat": {"id": uid, "type": "private"},
+            "from": {"id": uid, "is_bot": False, "first_name": "u"},
+        },
+    })
+
+
+def test_updates_of_one_user_in_order():
+    async def run():
+        dispatcher = RecordingDispatcher()
+        queue = UpdateQueue(dispatcher, None, workers=4, max_depth=1000)
+        queue.start()
+        for n in range(200):
+            assert await queue.submit(message(n, uid=n % 7))
+        await queue.stop()
+        return dispatcher.handled, queue.stats()
+
+    handled, stats = asyncio.run(run())
+    assert stats["processed"] == 200 and stats["dropped"] == 0
+    for uid in range(7):
+        ids = [update_id for user, update_id in handled if user == uid]
+        assert ids == sorted(ids) and len(ids) == len(range(uid, 200, 7))
+
+
+def test_overflow_dropped_and_counted():
+    async def run():
+        dispatcher = RecordingDispatcher()
+        queue = UpdateQueue(dispatcher, None, workers=1, max_depth=3, policy="drop")
+        # воркеры ещё не взяли ни одного апдейта: в очереди три места
+        accepted = [await queue.submit(message(n, uid=1)) for n in range(6)]
+        queue.start()
+        await queue.stop()
+        return accepted, dispatcher.handled, queue.dropped
+
+    accepted, handled, dropped = asyncio.run(run())
+    assert accepted == [True] * 3 + [False] * 3 and dropped == 3
+    assert handled == [(1, 0), (1, 1), (1, 2)]
+
+
+def test_wait_policy_gives_up_after_timeout():
+    async def run():
+        dispatcher = RecordingDispatcher()
+        queue = UpdateQueue(dispatcher, None, workers=1, max_depth=1, policy="wait", wait=0.05)
+        # без воркеров: очередь из одного места занята первым апдейтом
+        assert await queue.submit(message(1, uid=1))
+        assert not await queue.submit(message(2, uid=1))
+        queue.start()
+        await queue.stop()
+        return queue.dropped, dispatcher.handled
+
+    dropped, handled = asyncio.run(run())
+    assert dropped == 1 and handled == [(1, 1)]
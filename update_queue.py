@@ -0,0 +1,121 @@
+import os
+import zlib
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", 8))
+UPDATE_QUEUE_DEPTH = int(os.getenv("UPDATE_QUEUE_DEPTH", 1000))
+# drop — при переполнении апдейт отбрасывается сразу,
+# wait — вебхук ждёт места в очереди до UPDATE_QUEUE_WAIT секунд, потом отбрасывает
+UPDATE_QUEUE_POLICY = os.getenv("UPDATE_QUEUE_POLICY", "drop")
+UPDATE_QUEUE_WAIT = float(os.getenv("UPDATE_QUEUE_WAIT", 1))
+
+
+def update_user_id(update: Update):
+    """id пользователя, от которого пришёл апдейт, или None"""
+    try:
+        user = getattr(update.event, "from_user", None)
+    except Exception:
+        return None
+    return user.id if user else None
+
+
+class UpdateQueue:
+    """
+    Вебхук только кладёт апдейт в очередь и сразу отвечает Telegram,
+    обработку делают воркеры. Апдейты одного пользователя всегда попадают
+    к одному и тому же воркеру, поэтому обрабатываются строго по порядку.
+    Общая глубина очередей ограничена, лишнее отбрасывается и считается.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, workers: int = UPDATE_WORKERS,
+                 max_depth: int = UPDATE_QUEUE_DEPTH, policy: str = UPDATE_QUEUE_POLICY,
+                 wait: float = UPDATE_QUEUE_WAIT):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.policy = policy
+        self.wait = wait
+        per_worker = max(1, max_depth // workers)
+        self._queues = [asyncio.Queue(maxsize=per_worker) for _ in range(workers)]
+        self._tasks = []
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+
+    async def stop(self, timeout: float = 10):
+        """Дообрабатывает то, что уже в очереди, и останавливает воркеров"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Очередь не успела опустеть, осталось %d апдейтов", self.depth)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _queue_for(self, update: Update) -> asyncio.Queue:
+        key = update_user_id(update)
+        if key is None:
+            key = update.update_id
+        # не key % n: в кластере процесс получает только uid ≡ i (mod BOT_WORKERS)
+        # (cluster.py, shard_of), и простой остаток сложил бы их все в одну-две очереди
+        return self._queues[zlib.crc32(f"q{key}".encode()) % len(self._queues)]
+
+    async def submit(self, update: Update) -> bool:
+        """Ставит апдейт в очередь; False — очередь переполнена и апдейт отброшен"""
+        self.received += 1
+        queue = self._queue_for(update)
+        try:
+            if self.policy == "wait":
+                await asyncio.wait_for(queue.put(update), self.wait)
+            else:
+                queue.put_nowait(update)
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            self.dropped += 1
+            logger.warning("Очередь переполнена, апдейт %d отброшен", update.update_id)
+            return False
+        return True
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+                self.processed += 1
+            except Exception:
+                self.errors += 1
+                logger.exception("Ошибка обработки апдейта %d", update.update_id)
+            finally:
+                queue.task_done()
+
+    @property
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._queues),
+            "depth": self.depth,
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+    async def handle(self, request):
+        """aiohttp-хендлер вебхука: принять, поставить в очередь, сразу ответить 200"""
+        update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        await self.submit(update)
+        # на переполнение тоже 200: иначе Telegram начнёт повторять и нагрузка вырастет
+        return web.Response()
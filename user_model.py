@@ -0,0 +1,130 @@
+"""
+Модель пользователя в памяти.
+
+Вместо словаря с дюжиной строковых ключей — объекты со __slots__:
+профиль (UserProfile), счётчики текущего дня (DailyCounters) и история (UserHistory).
+В хранилище по-прежнему пишется плоский словарь прежнего вида (to_dict / from_dict),
+поэтому журнал, снимки и старые записи совместимы.
+"""
+import sys
+from datetime import date
+
+from history_store import UserHistory
+
+# поля профиля в порядке хранения и их значения по умолчанию
+PROFILE_FIELDS = {
+    "sex": None,
+    "weight": None,
+    "height": None,
+    "age": None,
+    "activity": 0,
+    "city": None,
+    "water_goal": 0,
+    "calorie_goal": 0,
+}
+# поля дня: ключ в хранилище -> атрибут DailyCounters
+DAILY_FIELDS = {
+    "logged_water": "water",
+    "logged_calories": "calories",
+    "burned_calories": "burned",
+}
+
+
+def _intern(value):
+    # город и пол повторяются у тысяч пользователей — храним одну копию строки
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class DailyCounters:
+    """Счётчики текущего дня; day — date.toordinal() или 0, если день ещё не начинался"""
+
+    __slots__ = ("day", "water", "calories", "burned")
+
+    def __init__(self, day: int = 0, water: float = 0, calories: float = 0, burned: float = 0):
+        self.day = day
+        self.water = water
+        self.calories = calories
+        self.burned = burned
+
+    def reset(self, day: int):
+        self.day = day
+        self.water = 0
+        self.calories = 0
+        self.burned = 0
+
+
+class UserProfile:
+    """
+    Пользователь: профиль, цели, счётчики дня, история и итоги периодов.
+    Запись всегда полная — поля, которых не было в хранилище, получают значения по умолчанию.
+    """
+
+    __slots__ = tuple(PROFILE_FIELDS) + ("today", "_history", "rollups", "remind_next", "foods", "extra")
+
+    def __init__(self, **profile):
+        for name, default in PROFILE_FIELDS.items():
+            setattr(self, name, _intern(profile.pop(name, default)))
+        if profile:
+            raise TypeError(f"Неизвестные поля профиля: {', '.join(profile)}")
+        self.today = DailyCounters(date.today().toordinal())
+        self._history = None    # UserHistory создаётся при первом обращении: у многих истории нет
+        self.rollups = None     # {ключ периода: корзина}, создаётся при первом закрытом дне
+        self.remind_next = None # когда проверить, не отстаёт ли по воде (unix-время); None — напоминания выключены
+        self.foods = None       # продукты, которые пользователь записывал (favorites.py)
+        self.extra = None       # ключи из хранилища, которых модель не знает — сохраняются как есть
+
+    @property
+    def history(self) -> UserHistory:
+        if self._history is None:
+            self._history = UserHistory()
+        return self._history
+
+    def set_profile(self, **profile):
+        for name, value in profile.items():
+            if name not in PROFILE_FIELDS:
+                raise TypeError(f"Неизвестное поле профиля: {name}")
+            setattr(self, name, _intern(value))
+
+    # =========================
+    # Сериализация
+    # =========================
+    def to_dict(self) -> dict:
+        """Плоский словарь для хранилища; вложенные объекты — новые, их можно отдавать в другой поток"""
+        data = {name: getattr(self, name) for name in PROFILE_FIELDS}
+        for key, attr in DAILY_FIELDS.items():
+            data[key] = getattr(self.today, attr)
+        data["last_update"] = str(date.fromordinal(self.today.day)) if self.today.day else None
+        data["history"] = (self._history or UserHistory()).to_dict()
+        if self.rollups:
+            # корзины не правятся на месте (см. rollups.add_day), хватает копии верхнего уровня
+            data["rollups"] = dict(self.rollups)
+        if self.remind_next is not None:
+            data["remind_next"] = self.remind_next
+        if self.foods:
+            # записи продуктов тоже заменяются целиком (favorites.remember)
+            data["foods"] = dict(self.foods)
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UserProfile":
+        data = dict(data)
+        user = cls.__new__(cls)
+        for name, default in PROFILE_FIELDS.items():
+            value = data.pop(name, default)
+            setattr(user, name, _intern(default if value is None and default is not None else value))
+        last_update = data.pop("last_update", None)
+        user.today = DailyCounters(
+            date.fromisoformat(last_update).toordinal() if last_update else 0,
+            *(data.pop(key, 0) or 0 for key in DAILY_FIELDS),
+        )
+        history = data.pop("history", None)
+        if history and not isinstance(history, UserHistory):
+            history = UserHistory.from_dict(history)
+        user._history = history if history else None
+        user.rollups = data.pop("rollups", None) or None
+        user.remind_next = data.pop("remind_next", None)
+        user.foods = data.pop("foods", None) or None
+        user.extra = data or None
+        return user
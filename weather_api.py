@@ -1,20 +1,113 @@
 import os
+import asyncio
+import logging
 import aiohttp
 from dotenv import load_dotenv
 
+from cache import TTLCache
+from resilience import Upstream
+import metrics
+
 load_dotenv()
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
+WEATHER_URL = os.getenv("OPENWEATHER_URL", "https://api.openweathermap.org/data/2.5/weather")
+WEATHER_API_TIMEOUT = float(os.getenv("WEATHER_API_TIMEOUT", 5))
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", 30 * 60))
+# дольше этого /set_profile погоду не ждёт; последнее известное значение годится ещё WEATHER_STALE_TTL
+WEATHER_API_BUDGET = float(os.getenv("WEATHER_API_BUDGET", 1.5))
+WEATHER_STALE_TTL = float(os.getenv("WEATHER_STALE_TTL", 6 * 3600))
+# при этой температуре норма воды не меняется: подставляется, только если погоды нет совсем
+DEFAULT_TEMPERATURE = 25
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_upstream = Upstream("get_temperature", budget=WEATHER_API_BUDGET,
+                     fresh_ttl=WEATHER_CACHE_TTL, stale_ttl=WEATHER_STALE_TTL)
+_unknown = TTLCache(maxsize=10000, ttl=WEATHER_CACHE_TTL)   # города, которых OpenWeather не знает
+
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=WEATHER_API_TIMEOUT, connect=3),
+            connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300),
+        )
+    return _session
+
 
-async def get_temperature(city: str) -> float:
-    url = "https://api.openweathermap.org/data/2.5/weather"
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def _fetch(city: str):
     params = {
         "q": city,
         "appid": OPENWEATHER_API_KEY,
         "units": "metric"
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params) as resp:
-            data = await resp.json()
-            if data.get("cod") != 200:
-                return 25  # дефолтная температура
-            return data["main"]["temp"]
+    async with get_session().get(WEATHER_URL, params=params) as resp:
+        if resp.status == 404:
+            # город не найден — это ответ, а не сбой API
+            return None
+        # 401, 429, 5xx — ошибка: её считает breaker в resilience.Upstream
+        # (не raise_for_status: в его тексте URL с appid попал бы в лог)
+        if resp.status >= 400:
+            raise RuntimeError(f"OpenWeather: HTTP {resp.status}")
+        data = await resp.json(content_type=None)
+    if str(data.get("cod")) == "404":
+        return None
+    if str(data.get("cod")) != "200":
+        raise RuntimeError(f"OpenWeather: {data.get('cod')} {data.get('message')}")
+    return data["main"]["temp"]
+
+
+async def get_temperature(city: str):
+    """Температура или None, если OpenWeather не ответил в бюджет и прошлых данных нет"""
+    with metrics.track("get_temperature"):
+        return await _lookup(city)
+
+
+def city_key(city: str) -> str:
+    return " ".join(city.lower().split())
+
+
+async def _lookup(city: str):
+    """Температура или None, если OpenWeather не ответил или не знает город"""
+    key = city_key(city)
+    if _unknown.get(key):
+        return None
+
+    async def fetch():
+        temp = await _fetch(city)
+        if temp is None:
+            _unknown.set(key, True)
+        return temp
+
+    # волна пользователей из одного города — один запрос к OpenWeather
+    return await _upstream.get(key, fetch)
+
+
+async def get_temperatures(cities, concurrency: int = 10) -> dict:
+    """
+    {город: температура} для пакетных задач: по одному запросу на город,
+    не больше concurrency одновременно. Города без ответа в результат не попадают
+    (подставлять DEFAULT_TEMPERATURE в пересчёт целей нельзя).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(city):
+        async with semaphore:
+            with metrics.track("get_temperature"):
+                return city, await _lookup(city)
+
+    results = await asyncio.gather(*(one(city) for city in cities))
+    return {city: temp for city, temp in results if temp is not None}
+
+
+def cache_stats() -> dict:
+    return _upstream.cache.stats()